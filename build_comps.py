@@ -6,13 +6,20 @@ Replaces the old assessor-based comps with fresh Redfin sold data.
 
 Usage:
   python3 build_comps.py
+  python3 build_comps.py --as-of 2026-01-31   # Pin the recency reference date
+  python3 build_comps.py --tiles              # Also write tiles/comps/ shards + manifest
   python3 listings_build.py   # Rebuild listings with updated neighborhood $/SF
 """
-import csv, json, re, os, sys
-from datetime import datetime
+import csv, re, os, sys
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file, TYPE_TO_ZONE
+from spatial_index import SpatialIndex
+from sale_dates import sale_day_number, build_date, DAYS_PER_MONTH
+from js_artifacts import write_js_vars
+from columnar import write_columnar
+from tile_utils import write_tiles
+from static_assets import publish_asset
 
 # Property type → numeric code (preserved alongside zone for comp weighting)
 PT_MAP = {
@@ -34,7 +41,9 @@ MIN_SQFT = 100        # Filter impossible sqft (data entry errors)
 MAX_PRICE = 50_000_000  # Filter commercial outliers
 MAX_PPSF = 5_000      # Filter impossible $/SF
 MIN_YEAR_BUILT = 1800  # Filter bogus year built
-CURRENT_YEAR = datetime.now().year
+BUILD_DATE = build_date()  # Recency reference day (--as-of YYYY-MM-DD, default today)
+BUILD_DAY = BUILD_DATE.toordinal()
+CURRENT_YEAR = BUILD_DATE.year
 
 # ── ARV Model config ──
 ARV_CONFIG = {
@@ -51,18 +60,11 @@ ARV_CONFIG = {
 
 # ── ARV Model functions ──
 
-def recency_weight(sale_date_str):
-    """Compute time-decay weight for a comp based on sale date."""
-    if not sale_date_str:
+def recency_weight(day_number):
+    """Compute time-decay weight for a comp from its sale day number (see sale_dates.py)."""
+    if day_number is None:
         return 0.5
-    try:
-        sale = datetime.strptime(sale_date_str, "%B-%d-%Y")  # Redfin: "January-15-2025"
-    except Exception:
-        try:
-            sale = datetime.strptime(sale_date_str, "%Y-%m-%d")
-        except Exception:
-            return 0.5
-    months_ago = (datetime.now() - sale).days / 30.44
+    months_ago = (BUILD_DAY - day_number) / DAYS_PER_MONTH
     if months_ago <= 6: return 1.0
     elif months_ago <= 12: return 0.85
     elif months_ago <= 18: return 0.65
@@ -72,36 +74,44 @@ def recency_weight(sale_date_str):
 
 
 def build_grid(comps):
-    """Build spatial grid index for fast neighbor lookups."""
+    """Build spatial index for fast neighbor lookups (point id = comp index)."""
+    return SpatialIndex([(c['lat'], c['lng']) for c in comps])
+
+
+def grid_cell(lat, lng):
+    """(row, col) of the cell_size grid cell containing (lat, lng)."""
     CELL = ARV_CONFIG["cell_size"]
-    grid = {}
-    for i, c in enumerate(comps):
-        key = (int(c['lat'] / CELL), int(c['lng'] / CELL))
-        if key not in grid:
-            grid[key] = []
-        grid[key].append(i)
-    return grid
+    return int(lat / CELL), int(lng / CELL)
+
+
+def in_cell_block(grid, indices, lat, lng, radius_cells):
+    """Keep the indices whose grid cell is within radius_cells of (lat, lng)'s cell."""
+    row, col = grid_cell(lat, lng)
+    out = []
+    for i in indices:
+        r, c = grid_cell(grid.lats[i], grid.lngs[i])
+        if abs(r - row) <= radius_cells and abs(c - col) <= radius_cells:
+            out.append(i)
+    return out
 
 
 def get_neighbors(grid, lat, lng, radius_cells=1):
-    """Get comp indices from adjacent grid cells."""
+    """Get comp indices from the (2·radius_cells+1)² grid cells around (lat, lng)'s cell.
+
+    The index is searched with a box of ±(radius_cells + 1) cells around the
+    point, which covers the whole block; hits are then kept by grid cell.
+    """
     CELL = ARV_CONFIG["cell_size"]
-    center_r = int(lat / CELL)
-    center_c = int(lng / CELL)
-    indices = []
-    for dr in range(-radius_cells, radius_cells + 1):
-        for dc in range(-radius_cells, radius_cells + 1):
-            key = (center_r + dr, center_c + dc)
-            if key in grid:
-                indices.extend(grid[key])
-    return indices
+    return in_cell_block(grid, grid.query_box(lat, lng, (radius_cells + 1) * CELL), lat, lng, radius_cells)
 
 
 def compute_neighborhood_medians(comps):
-    """Compute neighborhood median $/SF for each comp using spatial grid."""
+    """Compute neighborhood median $/SF for each comp using the spatial index."""
     grid = build_grid(comps)
+    CELL = ARV_CONFIG["cell_size"]
+    near = grid.query_box_batch([(c['lat'], c['lng']) for c in comps], 2 * CELL)  # radius_cells=1
     for i, c in enumerate(comps):
-        neighbor_idx = get_neighbors(grid, c['lat'], c['lng'], radius_cells=1)
+        neighbor_idx = in_cell_block(grid, near[i], c['lat'], c['lng'], 1)
         neighbor_ppsfs = [comps[j]['ppsf'] for j in neighbor_idx if j != i and comps[j]['ppsf'] > 0]
 
         # Expand to radius 2 if too few
@@ -365,6 +375,9 @@ with open(src, encoding="utf-8", errors="replace") as f:
                 "ppsf": ppsf,
                 "yb": year_built,
             }
+            dn = sale_day_number(sold_date)
+            if dn is not None:
+                rec["dn"] = dn  # Ordinal sale day — listings_build skips re-parsing "date"
             if pt:
                 rec["pt"] = pt
             if beds is not None:
@@ -411,10 +424,10 @@ print(f"  Unique zip codes: {len(zips)}")
 print(f"\n  ARV Model: Computing neighborhood medians...")
 compute_neighborhood_medians(comps)
 
-print(f"  ARV Model: Classifying condition tiers...")
+print(f"  ARV Model: Classifying condition tiers (recency as of {BUILD_DATE})...")
 for c in comps:
     c['t'] = classify_tier(c.get('yb'), c['ppsf'], c.get('_nbhd_median', c['ppsf']))
-    c['rw'] = round(recency_weight(c.get('date', '')), 2)
+    c['rw'] = round(recency_weight(c.get('dn')), 2)
     # T1 sub-tier classification
     if c['t'] == 1:
         yb = c.get('yb')
@@ -465,13 +478,20 @@ if sorted_clusters:
 
 # ── Write data.js ──
 output_file = market_file("data.js", market)
-suffix = f"_{market.upper()}" if market != "la" else ""
-js = f"var LOADED_COMPS{suffix} = " + json.dumps(comps, separators=(",", ":")) + ";\n"
-js += f"var CLUSTERS{suffix} = " + json.dumps(clusters, separators=(",", ":")) + ";"
-with open(output_file, "w") as f:
-    f.write(js)
+suffix = f"_{market['slug'].upper()}" if market["slug"] != "la" else ""
+js_vars = {f"LOADED_COMPS{suffix}": comps, f"CLUSTERS{suffix}": clusters}
+js = write_js_vars(output_file, js_vars)
+cols_dir = write_columnar(output_file, js_vars)  # Binary sidecar for listings_build (NumPy only)
+hashed_file = publish_asset(output_file)  # .gz/.br + content-hashed copy for om_server
 
 size_kb = len(js) / 1024
 print(f"\n  Written: {output_file} ({size_kb:.0f} KB, {len(comps):,} comps, {len(clusters)} clusters)")
+print(f"  Written: {hashed_file} (+ .gz{'/.br' if os.path.exists(hashed_file + '.br') else ''}, asset_manifest.json)")
+if cols_dir:
+    print(f"  Written: {cols_dir}/ (columnar sidecar)")
+if "--tiles" in sys.argv:
+    tiles_dir = os.path.join(market_file("tiles", market), "comps")
+    manifest = write_tiles(tiles_dir, comps, market, extra={"clusters": clusters})
+    print(f"  Written: {tiles_dir}/ ({len(manifest['tiles'])} tiles + clusters + manifest.json)")
 print(f"  Next: python3 listings_build.py")
 print(f"  Then refresh http://localhost:8080\n")
@@ -6,12 +6,16 @@ Converts rental_comps.csv into rental_data.js for the frontend rental comps tabl
 Usage:
   python3 build_rental_data.py              # LA (default)
   python3 build_rental_data.py --market sd  # San Diego
+  python3 build_rental_data.py --tiles      # Also write tiles/rentals/ shards + manifest
 """
-import csv, json, re, os, sys
+import csv, re, os, sys
 from datetime import datetime, timezone
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file
+from js_artifacts import write_js_vars
+from tile_utils import write_tiles
+from static_assets import publish_asset
 
 # Property type → compact code (matches build_comps.py PT_MAP)
 PT_MAP = {
@@ -163,10 +167,14 @@ for pt_code in sorted(pt_counts.keys()):
 
 # ── Write rental_data.js ──
 output_file = market_file("rental_data.js", market)
-js = "var LOADED_RENTAL_COMPS = " + json.dumps(comps, separators=(",", ":")) + ";"
-with open(output_file, "w") as f:
-    f.write(js)
+js = write_js_vars(output_file, {"LOADED_RENTAL_COMPS": comps})
+hashed_file = publish_asset(output_file)
+if "--tiles" in sys.argv:
+    tiles_dir = os.path.join(market_file("tiles", market), "rentals")
+    manifest = write_tiles(tiles_dir, comps, market)
+    print(f"  Written: {tiles_dir}/ ({len(manifest['tiles'])} tiles + manifest.json)")
 
 size_kb = len(js) / 1024
 print(f"\n  Written: {output_file} ({size_kb:.0f} KB, {len(comps):,} rental comps)")
+print(f"  Written: {hashed_file} (+ .gz{'/.br' if os.path.exists(hashed_file + '.br') else ''}, asset_manifest.json)")
 print(f"  Then refresh http://localhost:8080\n")
@@ -0,0 +1,256 @@
+"""
+columnar.py — Binary columnar sidecars for the large JS artifacts (NumPy .npy).
+
+Used by: build_comps.py (data.js → data.cols/), listings_build.py
+(listings.js → listings.cols/, reads data.cols/), fetch_zoning.py,
+fetch_rents.py, fetch_zhvi.py (read listings.cols/)
+
+Each record list ("var LOADED_COMPS = [{...}, ...]") is stored as one .npy
+file per key:
+  - int / float / bool columns as fixed-width arrays (smallest int dtype
+    that fits; NaN for missing floats)
+  - strings dictionary-encoded: int32 codes plus one UTF-8 blob and
+    offsets for the distinct values
+  - anything else (lists, dicts, mixed types) as dictionary-encoded JSON
+Each column also gets a uint8 state array when some records lack the key
+or hold null (0 = absent, 1 = null, 2 = value). Ints in a mixed int/float
+column read back as floats.
+
+manifest.json records the JS file's size and mtime at write time. Readers
+memory-map the arrays (np.load(mmap_mode="r")) only when that still
+matches the JS on disk; otherwise they fall back to parsing the JS
+(js_artifacts.load_js_var). NumPy is optional: without it no sidecar is
+written and every read takes the JS path.
+
+    write_columnar("data.js", {"LOADED_COMPS": comps, "CLUSTERS": clusters})
+    table = open_columnar("data.js", "LOADED_COMPS")   # None if missing/stale
+    table.column("lat")                    # mmap'd float64 array
+    table.values("zip")                    # list of str / None
+    load_records("listings.js", "LOADED_LISTINGS", columns=["lat", "lng", "zip"])
+"""
+import json, os, shutil
+
+from js_artifacts import load_js_var
+
+FORMAT = 1
+ABSENT, NULL, VALUE = 0, 1, 2
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def sidecar_dir(js_path):
+    """data.js → data.cols"""
+    return os.path.splitext(js_path)[0] + ".cols"
+
+
+def _source_stamp(js_path):
+    st = os.stat(js_path)
+    return {"file": os.path.basename(js_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _int_dtype(np, lo, hi):
+    for dt in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return dt
+    return np.int64
+
+
+def _write_strings(np, out_dir, stem, strings):
+    """Dictionary-encode strings (None allowed) → codes file + blob/offsets files."""
+    lookup = {}
+    codes = np.fromiter(
+        (-1 if s is None else lookup.setdefault(s, len(lookup)) for s in strings),
+        dtype=np.int32, count=len(strings),
+    )
+    encoded = [s.encode("utf-8") for s in lookup]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(out_dir, stem + ".npy"), codes)
+    np.save(os.path.join(out_dir, stem + ".dict.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(out_dir, stem + ".offsets.npy"), offsets)
+
+
+def _write_table(np, out_dir, table, records):
+    """Write one record list; returns its manifest entry."""
+    keys = {}
+    for r in records:
+        for k in r:
+            keys.setdefault(k, None)
+    columns = {}
+    for ci, key in enumerate(keys):
+        stem = f"{table}.{ci}"
+        values = [r.get(key) for r in records]
+        state = [ABSENT if key not in r else (NULL if r[key] is None else VALUE) for r in records]
+        present = [v for v in values if v is not None]
+        if not present:
+            kind = "null"
+        elif all(type(v) is bool for v in present):
+            kind = "bool"
+            np.save(os.path.join(out_dir, stem + ".npy"), np.array([bool(v) for v in values], dtype=bool))
+        elif all(type(v) is int for v in present) and -2**63 <= min(present) and max(present) < 2**63:
+            kind = "int"
+            dt = _int_dtype(np, min(present), max(present))
+            np.save(os.path.join(out_dir, stem + ".npy"), np.array([0 if v is None else v for v in values], dtype=dt))
+        elif all(type(v) in (int, float) for v in present):
+            kind = "float"
+            np.save(os.path.join(out_dir, stem + ".npy"),
+                    np.array([float("nan") if v is None else v for v in values], dtype=np.float64))
+        elif all(type(v) is str for v in present):
+            kind = "str"
+            _write_strings(np, out_dir, stem, values)
+        else:
+            kind = "json"
+            _write_strings(np, out_dir, stem, [None if v is None else json.dumps(v, separators=(",", ":")) for v in values])
+        col = {"kind": kind, "file": stem}
+        if any(s != VALUE for s in state):
+            np.save(os.path.join(out_dir, stem + ".state.npy"), np.array(state, dtype=np.uint8))
+            col["state"] = True
+        columns[key] = col
+    return {"rows": len(records), "columns": columns}
+
+
+def write_columnar(js_path, tables):
+    """Write the columnar sidecar for {NAME: records} next to js_path (call after writing it).
+
+    Returns the sidecar directory, or None when NumPy is unavailable.
+    """
+    np = _numpy()
+    if np is None:
+        return None
+    out_dir = sidecar_dir(js_path)
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    manifest = {"format": FORMAT, "source": _source_stamp(js_path), "tables": {}}
+    for name, records in tables.items():
+        manifest["tables"][name] = _write_table(np, tmp_dir, name, records)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+class ColumnarTable:
+    """Read-only view of one record list in a columnar sidecar (arrays are mmap'd)."""
+
+    def __init__(self, np, directory, meta):
+        self._np = np
+        self._dir = directory
+        self._columns = meta["columns"]
+        self.rows = meta["rows"]
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def names(self):
+        return list(self._columns)
+
+    def _load(self, stem, suffix=""):
+        return self._np.load(os.path.join(self._dir, stem + suffix + ".npy"), mmap_mode="r")
+
+    def column(self, name):
+        """Raw array for a column: numbers/bools as stored, string kinds as int32 codes (-1 = null)."""
+        col = self._columns[name]
+        if col["kind"] == "null":
+            return self._np.full(self.rows, self._np.nan)
+        return self._load(col["file"])
+
+    def state(self, name):
+        """uint8 state per row (0 absent, 1 null, 2 value)."""
+        col = self._columns.get(name)
+        if col is None:
+            return self._np.zeros(self.rows, dtype=self._np.uint8)
+        if col.get("state"):
+            return self._load(col["file"], ".state")
+        return self._np.full(self.rows, VALUE, dtype=self._np.uint8)
+
+    def dictionary(self, name):
+        """Distinct values of a string (or JSON) column, indexed by code."""
+        col = self._columns[name]
+        blob = self._load(col["file"], ".dict").tobytes()
+        offsets = self._load(col["file"], ".offsets").tolist()
+        values = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        if col["kind"] == "json":
+            values = [json.loads(v) for v in values]
+        return values
+
+    def values(self, name):
+        """Column as a list of Python values (None where absent or null)."""
+        col = self._columns.get(name)
+        if col is None or col["kind"] == "null":
+            return [None] * self.rows
+        kind = col["kind"]
+        if kind in ("str", "json"):
+            lookup = self.dictionary(name)
+            vals = [None if c < 0 else lookup[c] for c in self.column(name).tolist()]
+        else:
+            vals = self.column(name).tolist()
+        if col.get("state"):
+            vals = [v if s == VALUE else None for v, s in zip(vals, self.state(name).tolist())]
+        return vals
+
+    def records(self, columns=None):
+        """Materialize rows as dicts (absent keys omitted), optionally only some columns."""
+        names = [c for c in (self.names if columns is None else columns) if c in self._columns]
+        dense = [n for n in names if not self._columns[n].get("state")]
+        if dense:
+            out = [dict(zip(dense, row)) for row in zip(*(self.values(n) for n in dense))]
+        else:
+            out = [{} for _ in range(self.rows)]
+        for name in names:
+            if name in dense:
+                continue
+            for r, v, s in zip(out, self.values(name), self.state(name).tolist()):
+                if s != ABSENT:
+                    r[name] = v
+        if dense and len(dense) != len(names):
+            out = [{n: r[n] for n in names if n in r} for r in out]  # Restore column order
+        return out
+
+
+def open_columnar(js_path, name):
+    """ColumnarTable for NAME if a sidecar matching js_path exists (and NumPy is installed), else None."""
+    np = _numpy()
+    manifest_path = os.path.join(sidecar_dir(js_path), "manifest.json")
+    if np is None or not os.path.exists(manifest_path) or not os.path.exists(js_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    source = _source_stamp(js_path)
+    if manifest.get("format") != FORMAT or manifest.get("source") != source:
+        return None  # Stale: the JS was rewritten without the sidecar
+    tables = manifest.get("tables", {})
+    meta = tables.get(name)
+    if meta is None:
+        # Market-suffixed declaration (LOADED_COMPS_SD), as js_artifacts.load_js_var allows
+        meta = next((m for t, m in tables.items() if t.startswith(name + "_") and t[len(name) + 1:].isupper()), None)
+    if meta is None:
+        return None
+    return ColumnarTable(np, sidecar_dir(js_path), meta)
+
+
+def load_records(js_path, name, columns=None):
+    """Record list NAME from the columnar sidecar when fresh, else from the JS.
+
+    columns: optional list of keys to keep (the sidecar only reads those).
+    Returns None if the JS does not declare NAME.
+    """
+    table = open_columnar(js_path, name)
+    if table is not None:
+        return table.records(columns)
+    records = load_js_var(js_path, name)
+    if records is None or columns is None:
+        return records
+    return [{k: r[k] for k in columns if k in r} for r in records]
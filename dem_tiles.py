@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+dem_tiles.py — Local USGS 3DEP DEM tiles for offline slope / elevation metrics.
+
+Used by: fetch_slopes.py --dem, fetch_elevation.py --dem
+
+Download (one-time, resumable): the market bbox is cut into TILE_DEG tiles.
+Each tile is exported from the 3DEP ImageServer as a float32 GeoTIFF in
+EPSG:4326, converted to .npy and saved under DEM_DIR. Existing tiles are
+skipped, so an interrupted or failed run just resumes. Each tile carries
+a one-pixel margin, so bilinear sampling never has to cross into the
+neighboring tile.
+
+Sampling: DemSampler opens tiles with np.load(mmap_mode="r"), so only the
+pixels a lookup touches are read. sample(lat, lng) returns meters
+(bilinear), or None when the tile is missing or the cell is no-data.
+
+    dem = DemSampler()                     # exits with a hint if dem_tiles/ is empty
+    meters = dem.sample(lat, lng)
+    dem.resolves(spacing_m)                → False if points that close are < MIN_PIXELS apart
+    dem.src                                → "dem10m" — tags results computed from these tiles
+
+Results computed from the DEM carry "src": dem.src in the fetchers' caches.
+Bilinear samples at ~10 m smooth out slope that 1 m EPQS samples show, so a
+later EPQS run treats DEM-tagged entries as not cached and replaces them.
+
+Usage:
+  python3 dem_tiles.py                    # LA bbox at DEM_RES_M (~10 m)
+  python3 dem_tiles.py --market sd        # SD bbox
+  python3 dem_tiles.py --res 3            # ~3 m pixels (only into an empty DEM_DIR)
+
+Requires: numpy, and tifffile or rasterio to read the exported GeoTIFFs
+  pip3 install tifffile
+"""
+import asyncio, io, json, math, os, sys, time
+
+DEM_DIR = "dem_tiles"
+TILE_DEG = 0.05        # Tile edge (~5 km)
+DEM_RES_M = 10         # Default pixel size in meters (3DEP 1/3 arc-second)
+METERS_PER_DEG = 111320
+NODATA = -9999.0
+MIN_PIXELS = 2         # Sample points closer than this many DEM pixels can't resolve a slope
+MAX_WORKERS = 4
+
+
+def tile_of(lat, lng):
+    return math.floor(lng / TILE_DEG), math.floor(lat / TILE_DEG)
+
+
+def tile_path(tx, ty, dem_dir=DEM_DIR):
+    return os.path.join(dem_dir, f"{tx}_{ty}.npy")
+
+
+def read_geotiff(content):
+    """First band of a GeoTIFF as a float32 array (tifffile, else rasterio)."""
+    import numpy as np
+    try:
+        import tifffile
+        return np.asarray(tifffile.imread(io.BytesIO(content)), dtype=np.float32)
+    except ImportError:
+        pass
+    try:
+        from rasterio.io import MemoryFile
+    except ImportError:
+        print("\n  Reading DEM tiles needs tifffile or rasterio. Install: pip3 install tifffile\n")
+        sys.exit(1)
+    with MemoryFile(content) as mem, mem.open() as src:
+        return src.read(1).astype(np.float32)
+
+
+class DemSampler:
+    """Bilinear elevation (meters) from the .npy tiles in dem_dir, memory-mapped on first use."""
+
+    def __init__(self, dem_dir=DEM_DIR):
+        meta_file = os.path.join(dem_dir, "meta.json")
+        if not os.path.exists(meta_file):
+            print(f"\n  ❌ No DEM tiles in {dem_dir}/ — run: python3 dem_tiles.py first\n")
+            sys.exit(1)
+        with open(meta_file) as f:
+            meta = json.load(f)
+        self.dem_dir = dem_dir
+        self.tile_px = meta["tile_px"]
+        self.res_m = meta["res_m"]
+        self.src = f"dem{self.res_m:g}m"
+        self.res = TILE_DEG / self.tile_px
+        self._tiles = {}
+        self.stats = {"samples": 0, "missing": 0}
+
+    def resolves(self, spacing_m):
+        """Whether sample points spacing_m apart are at least MIN_PIXELS DEM pixels apart."""
+        return spacing_m >= MIN_PIXELS * self.res_m
+
+    def _tile(self, tx, ty):
+        if (tx, ty) not in self._tiles:
+            import numpy as np
+            path = tile_path(tx, ty, self.dem_dir)
+            self._tiles[(tx, ty)] = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+        return self._tiles[(tx, ty)]
+
+    def sample(self, lat, lng):
+        tx, ty = tile_of(lat, lng)
+        grid = self._tile(tx, ty)
+        self.stats["samples"] += 1
+        if grid is None:
+            self.stats["missing"] += 1
+            return None
+        # Pixel-center coordinates; row 0 is the north margin row
+        fx = (lng - (tx * TILE_DEG - self.res)) / self.res - 0.5
+        fy = ((ty + 1) * TILE_DEG + self.res - lat) / self.res - 0.5
+        j = min(max(int(fx), 0), self.tile_px)
+        i = min(max(int(fy), 0), self.tile_px)
+        wx, wy = fx - j, fy - i
+        z00, z01 = float(grid[i, j]), float(grid[i, j + 1])
+        z10, z11 = float(grid[i + 1, j]), float(grid[i + 1, j + 1])
+        if min(z00, z01, z10, z11) <= NODATA + 1:
+            return None
+        return (z00 * (1 - wx) + z01 * wx) * (1 - wy) + (z10 * (1 - wx) + z11 * wx) * wy
+
+
+def market_tiles(market):
+    """All (tx, ty) tiles covering the market bbox."""
+    tx0, ty0 = tile_of(market["lat_min"], market["lng_min"])
+    tx1, ty1 = tile_of(market["lat_max"], market["lng_max"])
+    return [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+
+async def download_tiles(tiles, tile_px, dem_dir=DEM_DIR):
+    """Export and save missing tiles. Returns (saved, failed)."""
+    import numpy as np
+    from http_client import AsyncClient, bounded_as_completed
+    from market_config import USGS_3DEP_EXPORT_URL
+
+    res = TILE_DEG / tile_px
+
+    def fetch(tile):
+        tx, ty = tile
+        return client.get_bytes(USGS_3DEP_EXPORT_URL, params={
+            "bbox": f"{tx * TILE_DEG - res},{ty * TILE_DEG - res},{(tx + 1) * TILE_DEG + res},{(ty + 1) * TILE_DEG + res}",
+            "bboxSR": 4326, "imageSR": 4326,
+            "size": f"{tile_px + 2},{tile_px + 2}",
+            "format": "tiff", "pixelType": "F32", "noData": NODATA,
+            "interpolation": "RSP_BilinearInterpolation",
+            "f": "image",
+        }, timeout=180)
+
+    saved = failed = 0
+    start = time.time()
+    client = AsyncClient(concurrency=MAX_WORKERS, retries=3)
+    try:
+        async for (tx, ty), content in bounded_as_completed(tiles, fetch, limit=MAX_WORKERS * 2):
+            grid = read_geotiff(content) if content else None
+            if grid is None or grid.shape != (tile_px + 2, tile_px + 2):
+                failed += 1
+            else:
+                path = tile_path(tx, ty, dem_dir)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, grid)
+                os.replace(path + ".tmp", path)
+                saved += 1
+            done = saved + failed
+            if done % 10 == 0 or done == len(tiles):
+                sys.stdout.write(f"\r  [{done:>4}/{len(tiles)}] {saved} saved | {failed} failed | "
+                                 f"{time.time() - start:.0f}s   ")
+                sys.stdout.flush()
+    finally:
+        client.close()
+    print()
+    client.report()
+    return saved, failed
+
+
+def main():
+    from market_config import get_market
+    market = get_market()
+    res_m = DEM_RES_M
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg == "--res":
+            res_m = float(sys.argv[i + 1])
+    tile_px = round(TILE_DEG * METERS_PER_DEG / res_m)
+
+    os.makedirs(DEM_DIR, exist_ok=True)
+    meta_file = os.path.join(DEM_DIR, "meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta["tile_px"] != tile_px:
+            print(f"  ❌ {DEM_DIR}/ holds {meta['tile_px']} px tiles (~{meta['res_m']} m); "
+                  f"move it aside to download at {res_m} m")
+            sys.exit(1)
+    else:
+        with open(meta_file, "w") as f:
+            json.dump({"tile_deg": TILE_DEG, "tile_px": tile_px, "res_m": res_m}, f)
+
+    tiles = market_tiles(market)
+    todo = [t for t in tiles if not os.path.exists(tile_path(*t))]
+    mb = len(todo) * (tile_px + 2) ** 2 * 4 / 1e6
+    print(f"  {market['name']} DEM: {len(tiles)} tiles of {TILE_DEG}° at ~{res_m} m ({tile_px} px)")
+    print(f"  Already downloaded: {len(tiles) - len(todo)} | To fetch: {len(todo)} (~{mb:,.0f} MB)")
+    if not todo:
+        return
+    saved, failed = asyncio.run(download_tiles(todo, tile_px))
+    print(f"  Done: {saved} saved, {failed} failed" + (" — rerun to retry" if failed else ""))
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,116 @@
+"""
+elevation_cache.py — Shared point-elevation cache for the USGS EPQS fetchers (SQLite).
+
+Used by: fetch_slopes.py (5 points per listing), fetch_elevation.py (3×3 grid)
+
+Samples are keyed by a ~1 m cell: lat/lng rounded to CELL_DEG (1e-5°,
+~1.1 m N/S, ~0.9 m E/W in SoCal). A miss queries EPQS at the cell center,
+so a cell's value doesn't depend on which listing fetched it first. Every
+point in the cell then reuses that value. Values are stored in meters.
+Callers convert (elevation_ft); EPQS no-data values are stored as returned.
+Concurrent requests for the same cell share one EPQS call.
+
+    cache = ElevationCache()                     # elevation_samples.sqlite
+    meters = await cache.sample(client, lat, lng)  # None if EPQS failed
+    cache.close(); cache.report()
+"""
+import asyncio, sqlite3
+
+from market_config import USGS_EPQS_URL
+
+CELL_DEG = 0.00001
+FEET_PER_METER = 3.28084
+COMMIT_EVERY = 500   # New samples per SQLite commit (and on close)
+CACHE_FILE = "elevation_samples.sqlite"
+
+
+def elevation_ft(meters):
+    return None if meters is None else meters * FEET_PER_METER
+
+
+class ElevationCache:
+    """Quantized EPQS samples. Use from one event loop (not thread-safe)."""
+
+    def __init__(self, path=CACHE_FILE, enabled=True):
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "shared": 0, "failed": 0}
+        self._values = {}
+        self._pending = {}
+        self._unsaved = 0
+        self._db = None
+        if enabled:
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS samples (qlat INTEGER, qlng INTEGER, meters REAL, "
+                             "PRIMARY KEY (qlat, qlng)) WITHOUT ROWID")
+
+    @staticmethod
+    def cell(lat, lng):
+        return round(lat / CELL_DEG), round(lng / CELL_DEG)
+
+    def get(self, lat, lng):
+        """Cached meters for the cell containing (lat, lng), or None."""
+        key = self.cell(lat, lng)
+        if key in self._values:
+            return self._values[key]
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT meters FROM samples WHERE qlat = ? AND qlng = ?", key).fetchone()
+        if row:
+            self._values[key] = row[0]
+            return row[0]
+        return None
+
+    def put(self, lat, lng, meters):
+        key = self.cell(lat, lng)
+        self._values[key] = meters
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?)", (*key, meters))
+            self._unsaved += 1
+            if self._unsaved >= COMMIT_EVERY:
+                self._db.commit()
+                self._unsaved = 0
+
+    async def _query(self, client, key):
+        data = await client.get_json(USGS_EPQS_URL, params={
+            "x": key[1] * CELL_DEG, "y": key[0] * CELL_DEG,
+            "wkid": 4326, "units": "Meters",
+            "includeDate": "false"
+        }, timeout=15)
+        val = data.get("value") if data else None
+        return float(val) if val is not None else None
+
+    async def sample(self, client, lat, lng):
+        """Elevation in meters at (lat, lng), from cache or one EPQS query at the cell center."""
+        cached = self.get(lat, lng)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+        key = self.cell(lat, lng)
+        if key in self._pending:
+            self.stats["shared"] += 1
+            return await self._pending[key]
+        self.stats["misses"] += 1
+        fut = self._pending[key] = asyncio.ensure_future(self._query(client, key))
+        try:
+            meters = await fut
+        finally:
+            del self._pending[key]
+        if meters is None:
+            self.stats["failed"] += 1
+        else:
+            self.put(lat, lng, meters)
+        return meters
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def report(self):
+        s = self.stats
+        total = s["hits"] + s["misses"] + s["shared"]
+        reused = s["hits"] + s["shared"]
+        print(f"  Elevation samples: {reused:,}/{total:,} reused ({s['hits']:,} cached, {s['shared']:,} shared) | "
+              f"{s['misses']:,} EPQS queries | {s['failed']} failed")
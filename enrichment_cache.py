@@ -0,0 +1,111 @@
+"""
+enrichment_cache.py — On-disk cache of per-listing enrichment results.
+
+Used by: listings_build.py (Step 4 exit $/SF, Step 4d rental estimates)
+
+A result is reused when nothing that can affect it has changed. The cache
+key for a listing hashes three things:
+  - the listing fields the step reads (lat/lng, zip, ...)
+  - the fingerprints of every source-data grid cell the step's search box
+    touches (CellFingerprints)
+  - the step's model version string (constants, build year, ...)
+
+A comp added, removed or edited near a listing changes its key. A change
+across town leaves the key alone. Only listings whose keys are new get
+recomputed. The cache file keeps just the keys used by the latest build,
+so it never grows past one entry per listing per step.
+"""
+import hashlib, json, math, os
+
+CACHE_FORMAT = 1
+CELL_DEG = 0.02  # Fingerprint grid cell (~1.4 mi); search boxes span a few cells
+
+
+def digest(*parts):
+    """Short stable hash of the repr() of parts."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+class CellFingerprints:
+    """Per-grid-cell hashes of a point dataset, for keying nearby results.
+
+    fp = CellFingerprints([(lat, lng, payload), ...])
+    fp.around(lat, lng, half_lat, half_lng) → hash of every cell the box touches
+    """
+
+    def __init__(self, items, cell=CELL_DEG):
+        self.cell = cell
+        hashes = {}
+        for lat, lng, payload in items:
+            key = (math.floor(lat / cell), math.floor(lng / cell))
+            h = hashes.get(key)
+            if h is None:
+                h = hashes[key] = hashlib.sha1()
+            h.update(repr(payload).encode())
+        self.cells = {k: h.hexdigest()[:12] for k, h in hashes.items()}
+
+    def around(self, lat, lng, half_lat, half_lng=None):
+        """Combined fingerprint of the cells overlapping lat/lng ± half-widths (degrees)."""
+        if half_lng is None:
+            half_lng = half_lat
+        c = self.cell
+        r0, r1 = math.floor((lat - half_lat) / c), math.floor((lat + half_lat) / c)
+        c0, c1 = math.floor((lng - half_lng) / c), math.floor((lng + half_lng) / c)
+        cells = self.cells
+        return "".join(cells.get((r, q), "-") for r in range(r0, r1 + 1) for q in range(c0, c1 + 1))
+
+
+class EnrichmentCache:
+    """JSON-backed {section: {key: result}} store.
+
+    cache = EnrichmentCache("enrich_cache.json")
+    results = cache.map("exit", items, keys, compute)   # compute(dirty items) → results
+    cache.save()
+    """
+
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.sections = {}
+        self.used = {}
+        self.stats = {}  # section → (hits, misses)
+        if enabled and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("format") == CACHE_FORMAT:
+                    self.sections = data.get("sections", {})
+            except (OSError, ValueError):
+                self.sections = {}
+
+    def map(self, section, items, keys, compute):
+        """Results for items in order: cached where the key matches, compute(misses) otherwise."""
+        if not self.enabled:
+            self.stats[section] = (0, len(items))
+            return compute(items)
+        old = self.sections.get(section, {})
+        results = [None] * len(items)
+        dirty = []
+        for i, k in enumerate(keys):
+            if k in old:
+                results[i] = old[k]
+            else:
+                dirty.append(i)
+        if dirty:
+            fresh = compute([items[i] for i in dirty])
+            for i, r in zip(dirty, fresh):
+                results[i] = r
+        self.used[section] = dict(zip(keys, results))
+        self.stats[section] = (len(items) - len(dirty), len(dirty))
+        return results
+
+    def save(self):
+        """Write the entries used this run (atomic replace). No-op when disabled."""
+        if not self.enabled or not self.used:
+            return
+        sections = dict(self.sections)
+        sections.update(self.used)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"format": CACHE_FORMAT, "sections": sections}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
@@ -10,9 +10,28 @@ then computes slope variation metrics:
   - flatPct: % of adjacent pairs below 10% slope
   - slopeScore: composite 0-100 (higher = worse for development)
 
-Uses USGS Elevation Point Query Service (1m LiDAR, free, no API key).
-
-Saves to elevation_cache.json — keyed by "lat,lng" → metrics dict.
+Uses USGS Elevation Point Query Service (1m LiDAR, free, no API key),
+through the shared asyncio client (http_client.py): pooled keep-alive
+session, MAX_WORKERS requests in flight, EPQS_RATE requests/sec, unified
+429/503 backoff. Points are fetched through the ~1 m elevation cache shared
+with fetch_slopes.py (elevation_cache.py).
+
+Sampling is adaptive: the 4 corners + center are fetched first. If they
+show a flat lot (range ≤ ADAPTIVE_RANGE_FT and every slope ≤
+ADAPTIVE_SLOPE_PCT), the edge midpoints are interpolated from their corners
+(exact for a planar lot) and metrics come from that grid. Otherwise the 4
+edge midpoints are fetched. --full-grid always samples all 9.
+
+--dem computes the same 3×3 metrics offline from local USGS 3DEP tiles
+(dem_tiles.py), with no network calls. That makes EPQS downtime irrelevant.
+DEM metrics carry "src": "dem10m" (the tile resolution), and a later run
+without --dem recomputes them from EPQS. Lots whose grid points are closer
+than dem_tiles.MIN_PIXELS pixels are skipped (left for EPQS), because
+bilinear sampling would flatten their slope.
+
+Saves to elevation_cache.json — keyed by "lat,lng" → metrics dict. Results
+go to elevation_cache.json.sqlite as they arrive (result_store.py);
+checkpoints are commits and the JSON is exported once at the end.
 Supports incremental runs (skips already-computed listings).
 
 Usage:
@@ -21,20 +40,28 @@ Usage:
   python3 fetch_elevation.py --limit 100     # First 100 only
   python3 fetch_elevation.py --force         # Recompute all (ignore cache)
   python3 fetch_elevation.py --market sd     # San Diego market
+  python3 fetch_elevation.py --no-cache      # Bypass the shared elevation sample cache
+  python3 fetch_elevation.py --dem           # Offline from dem_tiles/ (run dem_tiles.py first)
+  python3 fetch_elevation.py --full-grid     # Always sample all 9 points
 """
 
-import csv, json, math, os, re, sys, time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
+import asyncio, csv, math, os, re, sys, time
+from collections import Counter
+from urllib.parse import urlsplit
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file, USGS_EPQS_URL
+from http_client import AsyncClient, bounded_as_completed
+from elevation_cache import ElevationCache, elevation_ft
+from result_store import ResultStore
 
 # ── Config ──
 MAX_WORKERS = 8
-REQUEST_DELAY = 0.3  # seconds between EPQS requests within each worker
+EPQS_RATE = 20       # EPQS requests/sec across all workers (was 8 workers × 0.3 s delay)
 GRID_N = 3           # 3×3 grid = 9 sample points
 GRID_SCALE = 0.90    # sample at 90% of half-width (stay inside parcel edges)
+ADAPTIVE_RANGE_FT = 3.0   # Corners + center this flat (range, ft) ...
+ADAPTIVE_SLOPE_PCT = 5.0  # ... and no corner-center slope above this → skip the edge midpoints
 
 # Conversion constants
 FEET_PER_METER = 3.28084
@@ -42,14 +69,19 @@ DEG_LAT_PER_FOOT = 1.0 / (364000)   # ~1 degree lat ≈ 364,000 ft
 DEG_LNG_PER_FOOT = 1.0 / (288000)   # ~1 degree lng ≈ 288,000 ft at 34°N
 
 
+def grid_spacing_ft(lot_sf):
+    """Distance between adjacent sample points of a lot's grid (feet)."""
+    side_ft = math.sqrt(lot_sf) if lot_sf and lot_sf > 0 else 100
+    return side_ft / 2.0 * GRID_SCALE
+
+
 def generate_sample_grid(lat, lng, lot_sf, n=3):
     """Generate n×n grid of sample points scaled to parcel size.
 
     Estimates parcel side length from sqrt(lotSf), converts to lat/lng offsets,
     and generates grid at GRID_SCALE of half-width from center.
     """
-    side_ft = math.sqrt(lot_sf) if lot_sf and lot_sf > 0 else 100
-    half_ft = side_ft / 2.0 * GRID_SCALE
+    half_ft = grid_spacing_ft(lot_sf)
 
     lat_offset = half_ft * DEG_LAT_PER_FOOT
     lng_offset = half_ft * DEG_LNG_PER_FOOT
@@ -66,28 +98,11 @@ def generate_sample_grid(lat, lng, lot_sf, n=3):
     return points
 
 
-def fetch_elevation(lat, lng, retries=2):
-    """Fetch elevation in feet from USGS EPQS (1m LiDAR)."""
-    for attempt in range(retries + 1):
-        try:
-            resp = requests.get(USGS_EPQS_URL, params={
-                "x": lng, "y": lat,
-                "wkid": 4326, "units": "Feet",
-                "includeDate": "false"
-            }, timeout=15)
-            if resp.status_code == 200:
-                data = resp.json()
-                val = data.get("value")
-                if val is not None:
-                    fval = float(val)
-                    if fval > -100:  # Sanity check — not ocean/error
-                        return fval
-            elif resp.status_code in (429, 503):
-                time.sleep(5 + attempt * 5)
-                continue
-        except Exception:
-            if attempt < retries:
-                time.sleep(2)
+async def fetch_elevation(client, cache, lat, lng):
+    """Elevation in feet from USGS EPQS (1m LiDAR), via the shared sample cache."""
+    fval = elevation_ft(await cache.sample(client, lat, lng))
+    if fval is not None and fval > -100:  # Sanity check — not ocean/error
+        return fval
     return None
 
 
@@ -171,22 +186,52 @@ def compute_slope_metrics(points_with_elev):
     }
 
 
-def process_listing(lat, lng, lot_sf):
-    """Generate grid, fetch all 9 elevations, compute metrics."""
-    points = generate_sample_grid(lat, lng, lot_sf, GRID_N)
-    points_with_elev = []
-    consecutive_failures = 0
+def is_coarse_point(row, col, n=GRID_N):
+    """Corners + center: the first pass of adaptive sampling."""
+    return (row in (0, n - 1) and col in (0, n - 1)) or (row == col == n // 2)
+
 
+def interpolate_edges(points, coarse_with_elev):
+    """Coarse samples + edge midpoints interpolated from the two corners beside them."""
+    elev = {(row, col): e for _, _, row, col, e in coarse_with_elev}
+    out = list(coarse_with_elev)
     for plat, plng, row, col in points:
-        elev = fetch_elevation(plat, plng)
-        if elev is not None:
-            points_with_elev.append((plat, plng, row, col, elev))
-            consecutive_failures = 0
-        else:
-            consecutive_failures += 1
-            if consecutive_failures >= 5:
-                return None  # USGS likely down
-        time.sleep(REQUEST_DELAY)
+        if (row, col) in elev:
+            continue
+        ends = [(row, col - 1), (row, col + 1)] if row in (0, GRID_N - 1) else [(row - 1, col), (row + 1, col)]
+        out.append((plat, plng, row, col, sum(elev[rc] for rc in ends) / 2))
+    return out
+
+
+async def fetch_points(client, cache, points):
+    """[(lat, lng, row, col, elev)] for the points whose elevation came back."""
+    elevs = await asyncio.gather(*(fetch_elevation(client, cache, plat, plng) for plat, plng, _, _ in points))
+    return [(plat, plng, row, col, elev)
+            for (plat, plng, row, col), elev in zip(points, elevs) if elev is not None]
+
+
+async def process_listing(client, cache, lat, lng, lot_sf, adaptive=True, sampling=None):
+    """Generate grid, fetch elevations (adaptively), compute metrics.
+
+    sampling: optional Counter of "coarse" / "refined" / "full" listings.
+    """
+    points = generate_sample_grid(lat, lng, lot_sf, GRID_N)
+    if adaptive:
+        coarse = [p for p in points if is_coarse_point(p[2], p[3])]
+        points_with_elev = await fetch_points(client, cache, coarse)
+        if len(points_with_elev) == len(coarse):
+            metrics = compute_slope_metrics(points_with_elev)
+            if metrics and metrics["elevRange"] <= ADAPTIVE_RANGE_FT and metrics["maxSlope"] <= ADAPTIVE_SLOPE_PCT:
+                if sampling is not None:
+                    sampling["coarse"] += 1
+                return compute_slope_metrics(interpolate_edges(points, points_with_elev))
+        points_with_elev += await fetch_points(client, cache, [p for p in points if not is_coarse_point(p[2], p[3])])
+        kind = "refined"
+    else:
+        points_with_elev = await fetch_points(client, cache, points)
+        kind = "full"
+    if sampling is not None:
+        sampling[kind] += 1
 
     if len(points_with_elev) < 4:
         return None  # Not enough points for meaningful analysis
@@ -194,10 +239,121 @@ def process_listing(lat, lng, lot_sf):
     return compute_slope_metrics(points_with_elev)
 
 
+def process_listing_dem(dem, lat, lng, lot_sf):
+    """process_listing from local DEM tiles (metrics tagged with dem.src)."""
+    points_with_elev = []
+    for plat, plng, row, col in generate_sample_grid(lat, lng, lot_sf, GRID_N):
+        elev = elevation_ft(dem.sample(plat, plng))
+        if elev is not None and elev > -100:
+            points_with_elev.append((plat, plng, row, col, elev))
+    if len(points_with_elev) < 4:
+        return None
+    metrics = compute_slope_metrics(points_with_elev)
+    if metrics is not None:
+        metrics["src"] = dem.src
+    return metrics
+
+
+def compute_all_dem(work, results, dem):
+    """compute_all from local DEM tiles (--dem); returns the error count."""
+    from dem_tiles import MIN_PIXELS
+    errors = 0
+    too_fine = 0
+    start = time.time()
+    for lat, lng, lot_sf, key in work:
+        if not dem.resolves(grid_spacing_ft(lot_sf) / FEET_PER_METER):
+            too_fine += 1
+            continue
+        metrics = process_listing_dem(dem, lat, lng, lot_sf)
+        if metrics is not None:
+            results[key] = metrics
+        else:
+            errors += 1
+    elapsed = time.time() - start
+    print(f"  DEM: {len(work):,} listings in {elapsed:.1f}s ({len(work) / max(elapsed, 1e-9):,.0f}/s) | "
+          f"{dem.stats['missing']:,} samples outside downloaded tiles")
+    if too_fine:
+        print(f"  ⚠️  {too_fine:,} lots skipped: grid points under {dem.res_m * MIN_PIXELS:g} m apart "
+              f"({MIN_PIXELS} px of ~{dem.res_m:g} m DEM) — run without --dem, or download finer tiles "
+              f"(python3 dem_tiles.py --res 3)")
+    return errors
+
+
+async def compute_all(work, results):
+    """Compute metrics for work [(lat, lng, lot_sf, key)] into results; returns the error count."""
+    total = len(work)
+    completed = 0
+    new = 0
+    errors = 0
+    consecutive_errors = 0
+    pause_cycles = 0
+    start = time.time()
+    client = AsyncClient(concurrency=MAX_WORKERS, hosts={urlsplit(USGS_EPQS_URL).hostname: {"rate": EPQS_RATE}})
+    cache = ElevationCache(enabled="--no-cache" not in sys.argv)
+    adaptive = "--full-grid" not in sys.argv
+    sampling = Counter()
+    try:
+        async for (lat, lng, lot_sf, key), metrics in bounded_as_completed(
+                work, lambda w: process_listing(client, cache, w[0], w[1], w[2], adaptive, sampling),
+                limit=MAX_WORKERS * 2):
+            completed += 1
+            if metrics is not None:
+                results[key] = metrics
+                new += 1
+                consecutive_errors = 0
+            else:
+                errors += 1
+                consecutive_errors += 1
+
+            # USGS downtime handling
+            if consecutive_errors >= 10:
+                pause_cycles += 1
+                if pause_cycles >= 3:
+                    print(f"\n\n  USGS appears down — aborting after {completed} listings")
+                    break
+                print(f"\n  {consecutive_errors} consecutive failures — pausing 60s...")
+                await asyncio.sleep(60)
+                consecutive_errors = 0
+
+            if completed % 50 == 0 or completed == total:
+                elapsed = time.time() - start
+                rate = completed / elapsed if elapsed > 0 else 0
+                eta = (total - completed) / rate / 60 if rate > 0 else 0
+                sys.stdout.write(
+                    f"\r  [{completed:>5,}/{total:,}] "
+                    f"{rate:.1f}/s | "
+                    f"{new} new | "
+                    f"{errors} err | "
+                    f"ETA {eta:.1f}m   "
+                )
+                sys.stdout.flush()
+
+                # Checkpoint every 200
+                if completed % 200 == 0:
+                    results.commit()
+    finally:
+        client.close()
+        cache.close()
+    print()
+    client.report()
+    cache.report()
+    if adaptive:
+        coarse, refined = sampling["coarse"], sampling["refined"]
+        points = coarse * 5 + refined * GRID_N ** 2
+        print(f"  Adaptive sampling: {coarse:,} flat on corners + center, {refined:,} refined to full grid | "
+              f"{points:,} points ({points / max(coarse + refined, 1):.1f}/listing vs {GRID_N ** 2})")
+    return errors
+
+
 def main():
     market = get_market()
     test_mode = "--test" in sys.argv
     force_mode = "--force" in sys.argv
+    dem_mode = "--dem" in sys.argv
+    dem = None
+    if dem_mode:
+        from dem_tiles import DemSampler
+        dem = DemSampler()
 
     # Parse --limit N
     limit = None
@@ -243,18 +399,21 @@ def main():
 
     print(f"  Found {len(csv_listings):,} active listings with lot >= 5,000 SF")
 
-    # Load existing cache (incremental — skip already computed)
-    existing = {}
-    if os.path.exists(output_file) and not force_mode:
-        with open(output_file) as f:
-            existing = json.load(f)
-        print(f"  Loaded {len(existing):,} cached elevation records")
+    # Open the result store (incremental — skip already computed)
+    results = ResultStore(output_file)
+    if force_mode:
+        results.clear()
+    elif len(results):
+        print(f"  Loaded {len(results):,} cached elevation records")
+    cached_before = len(results)
+    existing = results.get_many(f"{l['lat']},{l['lng']}" for l in csv_listings)
 
     # Build work list
     work = []
     for l in csv_listings:
         key = f"{l['lat']},{l['lng']}"
-        if key not in existing:
+        # An EPQS run also redoes metrics computed from the DEM
+        if key not in existing or (not dem_mode and "src" in existing[key]):
             work.append((l["lat"], l["lng"], l["lotSf"], key))
 
     if limit:
@@ -267,82 +426,38 @@ def main():
         print(f"  ** LIMITED TO {limit} LISTINGS **")
     print(f"{'='*60}")
     print(f"\n  Listings to process: {total:,}")
-    print(f"  Already cached: {len(existing):,}")
-    print(f"  API calls needed: {total * 9:,}")
-    print(f"  Workers: {MAX_WORKERS}")
-    est_min = total * 9 * REQUEST_DELAY / MAX_WORKERS / 60
-    print(f"  Est. time: {est_min:.0f} minutes\n")
+    print(f"  Already cached: {cached_before:,}")
+    if dem_mode:
+        print("  Source: local DEM tiles (no API calls)\n")
+    else:
+        print(f"  API calls needed: {total * 9:,}")
+        print(f"  Workers: {MAX_WORKERS} ({EPQS_RATE} req/s)")
+        est_min = total * 9 / EPQS_RATE / 60
+        print(f"  Est. time: {est_min:.0f} minutes\n")
 
     if total == 0:
         print("  All listings already have elevation data. Done!\n")
+        if force_mode:
+            results.export_json()
+        results.close()
         return
 
-    results = dict(existing)
-    completed = 0
-    errors = 0
-    consecutive_errors = 0
-    pause_cycles = 0
     start = time.time()
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-        futures = {}
-        for lat, lng, lot_sf, key in work:
-            fut = pool.submit(process_listing, lat, lng, lot_sf)
-            futures[fut] = key
-
-        for fut in as_completed(futures):
-            key = futures[fut]
-            completed += 1
-            try:
-                metrics = fut.result()
-                if metrics is not None:
-                    results[key] = metrics
-                    consecutive_errors = 0
-                else:
-                    errors += 1
-                    consecutive_errors += 1
-            except Exception:
-                errors += 1
-                consecutive_errors += 1
-
-            # USGS downtime handling
-            if consecutive_errors >= 10:
-                pause_cycles += 1
-                if pause_cycles >= 3:
-                    print(f"\n\n  USGS appears down — aborting after {completed} listings")
-                    break
-                print(f"\n  {consecutive_errors} consecutive failures — pausing 60s...")
-                time.sleep(60)
-                consecutive_errors = 0
-
-            if completed % 50 == 0 or completed == total:
-                elapsed = time.time() - start
-                rate = completed / elapsed if elapsed > 0 else 0
-                eta = (total - completed) / rate / 60 if rate > 0 else 0
-                cached = len(results) - len(existing)
-                sys.stdout.write(
-                    f"\r  [{completed:>5,}/{total:,}] "
-                    f"{rate:.1f}/s | "
-                    f"{cached} new | "
-                    f"{errors} err | "
-                    f"ETA {eta:.1f}m   "
-                )
-                sys.stdout.flush()
-
-                # Checkpoint every 200
-                if completed % 200 == 0:
-                    with open(output_file, "w") as f:
-                        json.dump(results, f)
-
+    try:
+        if dem_mode:
+            errors = compute_all_dem(work, results, dem)
+        else:
+            errors = asyncio.run(compute_all(work, results))
+    finally:
+        results.commit()
     elapsed = time.time() - start
 
     # Final save
-    with open(output_file, "w") as f:
-        json.dump(results, f)
+    results.export_json()
 
     print(f"\n\n  Done in {elapsed / 60:.1f} minutes")
     print(f"  Total cached: {len(results):,}")
-    print(f"  New this run: {len(results) - len(existing):,}")
+    print(f"  New this run: {len(results) - cached_before:,}")
     print(f"  Errors: {errors}")
 
     # Distribution
@@ -359,6 +474,7 @@ def main():
         print(f"    Steep (51-75):     {steep:,} ({steep / len(scores) * 100:.1f}%)")
         print(f"    Severe (76-100):   {severe:,} ({severe / len(scores) * 100:.1f}%)")
 
+    results.close()
     print(f"\n  Written: {output_file}")
     print(f"  Next: python3 listings_build.py")
     print(f"  Then refresh http://localhost:8080\n")
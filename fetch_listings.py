@@ -5,16 +5,34 @@ Pulls ALL active residential listings in LA County via Redfin's gis-csv endpoint
 
 Uses adaptive geographic tiling: starts with a coarse grid, then automatically
 subdivides any tile that hits Redfin's per-request cap (350 listings) into
-4 smaller tiles. Recurses until every tile is under the cap → 100% coverage.
+4 smaller tiles, which go back on the work queue. Continues until every tile
+is under the cap → 100% coverage.
+
+Tiles are fetched by a small worker pool (--workers N) behind one shared
+token-bucket rate limit (--rate R requests/sec across all workers). A 429/403
+backs off the whole pool, not just the worker that saw it.
+
+Tile responses are cached locally for REDFIN_CACHE_HOURS (response_cache.py).
+A quick refresh inside that window only re-requests expired tiles
+(--max-age H to change it, --no-cache to bypass).
 
 Key fix: Creates a fresh HTTP session per tile to avoid Redfin's
 cookie-based geographic restrictions on reused sessions.
 
-Supports resumability: if script crashes, re-run to resume from last checkpoint.
+Supports resumability: every finished tile is appended to a JSON-lines
+journal (redfin_merged.journal.jsonl) with the rows it returned. A tile
+that failed (blocked / errored) is not journaled. If the script crashes,
+re-run to replay the journal and resume; failed tiles are fetched again.
+The CSV is written once at the end.
+
+A successful run saves its final leaf tiles with row counts
+(redfin_merged.leaves.json). The next run starts from that tiling:
+sparse leaves are merged and near-cap leaves pre-split.
 
 Usage:
   python3 fetch_listings.py          # Full LA County
   python3 fetch_listings.py --test   # Single tile test
+  python3 fetch_listings.py --workers 2 --rate 0.3   # Gentler on Redfin
   python3 listings_build.py          # Process into listings.js
   (refresh browser)
 """
@@ -29,71 +47,69 @@ import sys
 import random
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
-from market_config import get_market, market_file, REDFIN_GIS_CSV_URL, REDFIN_HEADERS, REDFIN_NUM_HOMES, REDFIN_DELAY_MIN, REDFIN_DELAY_MAX
-from tile_utils import build_grid, subdivide_tile, tile_to_poly, tile_label, tile_key
+from market_config import get_market, market_file, REDFIN_GIS_CSV_URL, REDFIN_HEADERS, REDFIN_NUM_HOMES
+from tile_utils import build_grid, subdivide_tile, tile_to_poly, tile_label, tile_key, tile_order, RateLimiter, run_tiles, scheduler_settings, plan_tiles, save_leaves, leaf_record
+from response_cache import ResponseCache, cache_settings
 
 # ── Config ──
 MAX_RETRIES = 5
 BACKOFF_BASE = 15  # seconds — doubles each retry: 15, 30, 60, 120, 240
 MAX_SUBDIVIDE_DEPTH = 6  # Max times a tile can be quartered (0.12° → ~0.002°)
-CHECKPOINT_INTERVAL = 10  # Write checkpoint every N tiles
 
-# ── Counters (global for easy access in recursive flow) ──
+# ── Counters (global; only updated on the main thread in handle_tile) ──
 header_row = None
 all_data_rows = []
 seen_keys = set()
+leaf_rows = []  # (leaf_record, CSV rows) per ingested leaf — deduped in tile order at the end
+rows_fetched = 0
 tiles_fetched = 0
 tiles_with_data = 0
 tiles_empty = 0
 tiles_subdivided = 0
+tiles_failed = 0  # Blocked / errored tiles (no leaf record: not taken as empty)
 dupes_skipped = 0
 completed_tiles = set()  # Track completed tile keys for resumability
+open_splits = {}  # tile_key(parent) → sub-tiles still outstanding
+parent_of = {}    # tile_key(sub-tile) → parent tile
+leaves = []       # leaf_record() per tile that was ingested (not split)
+journal = None    # Open checkpoint journal (append-only JSON lines), None in --test
 
 
-def load_checkpoint(checkpoint_file, output_file):
-    """Load checkpoint and existing CSV data for resume mode."""
-    global header_row, all_data_rows, seen_keys, completed_tiles
-    if not os.path.exists(checkpoint_file):
+def load_journal(journal_file):
+    """Replay the checkpoint journal for resume mode. Drops a torn last line."""
+    if not os.path.exists(journal_file):
         return
-    try:
-        with open(checkpoint_file) as f:
-            ckpt = json.load(f)
-        completed_tiles = set(ckpt.get("completed_tiles", []))
-        if not completed_tiles:
-            return
-        # Load existing partial CSV
-        if os.path.exists(output_file):
-            with open(output_file, newline="", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                rows = list(reader)
-            if rows:
-                header_row = rows[0]
-                for row in rows[1:]:
-                    if len(row) < 10:
-                        continue
-                    try:
-                        addr_idx = header_row.index("ADDRESS") if "ADDRESS" in header_row else 3
-                        price_idx = header_row.index("PRICE") if "PRICE" in header_row else 7
-                        key = (row[addr_idx].strip().lower(), row[price_idx].strip())
-                    except (IndexError, ValueError):
-                        key = tuple(row[:5])
-                    seen_keys.add(key)
-                    all_data_rows.append(row)
-        print(f"  Resuming: {len(completed_tiles)} tiles done, {len(all_data_rows):,} rows loaded")
-    except Exception as e:
-        print(f"  Checkpoint load failed ({e}), starting fresh")
-        completed_tiles = set()
-
-
-def save_checkpoint(checkpoint_file, output_file):
-    """Write current progress to checkpoint file and partial CSV."""
-    with open(checkpoint_file, "w") as f:
-        json.dump({"completed_tiles": list(completed_tiles)}, f)
-    if header_row and all_data_rows:
-        with open(output_file, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(header_row)
-            writer.writerows(all_data_rows)
+    good = 0
+    with open(journal_file, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Torn write from a crash
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            good += len(line)
+            completed_tiles.add(entry["tile"])
+            if "leaf" in entry:
+                leaves.append(entry["leaf"])
+                buffer_rows(entry["leaf"], entry["rows"])
+    if good < os.path.getsize(journal_file):
+        with open(journal_file, "r+b") as f:
+            f.truncate(good)
+    if completed_tiles:
+        print(f"  Resuming: {len(completed_tiles)} tiles done, {rows_fetched:,} rows replayed")
+
+
+def journal_tile(tile, leaf=None, rows=None):
+    """Append a finished tile (with its leaf record and raw CSV rows, if ingested) to the journal."""
+    if journal is None:
+        return
+    entry = {"tile": tile_key(tile)}
+    if leaf is not None:
+        entry["leaf"] = leaf
+        entry["rows"] = rows or []
+    journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    journal.flush()
 
 
 def is_tile_done(tile):
@@ -106,11 +122,34 @@ def mark_tile_done(tile):
     completed_tiles.add(tile_key(tile))
 
 
-def fetch_tile(tile, market, retries=0):
-    """Fetch active listings for a geographic tile.
+def finish_tile(tile, leaf=None, rows=None):
+    """Journal and mark a tile done; a split parent is done once its last sub-tile is."""
+    journal_tile(tile, leaf, rows)
+    mark_tile_done(tile)
+    parent = parent_of.pop(tile_key(tile), None)
+    if parent is not None:
+        pkey = tile_key(parent)
+        open_splits[pkey] -= 1
+        if open_splits[pkey] == 0:
+            del open_splits[pkey]
+            finish_tile(parent)
+
+
+def parse_tile_csv(text):
+    """gis-csv response text → CSV rows (header first), or [] if it holds no listings."""
+    text = text.strip()
+    if not text or text.startswith("<!") or text.startswith("{"):
+        return []
+    rows = list(csv.reader(io.StringIO(text)))
+    return rows if len(rows) > 1 else []
+
+
+def fetch_tile(tile, market, limiter, cache, retries=0):
+    """Fetch active listings for a geographic tile (runs in a worker thread).
     Uses a fresh session each call to avoid Redfin's cookie-based
     geographic restrictions that break reused sessions.
-    Exponential backoff: 15s, 30s, 60s, 120s, 240s on throttle.
+    Exponential backoff: 15s, 30s, 60s, 120s, 240s on throttle, shared by all workers.
+    Returns the tile's CSV rows, or None if it was blocked or failed.
     """
     poly = tile_to_poly(tile)
     url = (
@@ -119,41 +158,56 @@ def fetch_tile(tile, market, retries=0):
         f"&v=8&user_poly={poly}"
     )
 
+    cached = cache.get(url) if retries == 0 else None
+    if cached is not None:
+        return parse_tile_csv(cached)
+
+    limiter.acquire()
     try:
         session = requests.Session()
         resp = session.get(url, headers=REDFIN_HEADERS, timeout=30)
         session.close()
 
         if resp.status_code == 200:
-            text = resp.text.strip()
-            if not text or text.startswith("<!") or text.startswith("{"):
-                return []
-
-            reader = csv.reader(io.StringIO(text))
-            rows = list(reader)
-            return rows if len(rows) > 1 else []
+            cache.put(url, resp.status_code, resp.text)
+            return parse_tile_csv(resp.text)
 
         elif resp.status_code in (429, 403):
             if retries < MAX_RETRIES:
                 wait = BACKOFF_BASE * (2 ** retries) + random.uniform(0, 10)
-                print(f"\n      {resp.status_code} on tile {tile_label(tile)} — waiting {wait:.0f}s (retry {retries+1}/{MAX_RETRIES})...")
-                time.sleep(wait)
-                return fetch_tile(tile, market, retries + 1)
+                print(f"\n      {resp.status_code} on tile {tile_label(tile)} — pausing all workers {wait:.0f}s (retry {retries+1}/{MAX_RETRIES})...")
+                limiter.backoff(wait)
+                return fetch_tile(tile, market, limiter, cache, retries + 1)
             else:
                 print(f"\n      Blocked on tile {tile_label(tile)}, skipping")
-                return []
+                return None
         else:
-            return []
+            return None
 
     except requests.exceptions.Timeout:
         if retries < MAX_RETRIES:
             wait = BACKOFF_BASE * (2 ** retries)
             time.sleep(wait)
-            return fetch_tile(tile, market, retries + 1)
-        return []
+            return fetch_tile(tile, market, limiter, cache, retries + 1)
+        return None
     except Exception as e:
         print(f"\n      Error: {e}")
-        return []
+        return None
+
+
+def buffer_rows(leaf, rows):
+    """Hold a leaf's CSV rows until ingest_leaves() (so completion order doesn't matter)."""
+    global rows_fetched
+    if rows:
+        leaf_rows.append((leaf, rows))
+        rows_fetched += len(rows) - 1
+
+
+def ingest_leaves():
+    """Dedup every buffered leaf's rows into all_data_rows, in tile_order()."""
+    for _, rows in sorted(leaf_rows, key=lambda e: tile_order(e[0])):
+        ingest_rows(rows)
+    leaf_rows.clear()
 
 
 def ingest_rows(rows):
@@ -165,6 +219,8 @@ def ingest_rows(rows):
     if header_row is None:
         header_row = rows[0]
 
+    addr_idx = header_row.index("ADDRESS") if "ADDRESS" in header_row else 3
+    price_idx = header_row.index("PRICE") if "PRICE" in header_row else 7
     new_count = 0
     for row in rows[1:]:
         if len(row) < 10:
@@ -173,10 +229,8 @@ def ingest_rows(rows):
             continue
 
         try:
-            addr_idx = header_row.index("ADDRESS") if "ADDRESS" in header_row else 3
-            price_idx = header_row.index("PRICE") if "PRICE" in header_row else 7
             key = (row[addr_idx].strip().lower(), row[price_idx].strip())
-        except (IndexError, ValueError):
+        except IndexError:
             key = tuple(row[:5])
 
         if key in seen_keys:
@@ -189,13 +243,9 @@ def ingest_rows(rows):
     return new_count
 
 
-def process_tile(tile, market, checkpoint_file, output_file):
-    """Fetch a tile. If it hits the cap, subdivide and recurse."""
-    global tiles_fetched, tiles_with_data, tiles_empty, tiles_subdivided
-
-    # Skip already-completed tiles (resume mode)
-    if is_tile_done(tile):
-        return
+def handle_tile(tile, rows):
+    """Record a fetched tile (main thread; rows None = failed). Returns its sub-tiles to queue if it hit the cap."""
+    global tiles_fetched, tiles_with_data, tiles_empty, tiles_subdivided, tiles_failed
 
     tiles_fetched += 1
     depth = tile.get('depth', 0)
@@ -203,39 +253,44 @@ def process_tile(tile, market, checkpoint_file, output_file):
     sys.stdout.write(
         f"\r  [req {tiles_fetched:>3}] "
         f"{tile_label(tile)}  "
-        f"| {len(all_data_rows):,} listings  "
-        f"| {dupes_skipped:,} dupes  "
+        f"| {rows_fetched:,} rows  "
         f"| {tiles_subdivided} splits   "
     )
     sys.stdout.flush()
 
-    rows = fetch_tile(tile, market)
+    if rows is None:
+        # Failed, not empty: no leaf record, so the next plan doesn't merge it away.
+        # Not journaled or marked done either (nor is a split parent waiting on it),
+        # so a resume fetches it again.
+        tiles_failed += 1
+        return []
 
     if not rows:
         tiles_empty += 1
-        mark_tile_done(tile)
-        if tiles_fetched % CHECKPOINT_INTERVAL == 0:
-            save_checkpoint(checkpoint_file, output_file)
-        time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
-        return
+        leaves.append(leaf_record(tile, 0))
+        finish_tile(tile, leaves[-1])
+        return []
 
     data_count = len(rows) - 1  # minus header
     hit_cap = data_count >= REDFIN_NUM_HOMES - 5
 
     if hit_cap and depth < MAX_SUBDIVIDE_DEPTH:
-        # This tile is too dense — subdivide into 4 and recurse
+        # This tile is too dense — queue its 4 quadrants (minus any done before a resume)
         tiles_subdivided += 1
-        sub_tiles = subdivide_tile(tile)
+        sub_tiles = [st for st in subdivide_tile(tile) if not is_tile_done(st)]
         print(f"\n      Cap hit ({data_count}) on {tile_label(tile)} — splitting into 4 sub-tiles")
-        time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
+        if not sub_tiles:
+            finish_tile(tile)
+            return []
+        open_splits[tile_key(tile)] = len(sub_tiles)
         for st in sub_tiles:
-            process_tile(st, market, checkpoint_file, output_file)
-        mark_tile_done(tile)
-        return
+            parent_of[tile_key(st)] = tile
+        return sub_tiles
 
-    # Under cap or max depth — ingest the data
-    new = ingest_rows(rows)
-    if new > 0:
+    # Under cap or max depth — keep the data (deduped by ingest_leaves once every tile is in)
+    leaves.append(leaf_record(tile, data_count))
+    buffer_rows(leaves[-1], rows)
+    if data_count > 0:
         tiles_with_data += 1
     else:
         tiles_empty += 1
@@ -243,21 +298,22 @@ def process_tile(tile, market, checkpoint_file, output_file):
     if hit_cap and depth >= MAX_SUBDIVIDE_DEPTH:
         print(f"\n      Warning: {tile_label(tile)} still at cap after max depth — some listings missed")
 
-    mark_tile_done(tile)
-    if tiles_fetched % CHECKPOINT_INTERVAL == 0:
-        save_checkpoint(checkpoint_file, output_file)
-
-    time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
+    finish_tile(tile, leaves[-1], rows)
+    return []
 
 
 def main():
+    global journal
     test_mode = "--test" in sys.argv
+    workers, rate = scheduler_settings()
+    cache_on, max_age = cache_settings()
     market = get_market()
-    tiles = build_grid(market)
     output_file = market_file("redfin_merged.csv", market)
-    checkpoint_file = market_file("redfin_merged.ckpt", market)
+    journal_file = market_file("redfin_merged.journal.jsonl", market)
+    leaf_file = market_file("redfin_merged.leaves.json", market)
 
     if test_mode:
+        tiles = build_grid(market)
         # Pick a tile near the market center for testing
         center_lat = (market["lat_min"] + market["lat_max"]) / 2
         center_lng = (market["lng_min"] + market["lng_max"]) / 2
@@ -270,33 +326,51 @@ def main():
             test_tile = tiles[len(tiles) // 2]
         tiles = [test_tile]
     else:
-        # Resume mode: load checkpoint if available
-        load_checkpoint(checkpoint_file, output_file)
+        tiles, plan = plan_tiles(market, leaf_file, REDFIN_NUM_HOMES, MAX_SUBDIVIDE_DEPTH)
+        # Resume mode: replay the journal if a previous run crashed
+        load_journal(journal_file)
+        journal = open(journal_file, "a", encoding="utf-8")
 
     print("\n" + "=" * 60)
     print(f"  Redfin {market['name']} — Adaptive Full-Coverage Fetcher")
     if test_mode:
         print("  ** TEST MODE — single tile **")
     print("=" * 60)
-    print(f"\n  Starting grid: {market['tile_lat']}° x {market['tile_lng']}° ({len(tiles)} tiles)")
+    if not test_mode and plan["source"] == "leaves":
+        print(f"\n  Starting tiles: {len(tiles)} from the last run's leaves ({plan['merged']} merged, {plan['split']} pre-split)")
+    else:
+        print(f"\n  Starting grid: {market['tile_lat']}° x {market['tile_lng']}° ({len(tiles)} tiles)")
     print(f"  Cap per tile: {REDFIN_NUM_HOMES} (auto-subdivides if hit)")
     print(f"  Max subdivision depth: {MAX_SUBDIVIDE_DEPTH}")
-    print(f"  Rate limit: {REDFIN_DELAY_MIN}-{REDFIN_DELAY_MAX}s between requests")
+    print(f"  Rate limit: {rate:.2f} req/s across {workers} workers (shared token bucket)")
+    print(f"  Response cache: {f'{max_age / 3600:g}h TTL' if cache_on else 'off'}")
     print(f"  Retries: {MAX_RETRIES} with exponential backoff ({BACKOFF_BASE}s base)")
     print(f"  Output: {output_file}\n")
 
     start_time = time.time()
 
-    for tile in tiles:
-        process_tile(tile, market, checkpoint_file, output_file)
+    limiter = RateLimiter(rate)
+    cache = ResponseCache(market_file("redfin_cache.sqlite", market), max_age, enabled=cache_on)
+    run_tiles(
+        [t for t in tiles if not is_tile_done(t)],  # Skip already-completed tiles (resume mode)
+        lambda t: fetch_tile(t, market, limiter, cache),
+        handle_tile,
+        workers,
+    )
+    cache.close()
+    if journal is not None:
+        journal.close()
+    ingest_leaves()
 
     elapsed_total = time.time() - start_time
 
-    print(f"\n\n  Done in {elapsed_total / 60:.1f} minutes ({tiles_fetched} requests)")
+    print(f"\n\n  Done in {elapsed_total / 60:.1f} minutes ({tiles_fetched} tiles, "
+          f"{cache.stats['misses'] if cache_on else tiles_fetched} requests, {cache.stats['hits']} from cache)")
     print(f"\n  Results:")
     print(f"     Tiles with listings: {tiles_with_data}")
     print(f"     Tiles empty:         {tiles_empty}")
     print(f"     Tiles subdivided:    {tiles_subdivided}")
+    print(f"     Tiles failed:        {tiles_failed}")
     print(f"     Duplicates removed:  {dupes_skipped:,}")
     print(f"     Unique listings:     {len(all_data_rows):,}")
 
@@ -310,14 +384,18 @@ def main():
         writer.writerow(header_row)
         writer.writerows(all_data_rows)
 
-    # Clean up checkpoint on successful completion
-    if os.path.exists(checkpoint_file):
-        os.remove(checkpoint_file)
+    # Seed the next run's tiling, then clean up the journal on successful completion
+    if not test_mode:
+        save_leaves(leaf_file, market, leaves)
+        if os.path.exists(journal_file):
+            os.remove(journal_file)
 
     size_kb = os.path.getsize(output_file) / 1024
     print(f"\n  Written: {output_file}")
     print(f"     Size: {size_kb:.0f} KB ({size_kb/1024:.1f} MB)")
     print(f"     Rows: {len(all_data_rows):,}")
+    if not test_mode:
+        print(f"     Leaf tiles: {leaf_file} ({len(leaves)} tiles, seeds the next run)")
     print(f"\n  Next: python3 listings_build.py")
     print(f"     Then refresh http://localhost:8080\n")
 
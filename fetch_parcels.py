@@ -3,31 +3,48 @@
 fetch_parcels.py
 Fetches parcel lot area + fire zone status from ArcGIS for each listing.
 
-For each listing, queries two ArcGIS services:
+For each listing:
   1. Parcel service — lot area, APN, assessed values (market-specific endpoint)
-  2. Fire zone service — VHFHSZ status (statewide CAL FIRE or market-specific)
+  2. Fire zone — VHFHSZ status from the local polygons in fire_zones.py
+     (downloaded once from statewide CAL FIRE or the market's fire_url)
 
 Reads:  redfin_merged.csv (directly, to avoid chicken-and-egg with listings.js)
-Writes: parcels.json — keyed by "lat,lng"
+Writes: parcels.json — keyed by "lat,lng" (results go to parcels.json.sqlite
+        as they arrive, via result_store.py; the JSON is exported at the end)
 
 Supports incremental runs (skips already-computed listings).
 
+Listings are grouped into spatial batches (BATCH_CELL_DEG grid cells, at
+most BATCH_SIZE each). Each batch sends one parcel query, with an envelope
+around the whole batch. Every listing is then matched locally against the
+returned polygons, repeating the listing's own envelope-intersects test.
+Results are the same as per-listing queries, with about listings / batch
+size round-trips instead of 2 × listings.
+
+Requests go through the shared asyncio client (http_client.py): one pooled
+keep-alive session per host, MAX_WORKERS requests in flight per host,
+unified 429/503 backoff.
+
 Usage:
   python3 fetch_parcels.py                     # All LA listings (~1-3 min)
   python3 fetch_parcels.py --market sd          # All SD listings
   python3 fetch_parcels.py --market sd --test   # First 10 only
+  python3 fetch_parcels.py --sync-fire          # Re-download the fire-zone polygons first
 """
 
-import csv, json, math, os, sys, time, re
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
+import asyncio, csv, json, math, os, sys, time, re
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
-from market_config import get_market, market_file, CALFIRE_LRA_URL
+from market_config import get_market, market_file
+from http_client import AsyncClient, bounded_as_completed
+from fire_zones import ensure_fire_zones
+from result_store import ResultStore
 
 # ── Config ──
 MAX_WORKERS = 25
 ENVELOPE_OFFSET = 0.00002  # ~2m envelope around point for parcel query
+BATCH_CELL_DEG = 0.004     # ~400m grid cells for spatial batches
+BATCH_SIZE = 40            # Max listings per batch query
 
 # Coordinate-to-feet conversion
 DEG_LAT_FT = 364320  # ft per degree latitude (~111 km)
@@ -136,155 +153,165 @@ def compute_lot_dimensions(geometry, lot_sf=None):
     return (lot_w, lot_d, shape)
 
 
-def query_parcel(lat, lng, market, retries=2):
-    """Query parcel service with market-appropriate geometry (envelope or point)."""
-    parcel_url = market["parcel_url"]
-    field_map = market["parcel_field_map"]
-
-    if market.get("parcel_query_type") == "envelope":
-        # LA-style: small envelope around point
-        offset = market.get("parcel_envelope_offset", ENVELOPE_OFFSET)
-        env = {
-            "xmin": lng - offset, "ymin": lat - offset,
-            "xmax": lng + offset, "ymax": lat + offset,
-            "spatialReference": {"wkid": 4326}
-        }
-        params = {
-            "geometry": json.dumps(env),
-            "geometryType": "esriGeometryEnvelope",
-            "spatialRel": "esriSpatialRelIntersects",
-            "outFields": market.get("parcel_out_fields", "*"),
-            "returnGeometry": "true",
-            "outSR": 4326,
-            "f": "json",
-        }
-    else:
-        # SD-style: point query with coordinate system projection
-        params = {
-            "geometry": f"{lng},{lat}",
-            "geometryType": "esriGeometryPoint",
-            "inSR": market.get("parcel_in_sr", 4326),
-            "outSR": 4326,
-            "spatialRel": "esriSpatialRelIntersects",
-            "outFields": market.get("parcel_out_fields", "*"),
-            "returnGeometry": "true",
-            "f": "json",
-        }
-
-    for attempt in range(retries + 1):
-        try:
-            resp = requests.get(parcel_url, params=params, timeout=30)
-            if resp.status_code == 200:
-                data = resp.json()
-                features = data.get("features", [])
-                if features:
-                    if len(features) > 1:
-                        # Pick smallest lot (most specific parcel) — avoids HOA/assessment overlays
-                        best_feat = None
-                        best_lot = None
-                        for feat in features:
-                            a = feat.get("attributes", {})
-                            lot_raw = a.get(field_map["lot_sf"])
-                            if lot_raw and lot_raw > 0:
-                                if best_feat is None or lot_raw < best_lot:
-                                    best_feat = feat
-                                    best_lot = lot_raw
-                        # Fallback: point-in-polygon test when lot sizes are null
-                        if best_feat is None:
-                            for feat in features:
-                                geom = feat.get("geometry", {})
-                                rings = geom.get("rings", [])
-                                if rings and _point_in_ring(lng, lat, rings[0]):
-                                    best_feat = feat
-                                    break
-                        chosen = best_feat if best_feat else features[0]
-                    else:
-                        chosen = features[0]
-                    attrs = chosen.get("attributes", {})
-
-                    # Map response fields using market config
-                    lot_raw = attrs.get(field_map["lot_sf"])
-                    multiplier = field_map.get("lot_sf_multiplier", 1)
-                    lot_sf = round(lot_raw * multiplier) if lot_raw else None
-
-                    situs_field = field_map.get("situs_address")
-                    situs = attrs.get(situs_field, "") if situs_field else ""
-
-                    # Extract lot dimensions from polygon geometry
-                    geom = chosen.get("geometry")
-                    lot_w, lot_d, lot_shape = compute_lot_dimensions(geom, lot_sf) if geom else (None, None, None)
-
-                    result = {
-                        "lotSf": lot_sf,
-                        "ain": attrs.get(field_map["ain"], ""),
-                        "landValue": attrs.get(field_map["land_value"]),
-                        "impValue": attrs.get(field_map["imp_value"]),
-                        "situsAddress": situs,
-                        "lotWidth": lot_w,
-                        "lotDepth": lot_d,
-                        "lotShape": lot_shape,
-                    }
-
-                    # Extract existing dwelling units from assessor data
-                    units_fields = field_map.get("units_fields", [])
-                    if units_fields:
-                        total_units = sum(attrs.get(f) or 0 for f in units_fields)
-                        if total_units > 0:
-                            result["existingUnits"] = total_units
-
-                    return result
-                return None  # No parcel found at this location
-            elif resp.status_code in (429, 503):
-                time.sleep(3 + attempt * 3)
-                continue
-        except Exception:
-            if attempt < retries:
-                time.sleep(2)
-    return None
+def _point_in_rings(lng, lat, rings):
+    """Even-odd test over every ring of a polygon (multipart parcels and holes)."""
+    inside = False
+    for ring in rings:
+        if _point_in_ring(lng, lat, ring):
+            inside = not inside
+    return inside
 
 
-def query_fire_zone(lat, lng, market, retries=2):
-    """Query fire zone service for VHFHSZ status.
-    
-    Uses market-specific endpoint if available, otherwise statewide CAL FIRE.
+def _segment_hits_box(p, q, xmin, ymin, xmax, ymax):
+    """Liang-Barsky: does segment p→q pass through the box?"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = q[0] - p[0], q[1] - p[1]
+    for d, dist in ((-dx, p[0] - xmin), (dx, xmax - p[0]), (-dy, p[1] - ymin), (dy, ymax - p[1])):
+        if d == 0:
+            if dist < 0:
+                return False  # Parallel to this edge and outside it
+            continue
+        t = dist / d
+        if d < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return False
+    return True
+
+
+def _rings_intersect_envelope(rings, xmin, ymin, xmax, ymax):
+    """Exact polygon/envelope intersects test (what esriSpatialRelIntersects returns)."""
+    for ring in rings:
+        for i in range(len(ring)):
+            p, q = ring[i - 1], ring[i]
+            if xmin <= q[0] <= xmax and ymin <= q[1] <= ymax:
+                return True
+            if _segment_hits_box(p, q, xmin, ymin, xmax, ymax):
+                return True
+    # No edge touches the box: it is either wholly inside the polygon or disjoint
+    return _point_in_rings(xmin, ymin, rings)
+
+
+def cluster_batches(work, cell=BATCH_CELL_DEG, size=BATCH_SIZE):
+    """Group work [(lat, lng, key)] into spatial batches: grid cells, at most `size` points each."""
+    cells = {}
+    for w in work:
+        cells.setdefault((math.floor(w[0] / cell), math.floor(w[1] / cell)), []).append(w)
+    return [pts[i:i + size] for pts in cells.values() for i in range(0, len(pts), size)]
+
+
+async def query_envelope(client, url, batch, offset, out_fields):
+    """Features intersecting the envelope around a batch of points, or None if the query failed.
+
+    A response cut off by the server's record limit is retried as two half batches.
     """
-    fire_url = market.get("fire_url") or CALFIRE_LRA_URL
-    fire_field = market.get("fire_field", "HAZ_CLASS")
-    fire_value = market.get("fire_vhfhsz_value", "Very High")
-
+    env = {
+        "xmin": min(w[1] for w in batch) - offset, "ymin": min(w[0] for w in batch) - offset,
+        "xmax": max(w[1] for w in batch) + offset, "ymax": max(w[0] for w in batch) + offset,
+        "spatialReference": {"wkid": 4326}
+    }
     params = {
-        "geometry": f"{lng},{lat}",
-        "geometryType": "esriGeometryPoint",
+        "geometry": json.dumps(env),
+        "geometryType": "esriGeometryEnvelope",
         "inSR": 4326,
         "spatialRel": "esriSpatialRelIntersects",
-        "outFields": fire_field,
-        "returnGeometry": "false",
+        "outFields": out_fields,
+        "returnGeometry": "true",
+        "outSR": 4326,
         "f": "json",
     }
-    for attempt in range(retries + 1):
-        try:
-            resp = requests.get(fire_url, params=params, timeout=30)
-            if resp.status_code == 200:
-                data = resp.json()
-                features = data.get("features", [])
-                if features:
-                    haz = features[0].get("attributes", {}).get(fire_field, "")
-                    return haz == fire_value
-                return False  # No fire zone feature at this point
-            elif resp.status_code in (429, 503):
-                time.sleep(3 + attempt * 3)
-                continue
-        except Exception:
-            if attempt < retries:
-                time.sleep(2)
-    return None  # Query failed
+    data = await client.get_json(url, params=params)
+    if data is None:
+        return None  # Query failed
+    if data.get("exceededTransferLimit") and len(batch) > 1:
+        batch = sorted(batch, key=lambda w: (w[1], w[0]))
+        half = len(batch) // 2
+        parts = await asyncio.gather(query_envelope(client, url, batch[:half], offset, out_fields),
+                                     query_envelope(client, url, batch[half:], offset, out_fields))
+        if None in parts:
+            return None
+        return parts[0] + parts[1]
+    return data.get("features", [])
+
+
+def parcel_at(features, lat, lng, market):
+    """Parcel result for one listing from its batch's parcel features, or None.
+
+    Envelope markets keep the features that intersect the listing's own
+    envelope (as a per-listing envelope query would return); point markets
+    keep those containing the point.
+    """
+    field_map = market["parcel_field_map"]
+    if market.get("parcel_query_type") == "envelope":
+        offset = market.get("parcel_envelope_offset", ENVELOPE_OFFSET)
+        box = (lng - offset, lat - offset, lng + offset, lat + offset)
+        features = [f for f in features if _rings_intersect_envelope((f.get("geometry") or {}).get("rings", []), *box)]
+    else:
+        features = [f for f in features if _point_in_rings(lng, lat, (f.get("geometry") or {}).get("rings", []))]
+
+    if features:
+        if len(features) > 1:
+            # Pick smallest lot (most specific parcel) — avoids HOA/assessment overlays
+            best_feat = None
+            best_lot = None
+            for feat in features:
+                a = feat.get("attributes", {})
+                lot_raw = a.get(field_map["lot_sf"])
+                if lot_raw and lot_raw > 0:
+                    if best_feat is None or lot_raw < best_lot:
+                        best_feat = feat
+                        best_lot = lot_raw
+            # Fallback: point-in-polygon test when lot sizes are null
+            if best_feat is None:
+                for feat in features:
+                    geom = feat.get("geometry", {})
+                    rings = geom.get("rings", [])
+                    if rings and _point_in_ring(lng, lat, rings[0]):
+                        best_feat = feat
+                        break
+            chosen = best_feat if best_feat else features[0]
+        else:
+            chosen = features[0]
+        attrs = chosen.get("attributes", {})
+
+        # Map response fields using market config
+        lot_raw = attrs.get(field_map["lot_sf"])
+        multiplier = field_map.get("lot_sf_multiplier", 1)
+        lot_sf = round(lot_raw * multiplier) if lot_raw else None
+
+        situs_field = field_map.get("situs_address")
+        situs = attrs.get(situs_field, "") if situs_field else ""
+
+        # Extract lot dimensions from polygon geometry
+        geom = chosen.get("geometry")
+        lot_w, lot_d, lot_shape = compute_lot_dimensions(geom, lot_sf) if geom else (None, None, None)
+
+        result = {
+            "lotSf": lot_sf,
+            "ain": attrs.get(field_map["ain"], ""),
+            "landValue": attrs.get(field_map["land_value"]),
+            "impValue": attrs.get(field_map["imp_value"]),
+            "situsAddress": situs,
+            "lotWidth": lot_w,
+            "lotDepth": lot_d,
+            "lotShape": lot_shape,
+        }
+
+        # Extract existing dwelling units from assessor data
+        units_fields = field_map.get("units_fields", [])
+        if units_fields:
+            total_units = sum(attrs.get(f) or 0 for f in units_fields)
+            if total_units > 0:
+                result["existingUnits"] = total_units
 
+        return result
+    return None  # No parcel found at this location
 
-def fetch_parcel_data(lat, lng, market):
-    """Fetch both parcel info and fire zone status for a single listing."""
-    parcel = query_parcel(lat, lng, market)
-    fire = query_fire_zone(lat, lng, market)
 
+def merge_parcel_data(parcel, fire):
+    """One listing's parcels.json entry from its parcel and fire results (None = failed/no data)."""
     if parcel is None and fire is None:
         return None
 
@@ -310,6 +337,23 @@ def fetch_parcel_data(lat, lng, market):
     return result if result else None
 
 
+async def fetch_batch(client, batch, market, fire_zones):
+    """Parcel + fire data for a batch of listings: one parcel query, fire zones checked locally.
+
+    Returns [data or None] aligned with batch.
+    """
+    parcel_offset = (market.get("parcel_envelope_offset", ENVELOPE_OFFSET)
+                     if market.get("parcel_query_type") == "envelope" else ENVELOPE_OFFSET)
+    parcels = await query_envelope(client, market["parcel_url"], batch, parcel_offset,
+                                   market.get("parcel_out_fields", "*"))
+    out = []
+    for lat, lng, _ in batch:
+        parcel = parcel_at(parcels, lat, lng, market) if parcels is not None else None
+        fire = fire_zones.contains(lat, lng) if fire_zones is not None else None
+        out.append(merge_parcel_data(parcel, fire))
+    return out
+
+
 def load_listings_from_csv(market):
     """Load listing lat/lng from redfin_merged.csv."""
     csv_file = market_file("redfin_merged.csv", market)
@@ -341,6 +385,49 @@ def load_listings_from_csv(market):
     return listings
 
 
+async def fetch_all(work, results, market, fire_zones):
+    """Fetch parcel + fire data for work [(lat, lng, key)] into results; returns the error count."""
+    total = len(work)
+    completed = 0
+    errors = 0
+    start = time.time()
+    batches = cluster_batches(work)
+    print(f"  {len(batches):,} batches (avg {total / max(len(batches), 1):.1f} listings)")
+    client = AsyncClient(concurrency=MAX_WORKERS)
+    try:
+        async for batch, batch_data in bounded_as_completed(
+                batches, lambda b: fetch_batch(client, b, market, fire_zones), limit=MAX_WORKERS * 2):
+            batch_data = batch_data or [None] * len(batch)
+            for (lat, lng, key), data in zip(batch, batch_data):
+                if data is not None:
+                    results[key] = data
+                else:
+                    errors += 1
+            before = completed
+            completed += len(batch)
+
+            if completed // 50 != before // 50 or completed == total:
+                elapsed = time.time() - start
+                rate = completed / elapsed if elapsed > 0 else 0
+                eta = (total - completed) / rate / 60 if rate > 0 else 0
+                sys.stdout.write(
+                    f"\r  [{completed:>5,}/{total:,}] "
+                    f"{rate:.1f}/s | "
+                    f"{errors} err | "
+                    f"ETA {eta:.1f}m   "
+                )
+                sys.stdout.flush()
+
+                # Checkpoint every 500
+                if completed // 500 != before // 500:
+                    results.commit()
+    finally:
+        client.close()
+    print()
+    client.report()
+    return errors
+
+
 def main():
     test_mode = "--test" in sys.argv
     market = get_market()
@@ -348,12 +435,11 @@ def main():
 
     listings = load_listings_from_csv(market)
 
-    # Load existing (incremental — skip already computed)
-    existing = {}
-    if os.path.exists(output_file):
-        with open(output_file) as f:
-            existing = json.load(f)
-        print(f"  Loaded {len(existing):,} cached parcels")
+    # Open the parcel store (incremental — skip already computed)
+    results = ResultStore(output_file)
+    if len(results):
+        print(f"  Loaded {len(results):,} cached parcels")
+    existing = results.get_many(f"{lat},{lng}" for lat, lng in listings)
 
     # --refetch-dims: re-query parcels that have data but are missing lotWidth
     refetch_dims = "--refetch-dims" in sys.argv
@@ -372,68 +458,37 @@ def main():
 
     total = len(work)
     fire_source = "CAL FIRE statewide" if not market.get("fire_url") else "local"
+    fire_zones = ensure_fire_zones(market, force="--sync-fire" in sys.argv) if total else None
     print(f"\n{'='*60}")
     print(f"  {market['name']} ArcGIS — Parcel + Fire Zone Fetcher")
     if test_mode:
         print(f"  ** TEST MODE — 10 listings **")
     print(f"{'='*60}")
     print(f"\n  Listings from CSV: {len(listings):,}")
-    print(f"  Already cached: {len(existing):,}")
+    print(f"  Already cached: {len(results):,}")
     print(f"  To process: {total:,}")
     print(f"  Workers: {MAX_WORKERS}")
-    print(f"  Fire zone source: {fire_source}")
-    est_min = total * 2 / MAX_WORKERS * 0.5 / 60
+    if fire_zones is not None:
+        print(f"  Fire zone source: {fire_source} ({len(fire_zones):,} local VHFHSZ polygons)")
+    elif total:
+        print("  ⚠️  No local fire zones — fireZone left unset (rerun: python3 fire_zones.py)")
+    est_min = total / BATCH_SIZE / MAX_WORKERS * 1.0 / 60
     print(f"  Est. time: {est_min:.1f} minutes\n")
 
     if total == 0:
         print("  All listings already have parcel data. Done!\n")
+        results.close()
         return
 
-    results = dict(existing)
-    completed = 0
-    errors = 0
     start = time.time()
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-        futures = {}
-        for lat, lng, key in work:
-            fut = pool.submit(fetch_parcel_data, lat, lng, market)
-            futures[fut] = key
-
-        for fut in as_completed(futures):
-            key = futures[fut]
-            completed += 1
-            try:
-                data = fut.result()
-                if data is not None:
-                    results[key] = data
-                else:
-                    errors += 1
-            except Exception:
-                errors += 1
-
-            if completed % 50 == 0 or completed == total:
-                elapsed = time.time() - start
-                rate = completed / elapsed if elapsed > 0 else 0
-                eta = (total - completed) / rate / 60 if rate > 0 else 0
-                sys.stdout.write(
-                    f"\r  [{completed:>5,}/{total:,}] "
-                    f"{rate:.1f}/s | "
-                    f"{errors} err | "
-                    f"ETA {eta:.1f}m   "
-                )
-                sys.stdout.flush()
-
-                # Checkpoint every 500
-                if completed % 500 == 0:
-                    with open(output_file, "w") as f:
-                        json.dump(results, f)
-
+    try:
+        errors = asyncio.run(fetch_all(work, results, market, fire_zones))
+    finally:
+        results.commit()
     elapsed = time.time() - start
 
     # Final save
-    with open(output_file, "w") as f:
-        json.dump(results, f)
+    results.export_json()
 
     print(f"\n\n  Done in {elapsed / 60:.1f} minutes")
     print(f"  Total parcels: {len(results):,}")
@@ -462,6 +517,7 @@ def main():
         print(f"  Lot width: median {widths[len(widths)//2]:,}', min {widths[0]:,}', max {widths[-1]:,}'")
         print(f"  <40': {narrow:,} | 40-60': {medium:,} | 60-100': {wide:,} | 100'+: {very_wide:,}")
 
+    results.close()
     print(f"\n  Written: {output_file}")
     print(f"  Next: python3 listings_build.py\n")
 
@@ -15,6 +15,7 @@ import requests
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file
+from columnar import load_records
 
 market = get_market()
 listings_file = market_file("listings.js", market)
@@ -26,11 +27,7 @@ if not os.path.exists(listings_file):
     print(f"   ❌ {listings_file} not found — run: python3 listings_build.py")
     sys.exit(1)
 
-with open(listings_file, "r") as f:
-    raw = f.read()
-start = raw.index("[")
-end = raw.rindex("]") + 1
-listings = json.loads(raw[start:end])
+listings = load_records(listings_file, "LOADED_LISTINGS", ["zip"]) or []
 
 our_zips = set()
 for l in listings:
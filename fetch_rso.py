@@ -31,10 +31,11 @@ SD NOTE:
   still applies but there is no public database to query for SD.
 """
 
-import json, os, sys
+import os, sys
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file
+from js_artifacts import load_js_var
 
 market = get_market()
 
@@ -54,11 +55,7 @@ print("🏛️  RSO / Ellis Act Assessment — LA Market")
 print("=" * 60)
 
 # Parse listings.js
-with open(LISTINGS_FILE) as f:
-    content = f.read()
-start = content.index("[")
-end = content.rindex("]") + 1
-listings = json.loads(content[start:end])
+listings = load_js_var(LISTINGS_FILE, "LOADED_LISTINGS") or []
 
 print(f"   Loaded {len(listings):,} listings")
 
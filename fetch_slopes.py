@@ -6,25 +6,40 @@ Computes lot slope for each listing using USGS 1m LiDAR elevation data.
 For each listing, queries elevation at 5 points (center + 30m N/S/E/W),
 then computes max slope grade across the 4 cardinal directions.
 
-Uses USGS Elevation Point Query Service (1m resolution, free, no API key).
-
-Saves to slopes.json — keyed by "lat,lng" → slope percent.
+Uses USGS Elevation Point Query Service (1m resolution, free, no API key),
+through the shared asyncio client (http_client.py): one pooled keep-alive
+session, MAX_WORKERS requests in flight, unified 429/503 backoff. Samples
+go through the ~1 m elevation cache shared with fetch_elevation.py
+(elevation_cache.py), so re-runs and neighboring listings reuse them.
+
+--dem computes the same 5-point slope offline from local USGS 3DEP tiles
+(dem_tiles.py, bilinear samples from memory-mapped .npy tiles), with no
+network calls. DEM slopes are stored as {"slope": pct, "src": "dem10m"}
+(the tile resolution). A later run without --dem recomputes them from
+1 m EPQS samples. --dem refuses tiles too coarse for the 30 m offsets.
+
+Saves to slopes.json — keyed by "lat,lng" → slope percent. Results go to
+slopes.json.sqlite as they arrive (result_store.py); checkpoints are commits
+and the JSON is exported once at the end.
 Supports incremental runs (skips already-computed listings).
 
 Usage:
   python3 fetch_slopes.py          # All listings (~35 min)
   python3 fetch_slopes.py --test   # First 50 only
+  python3 fetch_slopes.py --no-cache  # Bypass the shared elevation sample cache
+  python3 fetch_slopes.py --dem    # Offline from dem_tiles/ (run dem_tiles.py first)
   python3 listings_build.py        # Rebuild listings.js with slope data
 """
 
-import json, os, sys, time, re
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
+import asyncio, os, sys, time
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
+from js_artifacts import load_js_var
+from http_client import AsyncClient, bounded_as_completed
+from elevation_cache import ElevationCache
+from result_store import ResultStore
 
 # ── Config ──
-EPQS_URL = "https://epqs.nationalmap.gov/v1/json"
 LAT_OFFSET = 0.00027   # ~30m north/south
 LNG_OFFSET = 0.00033   # ~30m east/west at 34°N latitude
 HORIZ_DIST = 30.0      # meters between center and offset points
@@ -32,32 +47,9 @@ MAX_WORKERS = 25
 OUTPUT_FILE = "slopes.json"
 
 
-def fetch_elevation(lat, lng, retries=2):
-    """Fetch elevation in meters from USGS EPQS (1m LiDAR)."""
-    for attempt in range(retries + 1):
-        try:
-            resp = requests.get(EPQS_URL, params={
-                "x": lng, "y": lat,
-                "wkid": 4326, "units": "Meters",
-                "includeDate": "false"
-            }, timeout=15)
-            if resp.status_code == 200:
-                data = resp.json()
-                val = data.get("value")
-                if val is not None:
-                    return float(val)
-            elif resp.status_code in (429, 503):
-                time.sleep(5 + attempt * 5)
-                continue
-        except Exception:
-            if attempt < retries:
-                time.sleep(2)
-    return None
-
-
-def compute_slope(lat, lng):
-    """Query 5 elevation points and compute max slope grade (percent)."""
-    points = [
+def slope_points(lat, lng):
+    """Center + 30m N/S/E/W sample points as (label, lat, lng)."""
+    return [
         ("center", lat, lng),
         ("north", lat + LAT_OFFSET, lng),
         ("south", lat - LAT_OFFSET, lng),
@@ -65,12 +57,30 @@ def compute_slope(lat, lng):
         ("west", lat, lng - LNG_OFFSET),
     ]
 
-    elevations = {}
-    for label, plat, plng in points:
-        elev = fetch_elevation(plat, plng)
-        if elev is None:
-            return None
-        elevations[label] = elev
+
+async def compute_slope(client, cache, lat, lng):
+    """Query 5 elevation points (concurrently) and compute max slope grade (percent)."""
+    points = slope_points(lat, lng)
+    values = await asyncio.gather(*(cache.sample(client, plat, plng) for _, plat, plng in points))
+    return slope_from_elevations(points, values)
+
+
+def compute_slope_dem(dem, lat, lng):
+    """compute_slope from local DEM tiles."""
+    points = slope_points(lat, lng)
+    return slope_from_elevations(points, [dem.sample(plat, plng) for _, plat, plng in points])
+
+
+def slope_value(entry):
+    """Slope percent of a slopes.json entry (a number, or a DEM-tagged dict)."""
+    return entry["slope"] if isinstance(entry, dict) else entry
+
+
+def slope_from_elevations(points, values):
+    """Max slope grade (percent) from the 5 sample elevations, or None if any is missing."""
+    if any(v is None for v in values):
+        return None
+    elevations = {label: v for (label, _, _), v in zip(points, values)}
 
     center = elevations["center"]
     max_grade = 0
@@ -82,35 +92,96 @@ def compute_slope(lat, lng):
     return round(max_grade, 1)
 
 
+async def compute_all(work, results):
+    """Compute slopes for work [(lat, lng, key)] into results; returns the error count."""
+    total = len(work)
+    completed = 0
+    errors = 0
+    start = time.time()
+    client = AsyncClient(concurrency=MAX_WORKERS)
+    cache = ElevationCache(enabled="--no-cache" not in sys.argv)
+    try:
+        async for (lat, lng, key), slope in bounded_as_completed(
+                work, lambda w: compute_slope(client, cache, w[0], w[1]), limit=MAX_WORKERS * 2):
+            completed += 1
+            if slope is not None:
+                results[key] = slope
+            else:
+                errors += 1
+
+            if completed % 200 == 0 or completed == total:
+                elapsed = time.time() - start
+                rate = completed / elapsed if elapsed > 0 else 0
+                eta = (total - completed) / rate / 60 if rate > 0 else 0
+                sys.stdout.write(
+                    f"\r  [{completed:>5,}/{total:,}] "
+                    f"{rate:.1f}/s | "
+                    f"{errors} err | "
+                    f"ETA {eta:.1f}m   "
+                )
+                sys.stdout.flush()
+
+                # Checkpoint every 1000
+                if completed % 1000 == 0:
+                    results.commit()
+    finally:
+        client.close()
+        cache.close()
+    print()
+    client.report()
+    cache.report()
+    return errors
+
+
+def compute_all_dem(work, results, dem):
+    """compute_all from local DEM tiles (--dem), tagging each slope with dem.src; returns the error count."""
+    errors = 0
+    start = time.time()
+    for lat, lng, key in work:
+        slope = compute_slope_dem(dem, lat, lng)
+        if slope is not None:
+            results[key] = {"slope": slope, "src": dem.src}
+        else:
+            errors += 1
+    elapsed = time.time() - start
+    print(f"  DEM: {len(work):,} listings in {elapsed:.1f}s ({len(work) / max(elapsed, 1e-9):,.0f}/s) | "
+          f"{dem.stats['missing']:,} samples outside downloaded tiles")
+    return errors
+
+
 def main():
     test_mode = "--test" in sys.argv
+    dem_mode = "--dem" in sys.argv
+    dem = None
+    if dem_mode:
+        from dem_tiles import DemSampler
+        dem = DemSampler()
+        if not dem.resolves(HORIZ_DIST):
+            print(f"\n  ❌ DEM tiles are ~{dem.res_m:g} m — too coarse for {HORIZ_DIST:g} m slope offsets. "
+                  f"Download finer tiles (python3 dem_tiles.py --res 3) or run without --dem.\n")
+            sys.exit(1)
 
     # Load listings
     if not os.path.exists("listings.js"):
         print("  No listings.js found. Run listings_build.py first.")
         sys.exit(1)
 
-    with open("listings.js") as f:
-        raw = f.read()
-    match = re.search(r"=\s*(\[.*\])\s*;?\s*$", raw, re.DOTALL)
-    if not match:
+    listings = load_js_var("listings.js", "LOADED_LISTINGS")
+    if listings is None:
         print("  Could not parse listings.js")
         sys.exit(1)
 
-    listings = json.loads(match.group(1))
-
-    # Load existing slopes (incremental — skip already computed)
-    existing = {}
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE) as f:
-            existing = json.load(f)
-        print(f"  Loaded {len(existing):,} cached slopes")
+    # Open the slope store (incremental — skip already computed)
+    results = ResultStore(OUTPUT_FILE)
+    if len(results):
+        print(f"  Loaded {len(results):,} cached slopes")
+    existing = results.get_many(f"{l['lat']},{l['lng']}" for l in listings)
 
-    # Build work list
+    # Build work list (an EPQS run also redoes slopes computed from the DEM)
     work = []
     for l in listings:
         key = f"{l['lat']},{l['lng']}"
-        if key not in existing:
+        if key not in existing or (not dem_mode and isinstance(existing[key], dict)):
             work.append((l["lat"], l["lng"], key))
 
     if test_mode:
@@ -123,68 +194,36 @@ def main():
         print(f"  ** TEST MODE — 50 listings **")
     print(f"{'='*60}")
     print(f"\n  Listings to process: {total:,}")
-    print(f"  Already cached: {len(existing):,}")
-    print(f"  API calls needed: {total * 5:,}")
-    print(f"  Workers: {MAX_WORKERS}")
-    est_min = total * 5 / MAX_WORKERS * 0.4 / 60
-    print(f"  Est. time: {est_min:.0f} minutes\n")
+    print(f"  Already cached: {len(results):,}")
+    if dem_mode:
+        print("  Source: local DEM tiles (no API calls)\n")
+    else:
+        print(f"  API calls needed: {total * 5:,}")
+        print(f"  Workers: {MAX_WORKERS}")
+        est_min = total * 5 / MAX_WORKERS * 0.4 / 60
+        print(f"  Est. time: {est_min:.0f} minutes\n")
 
     if total == 0:
         print("  All listings already have slopes. Done!\n")
+        results.close()
         return
 
-    results = dict(existing)
-    completed = 0
-    errors = 0
     start = time.time()
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-        futures = {}
-        for lat, lng, key in work:
-            fut = pool.submit(compute_slope, lat, lng)
-            futures[fut] = key
-
-        for fut in as_completed(futures):
-            key = futures[fut]
-            completed += 1
-            try:
-                slope = fut.result()
-                if slope is not None:
-                    results[key] = slope
-                else:
-                    errors += 1
-            except Exception:
-                errors += 1
-
-            if completed % 200 == 0 or completed == total:
-                elapsed = time.time() - start
-                rate = completed / elapsed if elapsed > 0 else 0
-                eta = (total - completed) / rate / 60 if rate > 0 else 0
-                sys.stdout.write(
-                    f"\r  [{completed:>5,}/{total:,}] "
-                    f"{rate:.1f}/s | "
-                    f"{errors} err | "
-                    f"ETA {eta:.1f}m   "
-                )
-                sys.stdout.flush()
-
-                # Checkpoint every 1000
-                if completed % 1000 == 0:
-                    with open(OUTPUT_FILE, "w") as f:
-                        json.dump(results, f)
-
+    try:
+        errors = compute_all_dem(work, results, dem) if dem_mode else asyncio.run(compute_all(work, results))
+    finally:
+        results.commit()
     elapsed = time.time() - start
 
     # Final save
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(results, f)
+    results.export_json()
 
     print(f"\n\n  Done in {elapsed / 60:.1f} minutes")
     print(f"  Total slopes: {len(results):,}")
     print(f"  Errors: {errors}")
 
     # Distribution
-    slopes = [v for v in results.values() if isinstance(v, (int, float))]
+    slopes = [slope_value(v) for v in results.values() if isinstance(slope_value(v), (int, float))]
     if slopes:
         slopes.sort()
         flat = sum(1 for s in slopes if s < 5)
@@ -197,6 +236,7 @@ def main():
         print(f"    Moderate (15-25%): {moderate:,} ({moderate / len(slopes) * 100:.1f}%)")
         print(f"    Steep (25%+):      {steep:,} ({steep / len(slopes) * 100:.1f}%)")
 
+    results.close()
     print(f"\n  Written: {OUTPUT_FILE}")
     print(f"  Next: python3 listings_build.py")
     print(f"  Then refresh http://localhost:8080\n")
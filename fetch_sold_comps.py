@@ -2,7 +2,20 @@
 """
 fetch_sold_comps.py
 Pulls recent residential sold comps via Redfin's gis-csv endpoint.
-Uses the same adaptive tiling as fetch_listings.py for full coverage.
+Uses the same adaptive tiling and concurrent, rate-limited tile scheduler
+as fetch_listings.py for full coverage (--workers N, --rate R), including
+starting from the last successful run's leaf tiles (redfin_sold.leaves.json).
+Tile responses are cached locally (response_cache.py, --max-age H, --no-cache).
+
+--incremental only asks Redfin for sales since the last *complete* run
+(plus SOLD_OVERLAP_DAYS for late-recorded sales). It then merges the
+previous rows back in and drops sales older than SOLD_WITHIN_DAYS, or
+whose sale date doesn't parse. A run is complete when no tile failed or
+was blocked. Only then is redfin_sold.complete.json stamped with the run's
+start time, so sales in failed tiles are re-fetched by the next window.
+Without a stamp, --incremental falls back to a full fetch. A full run with
+failed tiles keeps the previous CSV's rows inside those tiles, so their
+older sales are not lost until a run fetches them again.
 
 Output: redfin_sold.csv → then run build_comps.py to update data.js
 
@@ -10,6 +23,8 @@ Usage:
   python3 fetch_sold_comps.py                    # Full LA County, last 2 years
   python3 fetch_sold_comps.py --market sd         # Full SD County
   python3 fetch_sold_comps.py --market sd --test  # Single tile test
+  python3 fetch_sold_comps.py --workers 2 --rate 0.3  # Gentler on Redfin
+  python3 fetch_sold_comps.py --incremental       # New sales only, merged into redfin_sold.csv
 """
 
 import requests
@@ -19,71 +34,106 @@ import os
 import time
 import sys
 import random
+import json
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
-from market_config import get_market, market_file, REDFIN_GIS_CSV_URL, REDFIN_HEADERS, REDFIN_NUM_HOMES, REDFIN_DELAY_MIN, REDFIN_DELAY_MAX
-from tile_utils import build_grid, subdivide_tile, tile_to_poly, tile_label
+from market_config import get_market, market_file, REDFIN_GIS_CSV_URL, REDFIN_HEADERS, REDFIN_NUM_HOMES
+from tile_utils import build_grid, subdivide_tile, tile_to_poly, tile_label, tile_order, RateLimiter, run_tiles, scheduler_settings, plan_tiles, save_leaves, leaf_record
+from response_cache import ResponseCache, cache_settings
+from sale_dates import sale_day_number
+from datetime import date, datetime, timezone
 
 # ── Config ──
 MAX_RETRIES = 5
 BACKOFF_BASE = 15  # seconds — doubles each retry: 15, 30, 60, 120, 240
 MAX_SUBDIVIDE_DEPTH = 4
 SOLD_WITHIN_DAYS = 730  # 2 years
+SOLD_OVERLAP_DAYS = 14  # --incremental: re-fetch this far before the last complete run
 
 # ── Counters ──
 header_row = None
 all_data_rows = []
 seen_keys = set()
+leaf_rows = []  # (leaf_record, CSV rows) per ingested leaf — deduped in tile order at the end
+rows_fetched = 0
 tiles_fetched = 0
 tiles_with_data = 0
 tiles_empty = 0
 tiles_subdivided = 0
+tiles_failed = 0  # Blocked / errored tiles — the run is not complete
+failed_tiles = []  # Their bounds: a full run keeps the previous rows inside them
 dupes_skipped = 0
+leaves = []  # leaf_record() per tile that was ingested (not split)
+sold_within_days = SOLD_WITHIN_DAYS  # Query window (narrower with --incremental)
 
 
-def fetch_tile(tile, market, retries=0):
+def parse_tile_csv(text):
+    """gis-csv response text → CSV rows (header first), or [] if it holds no listings."""
+    text = text.strip()
+    if not text or text.startswith("<!") or text.startswith("{"):
+        return []
+    rows = list(csv.reader(io.StringIO(text)))
+    return rows if len(rows) > 1 else []
+
+
+def fetch_tile(tile, market, limiter, cache, retries=0):
     poly = tile_to_poly(tile)
     url = (
         f"{REDFIN_GIS_CSV_URL}?al=1&market={market['redfin_market']}&num_homes={REDFIN_NUM_HOMES}"
         f"&page_number=1&status=130&uipt=1,2,3,4"
-        f"&v=8&sold_within_days={SOLD_WITHIN_DAYS}"
+        f"&v=8&sold_within_days={sold_within_days}"
         f"&user_poly={poly}"
     )
 
+    cached = cache.get(url) if retries == 0 else None
+    if cached is not None:
+        return parse_tile_csv(cached)
+
+    limiter.acquire()
     try:
         session = requests.Session()
         resp = session.get(url, headers=REDFIN_HEADERS, timeout=30)
         session.close()
 
         if resp.status_code == 200:
-            text = resp.text.strip()
-            if not text or text.startswith("<!") or text.startswith("{"):
-                return []
-            reader = csv.reader(io.StringIO(text))
-            rows = list(reader)
-            return rows if len(rows) > 1 else []
+            cache.put(url, resp.status_code, resp.text)
+            return parse_tile_csv(resp.text)
 
         elif resp.status_code in (429, 403):
             if retries < MAX_RETRIES:
                 wait = BACKOFF_BASE * (2 ** retries) + random.uniform(0, 10)
-                print(f"\n      {resp.status_code} — waiting {wait:.0f}s (retry {retries+1}/{MAX_RETRIES})...")
-                time.sleep(wait)
-                return fetch_tile(tile, market, retries + 1)
+                print(f"\n      {resp.status_code} — pausing all workers {wait:.0f}s (retry {retries+1}/{MAX_RETRIES})...")
+                limiter.backoff(wait)
+                return fetch_tile(tile, market, limiter, cache, retries + 1)
             else:
                 print(f"\n      Blocked on {tile_label(tile)}, skipping")
-                return []
+                return None
         else:
-            return []
+            return None
 
     except requests.exceptions.Timeout:
         if retries < MAX_RETRIES:
             wait = BACKOFF_BASE * (2 ** retries)
             time.sleep(wait)
-            return fetch_tile(tile, market, retries + 1)
-        return []
+            return fetch_tile(tile, market, limiter, cache, retries + 1)
+        return None
     except Exception as e:
         print(f"\n      Error: {e}")
-        return []
+        return None
+
+
+def buffer_rows(leaf, rows):
+    """Hold a leaf's CSV rows until ingest_leaves() (so completion order doesn't matter)."""
+    global rows_fetched
+    leaf_rows.append((leaf, rows))
+    rows_fetched += len(rows) - 1
+
+
+def ingest_leaves():
+    """Dedup every buffered leaf's rows into all_data_rows, in tile_order()."""
+    for _, rows in sorted(leaf_rows, key=lambda e: tile_order(e[0])):
+        ingest_rows(rows)
+    leaf_rows.clear()
 
 
 def ingest_rows(rows):
@@ -115,26 +165,30 @@ def ingest_rows(rows):
     return new_count
 
 
-def process_tile(tile, market):
-    global tiles_fetched, tiles_with_data, tiles_empty, tiles_subdivided
+def handle_tile(tile, rows):
+    """Record a fetched tile (main thread; rows None = failed). Returns its sub-tiles to queue if it hit the cap."""
+    global tiles_fetched, tiles_with_data, tiles_empty, tiles_subdivided, tiles_failed
 
     tiles_fetched += 1
 
     sys.stdout.write(
         f"\r  [req {tiles_fetched:>3}] "
         f"{tile_label(tile)}  "
-        f"| {len(all_data_rows):,} sold  "
-        f"| {dupes_skipped:,} dupes  "
+        f"| {rows_fetched:,} rows  "
         f"| {tiles_subdivided} splits   "
     )
     sys.stdout.flush()
 
-    rows = fetch_tile(tile, market)
+    if rows is None:
+        # Failed, not empty: no leaf record, so the next plan doesn't merge it away
+        tiles_failed += 1
+        failed_tiles.append(tile)
+        return []
 
     if not rows:
         tiles_empty += 1
-        time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
-        return
+        leaves.append(leaf_record(tile, 0))
+        return []
 
     data_count = len(rows) - 1
     hit_cap = data_count >= REDFIN_NUM_HOMES - 5
@@ -142,30 +196,110 @@ def process_tile(tile, market):
     if hit_cap and tile.get('depth', 0) < MAX_SUBDIVIDE_DEPTH:
         tiles_subdivided += 1
         print(f"\n      Cap hit ({data_count}) on {tile_label(tile)} — splitting")
-        time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
-        for st in subdivide_tile(tile):
-            process_tile(st, market)
-        return
+        return subdivide_tile(tile)
 
-    new = ingest_rows(rows)
-    if new > 0:
+    leaves.append(leaf_record(tile, data_count))
+    buffer_rows(leaves[-1], rows)
+    if data_count > 0:
         tiles_with_data += 1
     else:
         tiles_empty += 1
 
     if hit_cap and tile.get('depth', 0) >= MAX_SUBDIVIDE_DEPTH:
         print(f"\n      Warning: {tile_label(tile)} at cap after max depth")
+    return []
 
-    time.sleep(random.uniform(REDFIN_DELAY_MIN, REDFIN_DELAY_MAX))
+
+def in_tiles(lat, lng, tiles):
+    """True if the CSV lat/lng strings parse and fall inside one of tiles."""
+    try:
+        lat, lng = float(lat), float(lng)
+    except ValueError:
+        return False
+    return any(t["lat_min"] <= lat <= t["lat_max"] and t["lng_min"] <= lng <= t["lng_max"] for t in tiles)
+
+
+def merge_previous(output_file, tiles=None):
+    """Add the previous CSV's rows (fetched rows win), drop sales past the window.
+
+    --incremental merges every previous row. After a full run with failed
+    tiles, pass those tiles: only previous rows inside them are merged.
+    Previous rows whose sale date doesn't parse are dropped too. Returns
+    (rows merged, rows expired).
+    """
+    global header_row
+    with open(output_file, newline="", encoding="utf-8") as f:
+        old = list(csv.reader(f))
+    if not old:
+        return 0, 0
+    if header_row is None:
+        header_row = old[0]
+    cols = [old[0].index(c) if c in old[0] else None for c in header_row]
+    remapped = [[row[c] if c is not None and c < len(row) else "" for c in cols] for row in old[1:]]
+    if tiles is not None:
+        if "LATITUDE" in header_row and "LONGITUDE" in header_row:
+            lat_idx, lng_idx = header_row.index("LATITUDE"), header_row.index("LONGITUDE")
+            remapped = [r for r in remapped if in_tiles(r[lat_idx], r[lng_idx], tiles)]
+        else:
+            remapped = []
+    fetched = len(all_data_rows)
+    merged = ingest_rows([header_row] + remapped)
+
+    date_idx = header_row.index("SOLD DATE") if "SOLD DATE" in header_row else None
+    if date_idx is None:
+        return merged, 0
+    cutoff = date.today().toordinal() - SOLD_WITHIN_DAYS
+    # Fetched rows are in the query window already; previous rows must prove it
+    kept = [r for i, r in enumerate(all_data_rows)
+            if (sale_day_number(r[date_idx]) or (cutoff if i < fetched else cutoff - 1)) >= cutoff]
+    expired = len(all_data_rows) - len(kept)
+    all_data_rows[:] = kept
+    return merged, expired
+
+
+def load_complete_stamp(stamp_file):
+    """Start time (epoch seconds) of the last run with no failed tiles, or None."""
+    if not os.path.exists(stamp_file):
+        return None
+    try:
+        with open(stamp_file) as f:
+            return float(json.load(f)["started"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def save_complete_stamp(stamp_file, started, window_days):
+    with open(stamp_file + ".tmp", "w") as f:
+        json.dump({"started": started, "window_days": window_days,
+                   "started_iso": datetime.fromtimestamp(started, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}, f)
+    os.replace(stamp_file + ".tmp", stamp_file)
 
 
 def main():
+    global sold_within_days
     test_mode = "--test" in sys.argv
+    workers, rate = scheduler_settings()
+    cache_on, max_age = cache_settings()
     market = get_market()
-    tiles = build_grid(market)
     output_file = market_file("redfin_sold.csv", market)
+    leaf_file = market_file("redfin_sold.leaves.json", market)
+    stamp_file = market_file("redfin_sold.complete.json", market)
+    run_started = time.time()
+    last_complete = load_complete_stamp(stamp_file)
+    incremental = "--incremental" in sys.argv and not test_mode and os.path.exists(output_file)
+    if incremental and last_complete is None:
+        print(f"\n  No {stamp_file} (last complete run) — running a full {SOLD_WITHIN_DAYS}-day fetch instead")
+        incremental = False
+    if incremental:
+        age_days = (run_started - last_complete) / 86400
+        sold_within_days = min(SOLD_WITHIN_DAYS, int(age_days) + 1 + SOLD_OVERLAP_DAYS)
+        # The leaf tiling is sized for 2 years of sales; a short window starts from the coarse grid
+        tiles, plan = build_grid(market), {"source": "grid"}
+    else:
+        tiles, plan = plan_tiles(market, leaf_file, REDFIN_NUM_HOMES, MAX_SUBDIVIDE_DEPTH)
 
     if test_mode:
+        tiles = build_grid(market)
         center_lat = (market["lat_min"] + market["lat_max"]) / 2
         center_lng = (market["lng_min"] + market["lng_max"]) / 2
         test_tile = None
@@ -182,24 +316,45 @@ def main():
     if test_mode:
         print("  ** TEST MODE — single tile **")
     print("=" * 60)
-    print(f"\n  Grid: {len(tiles)} tiles, adaptive subdivision")
-    print(f"  Sold within: {SOLD_WITHIN_DAYS} days ({SOLD_WITHIN_DAYS // 365} years)")
+    if not test_mode and plan["source"] == "leaves":
+        print(f"\n  Starting tiles: {len(tiles)} from the last run's leaves ({plan['merged']} merged, {plan['split']} pre-split)")
+    else:
+        print(f"\n  Grid: {len(tiles)} tiles, adaptive subdivision")
+    if incremental:
+        print(f"  Sold within: {sold_within_days} days (incremental, merged into {output_file})")
+    else:
+        print(f"  Sold within: {SOLD_WITHIN_DAYS} days ({SOLD_WITHIN_DAYS // 365} years)")
+    print(f"  Response cache: {f'{max_age / 3600:g}h TTL' if cache_on else 'off'}")
     print(f"  Cap per tile: {REDFIN_NUM_HOMES} (auto-subdivides if hit)")
+    print(f"  Rate limit: {rate:.2f} req/s across {workers} workers (shared token bucket)")
     print(f"  Retries: {MAX_RETRIES} with exponential backoff ({BACKOFF_BASE}s base)")
     print(f"  Output: {output_file}\n")
 
     start_time = time.time()
-    for tile in tiles:
-        process_tile(tile, market)
+    limiter = RateLimiter(rate)
+    cache = ResponseCache(market_file("redfin_cache.sqlite", market), max_age, enabled=cache_on)
+    run_tiles(tiles, lambda t: fetch_tile(t, market, limiter, cache), handle_tile, workers)
+    cache.close()
+    ingest_leaves()
 
     elapsed = time.time() - start_time
-
-    print(f"\n\n  Done in {elapsed / 60:.1f} minutes ({tiles_fetched} requests)")
+    merged = None
+    if incremental:
+        merged, expired = merge_previous(output_file)
+    elif failed_tiles and not test_mode and os.path.exists(output_file):
+        merged, expired = merge_previous(output_file, failed_tiles)
+
+    print(f"\n\n  Done in {elapsed / 60:.1f} minutes ({tiles_fetched} tiles, "
+          f"{cache.stats['misses'] if cache_on else tiles_fetched} requests, {cache.stats['hits']} from cache)")
     print(f"\n  Results:")
     print(f"     Tiles with data:   {tiles_with_data}")
     print(f"     Tiles empty:       {tiles_empty}")
     print(f"     Tiles subdivided:  {tiles_subdivided}")
+    print(f"     Tiles failed:      {tiles_failed}")
     print(f"     Duplicates:        {dupes_skipped:,}")
+    if merged is not None:
+        where = "" if incremental else " in failed tiles"
+        print(f"     Kept from previous{where}: {merged:,} ({expired:,} older than {SOLD_WITHIN_DAYS} days dropped)")
     print(f"     Unique sold comps: {len(all_data_rows):,}")
 
     if not all_data_rows:
@@ -210,11 +365,23 @@ def main():
         writer = csv.writer(f)
         writer.writerow(header_row)
         writer.writerows(all_data_rows)
+    if not test_mode and not incremental:
+        save_leaves(leaf_file, market, leaves)
+    if not test_mode and not tiles_failed:
+        save_complete_stamp(stamp_file, run_started, sold_within_days)
 
     size_kb = os.path.getsize(output_file) / 1024
     print(f"\n  Written: {output_file}")
     print(f"     Size: {size_kb:.0f} KB ({size_kb / 1024:.1f} MB)")
     print(f"     Rows: {len(all_data_rows):,}")
+    if not test_mode and not incremental:
+        print(f"     Leaf tiles: {leaf_file} ({len(leaves)} tiles, seeds the next run)")
+    if not test_mode:
+        if tiles_failed:
+            print(f"     ⚠️  {tiles_failed} tiles failed — previous rows there kept, run not marked complete; "
+                  f"the next --incremental run re-fetches from the last complete run")
+        else:
+            print(f"     Complete run stamped: {stamp_file}")
     print(f"\n  Next: python3 build_comps.py")
     print(f"     Then: python3 listings_build.py")
     print(f"     Then refresh http://localhost:8080\n")
@@ -14,25 +14,48 @@ Writes: zoning.json — keyed by "lat,lng"
 
 Supports incremental runs (skips already-fetched listings).
 
+Requests go through the shared asyncio client (http_client.py). Each
+endpoint gets its own worker pool and rate limit (ENDPOINT_CONCURRENCY /
+ENDPOINT_RATE, overridable per endpoint with "concurrency" / "rate"), and
+many listings run their cascades at once. Endpoints whose "bbox" cannot
+contain the point are skipped without a request. The cascade order per
+listing is unchanged, so results match a serial run.
+
+Each lookup is upserted into zoning.json.sqlite as it arrives (result_store.py),
+so an interrupted run resumes where it stopped. zoning.json is exported once
+at the end.
+
+--bulk skips the per-point queries. Each endpoint's layer is downloaded
+whole (polygon_layers.py) into zoning_layers.json, and every listing is
+matched offline with point-in-polygon, using the same cascade and CLASSIFY_FNS.
+A layer is downloaded again when it is older than ZONING_SYNC_DAYS, when its
+endpoint config changes, or when --sync is given.
+
 Usage:
   python3 fetch_zoning.py                        # All LA listings
   python3 fetch_zoning.py --market sd             # All SD listings
   python3 fetch_zoning.py --market sd --test      # First 50 only
   python3 fetch_zoning.py --analyze               # Run on 50 listings + compare
+  python3 fetch_zoning.py --bulk                  # Local polygons, all listings
+  python3 fetch_zoning.py --bulk --sync           # Re-download layers first
 """
 
-import json, os, re, sys, time
-import requests
+import asyncio, json, os, sys, time
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from market_config import get_market, market_file, CLASSIFY_FNS
+from columnar import load_records
+from http_client import AsyncClient, bounded_as_completed
+from polygon_layers import PolygonIndex, download_layer
+from result_store import ResultStore
 
 # ── Config ──
-CHECKPOINT_EVERY = 100
-RATE_LIMIT_DELAY = 0.5  # ~2 req/sec
+ENDPOINT_CONCURRENCY = 4  # Requests in flight per zoning endpoint
+ENDPOINT_RATE = 4         # Requests/sec per zoning endpoint (was serial at ~2 req/sec overall)
+ZONING_SYNC_DAYS = 30     # --bulk: re-download a zoning layer after this long
 
 
-def query_zoning_endpoint(lat, lng, endpoint, retries=2):
+async def query_zoning_endpoint(client, lat, lng, endpoint):
     """Query a single ArcGIS zoning endpoint at a lat/lng point."""
     params = {
         "geometry": f"{lng},{lat}",
@@ -43,69 +66,120 @@ def query_zoning_endpoint(lat, lng, endpoint, retries=2):
         "returnGeometry": "false",
         "f": "json",
     }
-    for attempt in range(retries + 1):
-        try:
-            resp = requests.get(endpoint["url"], params=params, timeout=30)
-            if resp.status_code == 200:
-                data = resp.json()
-                features = data.get("features", [])
-                if features:
-                    attrs = features[0].get("attributes", {})
-                    zone_field = endpoint["zone_field"]
-                    category_field = endpoint.get("category_field")
-
-                    zone = attrs.get(zone_field, "")
-                    # Try common field name variants if primary returns empty
-                    if not zone:
-                        for alt in ("ZONE_CMPLT", "ZONING", "Zone", "ZONE", "ZONE_CLASS"):
-                            zone = attrs.get(alt, "")
-                            if zone:
-                                break
-
-                    category = attrs.get(category_field, "") if category_field else ""
-                    if not category:
-                        for alt in ("CATEGORY", "GEN_PLAN"):
-                            category = attrs.get(alt, "")
-                            if category:
-                                break
-
-                    return {
-                        "zoning": zone,
-                        "category": category,
-                        "source": endpoint["name"],
-                    }
-                return None  # No feature found at this location
-            elif resp.status_code in (429, 503):
-                wait = 3 + attempt * 5
-                print(f"    Rate limited ({resp.status_code}), waiting {wait}s...")
-                time.sleep(wait)
-                continue
-        except requests.exceptions.Timeout:
-            if attempt < retries:
-                print(f"    Timeout on {endpoint['name']}, retry {attempt+1}...")
-                time.sleep(2)
-        except Exception as e:
-            if attempt < retries:
-                time.sleep(2)
-    return None  # All retries failed
-
-
-def fetch_zoning_cascade(lat, lng, market):
+    data = await client.get_json(endpoint["url"], params=params, pool=endpoint["name"])
+    if data is None:
+        return None  # Request failed
+    features = data.get("features", [])
+    if not features:
+        return None  # No feature found at this location
+    zone, category = zone_from_attrs(features[0].get("attributes", {}), endpoint)
+    return {
+        "zoning": zone,
+        "category": category,
+        "source": endpoint["name"],
+    }
+
+
+def zone_from_attrs(attrs, endpoint):
+    """(zone, category) from a zoning feature's attributes."""
+    zone_field = endpoint["zone_field"]
+    category_field = endpoint.get("category_field")
+
+    zone = attrs.get(zone_field, "")
+    # Try common field name variants if primary returns empty
+    if not zone:
+        for alt in ("ZONE_CMPLT", "ZONING", "Zone", "ZONE", "ZONE_CLASS"):
+            zone = attrs.get(alt, "")
+            if zone:
+                break
+
+    category = attrs.get(category_field, "") if category_field else ""
+    if not category:
+        for alt in ("CATEGORY", "GEN_PLAN"):
+            category = attrs.get(alt, "")
+            if category:
+                break
+    return zone, category
+
+
+def endpoint_covers(endpoint, lat, lng):
+    """False when the endpoint's jurisdiction bbox cannot contain the point."""
+    bbox = endpoint.get("bbox")
+    if not bbox:
+        return True
+    lng_min, lat_min, lng_max, lat_max = bbox
+    return lat_min <= lat <= lat_max and lng_min <= lng <= lng_max
+
+
+def classify_result(result, endpoint):
+    """Add the market-specific SB 1123 class to an endpoint hit."""
+    classify_fn = CLASSIFY_FNS[endpoint["classify_fn"]]
+    result["sb1123"] = classify_fn(result["zoning"])
+    return result
+
+
+async def fetch_zoning_cascade(client, lat, lng, market):
     """Try each zoning endpoint in order. First hit with data wins.
 
     Returns dict with zoning, category, sb1123, source — or None.
     """
     for endpoint in market["zoning_endpoints"]:
-        result = query_zoning_endpoint(lat, lng, endpoint)
+        if not endpoint_covers(endpoint, lat, lng):
+            continue
+        result = await query_zoning_endpoint(client, lat, lng, endpoint)
         if result and result.get("zoning"):
-            # Classify using market-specific function
-            classify_fn = CLASSIFY_FNS[endpoint["classify_fn"]]
-            sb_zone = classify_fn(result["zoning"])
-            result["sb1123"] = sb_zone
-            return result
+            return classify_result(result, endpoint)
     return None
 
 
+def local_zoning_cascade(indexes, lat, lng, market):
+    """fetch_zoning_cascade against downloaded layers (--bulk)."""
+    for endpoint in market["zoning_endpoints"]:
+        if not endpoint_covers(endpoint, lat, lng):
+            continue
+        hit = indexes[endpoint["name"]].lookup(lat, lng)
+        if hit and hit[0]:
+            return classify_result({"zoning": hit[0], "category": hit[1], "source": endpoint["name"]}, endpoint)
+    return None
+
+
+def layer_signature(endpoint):
+    """Config that a downloaded layer depends on — a change forces a re-sync."""
+    return [endpoint["url"], endpoint.get("out_fields", "*"), endpoint["zone_field"], endpoint.get("category_field")]
+
+
+async def sync_layers(layers, market, force=False):
+    """Download stale zoning layers into layers (name → entry). Returns names synced."""
+    stale = [ep for ep in market["zoning_endpoints"]
+             if force or ep["name"] not in layers
+             or layers[ep["name"]]["signature"] != layer_signature(ep)
+             or time.time() - layers[ep["name"]]["synced"] > ZONING_SYNC_DAYS * 86400]
+    if not stale:
+        return []
+    client = AsyncClient(hosts={ep["name"]: {"concurrency": ep.get("concurrency", ENDPOINT_CONCURRENCY),
+                                             "rate": ep.get("rate", ENDPOINT_RATE)} for ep in stale})
+    try:
+        downloads = await asyncio.gather(
+            *(download_layer(client, ep["url"], ep.get("out_fields", "*"), pool=ep["name"]) for ep in stale),
+            return_exceptions=True)
+    finally:
+        client.close()
+    client.report()
+    synced = []
+    for ep, features in zip(stale, downloads):
+        if isinstance(features, Exception):
+            print(f"  ⚠️  {ep['name']}: download failed ({features})")
+            continue
+        layers[ep["name"]] = {
+            "signature": layer_signature(ep),
+            "synced": time.time(),
+            "features": [[*zone_from_attrs(attrs, ep), rings] for rings, attrs in features],
+        }
+        print(f"  {ep['name']}: {len(features):,} polygons")
+        synced.append(ep["name"])
+    return synced
+
+
 def load_listings_from_js(market):
     """Parse listings from listings.js (extracts the JSON array)."""
     js_file = market_file("listings.js", market)
@@ -113,18 +187,10 @@ def load_listings_from_js(market):
         print(f"  No {js_file} found.")
         sys.exit(1)
 
-    with open(js_file, encoding="utf-8") as f:
-        content = f.read()
-
-    # Find the JSON array start without slow re.DOTALL regex
-    marker = "LOADED_LISTINGS"
-    idx = content.find(marker)
-    if idx == -1:
+    listings_raw = load_records(js_file, "LOADED_LISTINGS", ["lat", "lng", "zone", "type", "city", "address"])
+    if listings_raw is None:
         print(f"  Could not parse {js_file}")
         sys.exit(1)
-    bracket = content.index("[", idx)
-    decoder = json.JSONDecoder()
-    listings_raw, _ = decoder.raw_decode(content, bracket)
     listings = []
     for item in listings_raw:
         lat = item.get("lat")
@@ -141,15 +207,82 @@ def load_listings_from_js(market):
     return listings
 
 
-def save_cache(cache, output_file):
-    """Write cache to disk."""
-    with open(output_file, "w") as f:
-        json.dump(cache, f, indent=1)
+async def fetch_all(work, cache, market):
+    """Look up zoning for work listings into cache (a ResultStore). Returns (found, source_counts)."""
+    total = len(work)
+    fetched = 0
+    found = 0
+    source_counts = {}
+    endpoints = market["zoning_endpoints"]
+    limits = {ep["name"]: {"concurrency": ep.get("concurrency", ENDPOINT_CONCURRENCY),
+                           "rate": ep.get("rate", ENDPOINT_RATE)} for ep in endpoints}
+    in_flight = 2 * sum(l["concurrency"] for l in limits.values())
+    client = AsyncClient(hosts=limits)
+    try:
+        async for item, result in bounded_as_completed(
+                work, lambda it: fetch_zoning_cascade(client, it["lat"], it["lng"], market), limit=in_flight):
+            key = f"{item['lat']},{item['lng']}"
+            if result:
+                cache[key] = result
+                found += 1
+                src = result.get("source", "unknown")
+                source_counts[src] = source_counts.get(src, 0) + 1
+            else:
+                cache[key] = {"zoning": None, "category": None, "sb1123": None, "source": None}
+
+            fetched += 1
+
+            if fetched % 10 == 0 or fetched == total:
+                print(f"  [{fetched}/{total}] found={found} | last: {item.get('address','')[:40]} → {result.get('zoning','?') if result else '—'}")
+                cache.commit()
+    finally:
+        client.close()
+    client.report()
+    return found, source_counts
+
+
+def run_bulk(listings, cache, market, force_sync):
+    """--bulk: sync the zoning layers, then classify listings offline into cache."""
+    layer_file = market_file("zoning_layers.json", market)
+    layers = {}
+    if os.path.exists(layer_file):
+        with open(layer_file) as f:
+            layers = json.load(f)
+    print(f"  Syncing zoning layers (every {ZONING_SYNC_DAYS} days{', forced' if force_sync else ''})...")
+    if asyncio.run(sync_layers(layers, market, force_sync)):
+        with open(layer_file + ".tmp", "w") as f:
+            json.dump(layers, f, separators=(",", ":"))
+        os.replace(layer_file + ".tmp", layer_file)
+    missing = [ep["name"] for ep in market["zoning_endpoints"] if ep["name"] not in layers]
+    if missing:
+        print(f"  ❌ No local copy of {', '.join(missing)} — rerun later or without --bulk")
+        sys.exit(1)
+
+    t0 = time.time()
+    indexes = {name: PolygonIndex((rings, (zone, category)) for zone, category, rings in layer["features"])
+               for name, layer in layers.items()}
+    print(f"  Indexed {sum(len(ix) for ix in indexes.values()):,} polygons ({time.time() - t0:.1f}s)")
+
+    t0 = time.time()
+    found = 0
+    source_counts = {}
+    for item in listings:
+        result = local_zoning_cascade(indexes, item["lat"], item["lng"], market)
+        key = f"{item['lat']},{item['lng']}"
+        if result:
+            cache[key] = result
+            found += 1
+            source_counts[result["source"]] = source_counts.get(result["source"], 0) + 1
+        else:
+            cache[key] = {"zoning": None, "category": None, "sb1123": None, "source": None}
+    print(f"  Classified {len(listings):,} listings offline ({time.time() - t0:.1f}s)")
+    return found, source_counts
 
 
 def main():
     test_mode = "--test" in sys.argv
     analyze_mode = "--analyze" in sys.argv
+    bulk_mode = "--bulk" in sys.argv
     market = get_market()
     output_file = market_file("zoning.json", market)
 
@@ -160,55 +293,39 @@ def main():
     # Show configured endpoints
     print(f"  Zoning endpoints ({market['name']}):")
     for ep in market["zoning_endpoints"]:
-        print(f"    - {ep['name']} → {ep['zone_field']} → {ep['classify_fn']}")
+        scope = "bbox" if ep.get("bbox") else "everywhere"
+        print(f"    - {ep['name']} → {ep['zone_field']} → {ep['classify_fn']} ({scope}, "
+              f"{ep.get('rate', ENDPOINT_RATE)} req/s)")
 
-    # Load existing cache
-    cache = {}
-    if os.path.exists(output_file):
-        with open(output_file) as f:
-            cache = json.load(f)
+    # Open the zoning store (picks up lookups from an interrupted run)
+    cache = ResultStore(output_file, indent=1)
+    if len(cache):
         print(f"  {len(cache):,} cached zoning lookups")
 
-    # Build work list
-    work = [item for item in listings
-            if f"{item['lat']},{item['lng']}" not in cache]
+    # Build work list (--bulk reclassifies everything — it's offline)
+    cached = set() if bulk_mode else cache.get_many(f"{item['lat']},{item['lng']}" for item in listings)
+    work = [item for item in listings if f"{item['lat']},{item['lng']}" not in cached]
 
     limit = 50 if (test_mode or analyze_mode) else len(work)
     work = work[:limit]
 
     total = len(work)
-    if total == 0:
+    if bulk_mode:
+        found, source_counts = run_bulk(work, cache, market, "--sync" in sys.argv)
+        cache.export_json()
+        print(f"\nDone! {found}/{total} listings matched a zoning polygon.")
+        print(f"Total cached: {len(cache):,} entries → {output_file}")
+        if source_counts:
+            print(f"  Sources: {source_counts}")
+    elif total == 0:
         print("  All listings already cached!")
     else:
         print(f"  Fetching zoning for {total:,} listings (cascade through {len(market['zoning_endpoints'])} endpoints)...")
-        fetched = 0
-        found = 0
-        source_counts = {}
-        for i, item in enumerate(work):
-            key = f"{item['lat']},{item['lng']}"
-            result = fetch_zoning_cascade(item["lat"], item["lng"], market)
-
-            if result:
-                cache[key] = result
-                found += 1
-                src = result.get("source", "unknown")
-                source_counts[src] = source_counts.get(src, 0) + 1
-            else:
-                cache[key] = {"zoning": None, "category": None, "sb1123": None, "source": None}
-
-            fetched += 1
-
-            if (i + 1) % 10 == 0 or i == total - 1:
-                print(f"  [{i+1}/{total}] found={found} | last: {item.get('address','')[:40]} → {result.get('zoning','?') if result else '—'}")
-
-            # Checkpoint
-            if fetched % CHECKPOINT_EVERY == 0:
-                save_cache(cache, output_file)
-                print(f"  💾 Checkpoint: {len(cache):,} entries saved")
-
-            time.sleep(RATE_LIMIT_DELAY)
-
-        save_cache(cache, output_file)
+        try:
+            found, source_counts = asyncio.run(fetch_all(work, cache, market))
+        finally:
+            cache.commit()
+        cache.export_json()
         print(f"\nDone! {found}/{total} lookups returned zoning data.")
         print(f"Total cached: {len(cache):,} entries → {output_file}")
         if source_counts:
@@ -217,6 +334,7 @@ def main():
     # Analysis mode: compare real zoning vs Redfin-guessed zoning
     if analyze_mode:
         run_analysis(listings, cache)
+    cache.close()
 
 
 def run_analysis(listings, cache):
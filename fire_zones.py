@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+fire_zones.py — Local VHFHSZ (Very High Fire Hazard Severity Zone) polygons.
+
+Used by: fetch_parcels.py (fireZone for every parcel), listings_build.py
+(Step 3 fallback for listings without a parcels.json entry)
+
+The fire-zone layer (market fire_url, or statewide CAL FIRE) is downloaded
+once per market. Only the VHFHSZ polygons inside the market bounds are kept,
+and they are written to fire_zones_vhfhsz.geojson. The file records a
+"version": the source URL, filter, bounds and FIRE_ZONES_FORMAT. An existing
+file is never replaced implicitly. If it has no version (an older download)
+or its version no longer matches the market config, a warning is printed and
+the file is still used. It is only downloaded again when missing, or with
+--sync (fetch_parcels.py --sync-fire). Points are then classified offline:
+
+    zones = load_fire_zones(market)        # None if the file is missing
+    zones.contains(lat, lng)               → True inside a VHFHSZ polygon
+
+Usage:
+  python3 fire_zones.py                   # Download LA polygons if missing
+  python3 fire_zones.py --market sd       # SD
+  python3 fire_zones.py --sync            # Re-download even if current
+"""
+import asyncio, json, os, sys
+from datetime import datetime, timezone
+
+from market_config import CALFIRE_LRA_URL, market_file
+from polygon_layers import PolygonIndex
+
+FIRE_ZONES_FORMAT = 1  # Bump when the stored layout changes (older files then warn until --sync)
+
+
+def fire_zone_version(market):
+    """What the stored polygons depend on — a mismatch warns (re-download with --sync)."""
+    field = market.get("fire_field", "HAZ_CLASS")
+    value = market.get("fire_vhfhsz_value", "Very High")
+    return {
+        "format": FIRE_ZONES_FORMAT,
+        "source": market.get("fire_url") or CALFIRE_LRA_URL,
+        "where": f"{field} = '{value}'",
+        "bbox": [market["lng_min"], market["lat_min"], market["lng_max"], market["lat_max"]],
+    }
+
+
+def _ring_area(ring):
+    """Shoelace signed area (negative = clockwise, an ArcGIS outer ring)."""
+    return sum(ring[i - 1][0] * ring[i][1] - ring[i][0] * ring[i - 1][1] for i in range(len(ring))) / 2
+
+
+def rings_to_geometry(rings):
+    """ArcGIS rings (clockwise outers, counter-clockwise holes) → GeoJSON Polygon/MultiPolygon."""
+    polygons = []
+    for ring in rings:
+        if _ring_area(ring) <= 0 or not polygons:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)  # Hole of the preceding outer ring
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def geometry_polygons(geom):
+    """Polygons (each [outer, *holes]) of a GeoJSON Polygon/MultiPolygon."""
+    if geom["type"] == "Polygon":
+        return [geom["coordinates"]]
+    if geom["type"] == "MultiPolygon":
+        return geom["coordinates"]
+    return []
+
+
+class FireZones:
+    """Indexed VHFHSZ point-in-polygon classifier over a GeoJSON FeatureCollection."""
+
+    def __init__(self, geojson):
+        self.version = geojson.get("version")
+        self.index = PolygonIndex((rings, True) for f in geojson["features"] for rings in geometry_polygons(f["geometry"]))
+
+    def __len__(self):
+        return len(self.index)
+
+    def contains(self, lat, lng):
+        return self.index.lookup(lat, lng) is not None
+
+
+def load_fire_zones(market, path=None):
+    """FireZones from the market's fire_zones_vhfhsz.geojson, or None if it hasn't been downloaded."""
+    path = path or market_file("fire_zones_vhfhsz.geojson", market)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return FireZones(json.load(f))
+
+
+async def download_fire_zones(market):
+    """VHFHSZ features within the market bounds as a GeoJSON FeatureCollection (raises on failure)."""
+    from http_client import AsyncClient
+    from polygon_layers import download_layer
+
+    version = fire_zone_version(market)
+    client = AsyncClient(concurrency=4)
+    try:
+        features = await download_layer(client, version["source"], market.get("fire_field", "HAZ_CLASS"),
+                                        where=version["where"], bbox=version["bbox"])
+    finally:
+        client.close()
+    client.report()
+    return {
+        "type": "FeatureCollection",
+        "version": dict(version, fetched=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")),
+        "features": [{"type": "Feature", "properties": attrs, "geometry": rings_to_geometry(rings)}
+                     for rings, attrs in features],
+    }
+
+
+def ensure_fire_zones(market, force=False):
+    """Load the market's fire zones, downloading them first only if missing or forced.
+
+    An unversioned or outdated file is kept (with a warning). Returns
+    FireZones, or None if there is no usable local copy.
+    """
+    path = market_file("fire_zones_vhfhsz.geojson", market)
+    zones = load_fire_zones(market, path)
+    current = fire_zone_version(market)
+    if zones is not None and not force:
+        stored = {k: v for k, v in zones.version.items() if k != "fetched"} if zones.version else None
+        if stored is None:
+            print(f"  ⚠️  {path} has no version (older download) — using it as is; refresh with --sync")
+        elif stored != current:
+            print(f"  ⚠️  {path} was downloaded for a different fire-zone config — using it as is; refresh with --sync")
+        return zones
+
+    reason = "forced" if force else "missing"
+    print(f"  🔥 Downloading VHFHSZ polygons ({reason}) from {current['source']}...")
+    try:
+        geojson = asyncio.run(download_fire_zones(market))
+    except RuntimeError as e:
+        print(f"  ⚠️  Fire zone download failed ({e})")
+        if zones is not None:
+            print(f"  Keeping existing {path}")
+        return zones
+    with open(path + ".tmp", "w") as f:
+        json.dump(geojson, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    print(f"  {len(geojson['features']):,} VHFHSZ polygons → {path}")
+    return FireZones(geojson)
+
+
+def main():
+    from market_config import get_market
+    market = get_market()
+    zones = ensure_fire_zones(market, force="--sync" in sys.argv)
+    if zones is None:
+        sys.exit(1)
+    print(f"  {market['name']}: {len(zones):,} VHFHSZ polygons (fetched {(zones.version or {}).get('fetched', '?')})")
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()
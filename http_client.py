@@ -0,0 +1,191 @@
+"""
+http_client.py — Shared asyncio HTTP client for the ArcGIS / USGS fetchers.
+
+Used by: fetch_parcels.py, fetch_slopes.py, fetch_elevation.py, fetch_zoning.py,
+dem_tiles.py (get_bytes)
+
+requests is the only HTTP dependency, so each call runs in a thread and is
+awaited from the event loop. Per host, the client keeps:
+  - one requests.Session (connection pool sized to the host's concurrency,
+    so connections are kept alive and reused)
+  - an asyncio.Semaphore capping requests in flight
+  - an optional requests/sec limit (even spacing between request starts)
+  - a shared backoff: a 429/503 pauses every request to that host
+Timeouts and connection errors are retried with the same exponential backoff.
+report() prints per-host request counts, statuses, retries, errors and latency.
+
+    async def run():
+        client = AsyncClient(concurrency=25, hosts={"epqs.nationalmap.gov": {"rate": 20}})
+        try:
+            async for item, result in bounded_as_completed(work, fetch, limit=100):
+                ...
+        finally:
+            client.close()
+            client.report()
+    asyncio.run(run())
+"""
+import asyncio, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = (429, 503)
+BACKOFF_BASE = 3  # seconds — doubles each retry: 3, 6, 12
+
+
+def _get(session, url, params, timeout, raw=False):
+    """Worker-thread half of a request: (status, parsed JSON / body bytes, or None)."""
+    with session.get(url, params=params, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            return resp.status_code, None
+        if raw:
+            return 200, resp.content
+        try:
+            return 200, resp.json()
+        except ValueError:
+            return 200, None
+
+
+class _Host:
+    def __init__(self, concurrency, rate):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.pause_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.statuses = Counter()
+        self.latencies = []
+
+
+class AsyncClient:
+    """Per-host pooled, rate-limited, retrying JSON GETs (create inside the running event loop).
+
+    concurrency / rate: defaults for every host (rate = requests/sec, None = unlimited).
+    hosts: {hostname or pool name: {"concurrency": n, "rate": r}} overrides.
+    """
+
+    def __init__(self, concurrency=8, rate=None, hosts=None, retries=2):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.host_limits = hosts or {}
+        self.retries = retries
+        self._hosts = {}
+        self._start = time.time()
+
+    def _host(self, url, pool=None):
+        name = pool or urlsplit(url).hostname
+        host = self._hosts.get(name)
+        if host is None:
+            limits = self.host_limits.get(name, {})
+            host = self._hosts[name] = _Host(limits.get("concurrency", self.concurrency),
+                                              limits.get("rate", self.rate))
+        return host
+
+    async def _wait_turn(self, host):
+        loop = asyncio.get_running_loop()
+        while loop.time() < host.pause_until:
+            await asyncio.sleep(host.pause_until - loop.time())
+        if host.interval:
+            now = loop.time()
+            start = max(now, host.next_start)
+            host.next_start = start + host.interval
+            if start > now:
+                await asyncio.sleep(start - now)
+
+    async def get_json(self, url, params=None, timeout=30, pool=None):
+        """Parsed JSON body of a 200 response, or None (other status, bad JSON, retries exhausted).
+
+        pool: limit this request under a name other than its host, e.g. one
+        ArcGIS layer with its own rate limit on a shared server.
+        """
+        return await self._request(url, params, timeout, pool, raw=False)
+
+    async def get_bytes(self, url, params=None, timeout=60, pool=None):
+        """Raw body of a 200 response (e.g. an exported raster), or None."""
+        return await self._request(url, params, timeout, pool, raw=True)
+
+    async def _request(self, url, params, timeout, pool, raw):
+        loop = asyncio.get_running_loop()
+        host = self._host(url, pool)
+        for attempt in range(self.retries + 1):
+            status = data = None
+            async with host.semaphore:
+                await self._wait_turn(host)
+                t0 = time.perf_counter()
+                try:
+                    status, data = await loop.run_in_executor(host.executor, _get, host.session, url, params, timeout, raw)
+                except requests.RequestException:
+                    host.errors += 1
+                host.requests += 1
+                host.latencies.append(time.perf_counter() - t0)
+            if status is not None:
+                host.statuses[status] += 1
+                if status not in RETRY_STATUS:
+                    return data
+            if attempt == self.retries:
+                break
+            host.retries += 1
+            wait = BACKOFF_BASE * (2 ** attempt)
+            if status is not None:
+                host.pause_until = max(host.pause_until, loop.time() + wait)  # Throttled: back off the whole host
+            await asyncio.sleep(wait)
+        return None
+
+    def close(self):
+        for host in self._hosts.values():
+            host.executor.shutdown(wait=True)
+            host.session.close()
+
+    def report(self):
+        """Print request/latency metrics per host."""
+        elapsed = max(time.time() - self._start, 1e-9)
+        for name, h in self._hosts.items():
+            lat = sorted(h.latencies)
+            p50 = lat[len(lat) // 2] * 1000 if lat else 0
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000 if lat else 0
+            statuses = " ".join(f"{s}×{n:,}" for s, n in sorted(h.statuses.items()))
+            print(f"  HTTP {name}: {h.requests:,} req ({h.requests / elapsed:.1f}/s) | "
+                  f"p50 {p50:.0f}ms p95 {p95:.0f}ms | {h.retries} retries | {h.errors} errors | {statuses}")
+
+
+async def bounded_as_completed(items, fn, limit):
+    """Yield (item, result) as the fn(item) coroutines finish, with at most `limit` running.
+
+    A coroutine that raises a network error (requests.RequestException) yields
+    None as its result, like a failed request. Any other exception is a bug in
+    fn: it is re-raised here (the remaining coroutines are cancelled) rather
+    than passed off as "no data" that callers would cache.
+    """
+    items = iter(items)
+    pending = {}
+
+    def fill():
+        for item in items:
+            pending[asyncio.ensure_future(fn(item))] = item
+            if len(pending) >= limit:
+                break
+
+    fill()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                exc = task.exception()
+                if exc is not None and not isinstance(exc, requests.RequestException):
+                    raise exc
+                yield item, (None if exc is not None else task.result())
+            fill()
+    finally:
+        for task in pending:
+            task.cancel()
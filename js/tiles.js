@@ -0,0 +1,47 @@
+// ── js/tiles.js — Viewport loading for the tiled build output ──
+// Reads tiles/<kind>/manifest.json written by `listings_build.py --tiles`
+// (and build_comps.py / build_rental_data.py --tiles) and fetches only the
+// shards that intersect the map bounds. Shards are cached per URL, so
+// panning back over loaded tiles costs nothing.
+
+var _manifests = {};
+var _shards = {};
+
+// Manifest for a tile directory, e.g. 'tiles/listings' or 'sd_tiles/comps'
+export function loadTileManifest(dir){
+  if(!_manifests[dir]){
+    _manifests[dir] = fetch(dir + '/manifest.json').then(function(r){
+      if(!r.ok) throw new Error(dir + '/manifest.json: HTTP ' + r.status);
+      return r.json();
+    }).catch(function(err){ delete _manifests[dir]; throw err; });
+  }
+  return _manifests[dir];
+}
+
+// Tiles whose record extent intersects bounds {south, west, north, east}
+export function tilesInBounds(manifest, b){
+  return manifest.tiles.filter(function(t){
+    var e = t.extent;  // [minLat, minLng, maxLat, maxLng]
+    return e[0] <= b.north && e[2] >= b.south && e[1] <= b.east && e[3] >= b.west;
+  });
+}
+
+// Records from every tile in view (Leaflet LatLngBounds or {south, west, north, east})
+export function loadTilesInView(dir, bounds){
+  var b = bounds.getSouth ? {south: bounds.getSouth(), west: bounds.getWest(), north: bounds.getNorth(), east: bounds.getEast()} : bounds;
+  return loadTileManifest(dir).then(function(manifest){
+    return Promise.all(tilesInBounds(manifest, b).map(function(t){
+      var url = dir + '/' + t.file;
+      if(!_shards[url]){
+        _shards[url] = fetch(url).then(function(r){
+          if(!r.ok) throw new Error(url + ': HTTP ' + r.status);
+          return r.json();
+        }).catch(function(err){ delete _shards[url]; throw err; });
+      }
+      return _shards[url];
+    }));
+  }).then(function(parts){ return [].concat.apply([], parts); });
+}
+
+// Drop cached manifests/shards (e.g. after a market switch)
+export function clearTileCache(){ _manifests = {}; _shards = {}; }
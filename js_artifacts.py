@@ -0,0 +1,61 @@
+"""
+js_artifacts.py — Read and write the "var NAME = <json>;" data files the GUI loads.
+
+Used by: build_comps.py (data.js), listings_build.py (listings.js, reads
+data.js), build_rental_data.py (rental_data.js), and the fetch_* scripts
+that read listings.js back.
+
+Readers find the declaration by name and decode the value in place with
+JSONDecoder.raw_decode. This avoids a regex scan over a multi-MB file and
+copying the matched substring.
+"""
+import json
+
+_decoder = json.JSONDecoder()
+
+
+def write_js_vars(path, variables):
+    """Write {name: value} as one `var NAME = <compact json>;` line each. Returns the JS text."""
+    js = "\n".join(
+        f"var {name} = " + json.dumps(value, separators=(",", ":")) + ";"
+        for name, value in variables.items()
+    )
+    with open(path, "w") as f:
+        f.write(js)
+    return js
+
+
+def _value_offset(content, name):
+    """Offset of the value assigned to NAME (or NAME_SUFFIX, e.g. LOADED_COMPS_SD), or -1."""
+    n = len(content)
+    pos = content.find(name)
+    while pos != -1:
+        prev = content[pos - 1] if pos else " "
+        if not (prev.isalnum() or prev in "_$."):
+            j = pos + len(name)
+            while j < n and (content[j].isupper() or content[j].isdigit() or content[j] == "_"):
+                j += 1  # Market suffix
+            while j < n and content[j].isspace():
+                j += 1
+            if j < n and content[j] == "=":
+                j += 1
+                while j < n and content[j].isspace():
+                    j += 1
+                return j
+        pos = content.find(name, pos + 1)
+    return -1
+
+
+def parse_js_var(content, name):
+    """Value of `var|const NAME = <json>` in JS source text, or None if not declared."""
+    start = _value_offset(content, name)
+    if start == -1:
+        return None
+    value, _ = _decoder.raw_decode(content, start)
+    return value
+
+
+def load_js_var(path, name):
+    """Value of `var NAME = <json>` in a JS artifact file, or None if not declared."""
+    with open(path, encoding="utf-8") as f:
+        return parse_js_var(f.read(), name)
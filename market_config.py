@@ -23,6 +23,10 @@ CALFIRE_LRA_URL = (
     "Environment/Fire_Severity_Zones/MapServer/1/query"
 )
 USGS_EPQS_URL = "https://epqs.nationalmap.gov/v1/json"
+USGS_3DEP_EXPORT_URL = (  # Seamless 3DEP DEM as raster tiles (dem_tiles.py)
+    "https://elevation.nationalmap.gov/arcgis/rest/services/"
+    "3DEPElevation/ImageServer/exportImage"
+)
 HUD_SAFMR_BASE = "https://www.huduser.gov/hudapi/public/fmr/data/"
 
 # Redfin (same endpoint for all markets, just change bounding box)
@@ -40,6 +44,9 @@ REDFIN_HEADERS = {
 REDFIN_NUM_HOMES = 350
 REDFIN_DELAY_MIN = 1.5
 REDFIN_DELAY_MAX = 2.5
+REDFIN_WORKERS = 4  # Concurrent gis-csv requests (fetch_listings / fetch_sold_comps, --workers N)
+REDFIN_RATE = 2 / (REDFIN_DELAY_MIN + REDFIN_DELAY_MAX)  # Requests/sec across all workers (--rate R)
+REDFIN_CACHE_HOURS = 6  # Tile response cache TTL (response_cache.py, --max-age H, --no-cache)
 
 # Property-type → approximate zone mapping (Redfin → SB 1123)
 # Used as fallback when real zoning is unavailable
@@ -333,7 +340,9 @@ MARKETS = {
         "fire_field": "HAZ_CLASS",
         "fire_vhfhsz_value": "Very High",
 
-        # Zoning endpoints (tried in order — first hit wins)
+        # Zoning endpoints (tried in order — first hit wins). Optional "bbox"
+        # (lng_min, lat_min, lng_max, lat_max, generous) skips an endpoint for
+        # points outside its jurisdiction; no bbox = always queried.
         "zoning_endpoints": [
             {
                 "name": "City of LA (ZIMAS)",
@@ -345,6 +354,7 @@ MARKETS = {
                 "zone_field": "Zoning",
                 "category_field": "CATEGORY",
                 "classify_fn": "classify_zoning_la_city",
+                "bbox": (-118.67, 33.70, -118.15, 34.34),
             },
             {
                 "name": "Santa Monica",
@@ -356,6 +366,7 @@ MARKETS = {
                 "zone_field": "zoning",
                 "category_field": "zonedesc",
                 "classify_fn": "classify_zoning_santa_monica",
+                "bbox": (-118.52, 33.99, -118.44, 34.05),
             },
             {
                 "name": "Malibu",
@@ -366,6 +377,7 @@ MARKETS = {
                 "out_fields": "MALIBUZONE",
                 "zone_field": "MALIBUZONE",
                 "classify_fn": "classify_zoning_malibu",
+                "bbox": (-118.95, 33.99, -118.63, 34.10),
             },
             {
                 "name": "LA County (DRP)",
@@ -483,6 +495,7 @@ MARKETS = {
                 "zone_field": "ZONE_NAME",
                 "category_field": None,
                 "classify_fn": "classify_zoning_sd_city",
+                "bbox": (-117.29, 32.53, -116.90, 33.12),
             },
             {
                 "name": "SD County (DPW/BASE_LAYERS)",
@@ -8,9 +8,16 @@ Usage:
 
 Serves static files AND handles:
   POST /api/generate-om  → accepts JSON deal dict, returns PPTX binary
+
+Static files: a precompressed .br / .gz sibling (see static_assets.py) is
+sent when the client's Accept-Encoding allows it. Content-hashed files
+(listings.<hash>.js) get a one-year immutable Cache-Control. HTML pages get
+the asset manifest injected in place of their <!-- ASSET_MANIFEST -->
+placeholder. Everything else, including the HTML, stays no-cache.
 """
 
 import json, os, sys, io, traceback
+from email.utils import formatdate
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,13 +25,86 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Import generate_om from same directory
 sys.path.insert(0, SCRIPT_DIR)
 from generate_om import build_om
+from static_assets import HASHED_RE, MANIFEST_MARKER, manifest_script
 
 ASSETS_DIR = os.path.join(SCRIPT_DIR, 'assets')
 MATT_PHOTO = os.path.join(ASSETS_DIR, 'matt_circle.png')
 JOE_PHOTO = os.path.join(ASSETS_DIR, 'joe_circle.png')
 
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # Server preference order
+COMPRESSIBLE = ('.js', '.json', '.html', '.css', '.geojson')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def accepted_encodings(header):
+    """Codings allowed by an Accept-Encoding header (q=0 excluded)."""
+    allowed = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        for p in params.split(';'):
+            k, _, v = p.strip().partition('=')
+            if k == 'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            allowed.add(name.strip().lower())
+    return allowed
+
 
 class OMHandler(SimpleHTTPRequestHandler):
+    cache_control = 'no-cache'
+
+    def parse_request(self):
+        self.cache_control = 'no-cache'  # Per request; send_head() upgrades hashed assets
+        return super().parse_request()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        self.cache_control = IMMUTABLE if HASHED_RE.search(path) else 'no-cache'
+        if os.path.isdir(path) and self.path.split('?')[0].endswith('/'):
+            path = os.path.join(path, 'index.html')
+        if os.path.isfile(path) and path.endswith('.html'):
+            return self._html_with_manifest(path)
+        if os.path.isfile(path) and path.endswith(COMPRESSIBLE):
+            variant = self._precompressed(path)
+            if variant:
+                return variant
+        return super().send_head()
+
+    def _html_with_manifest(self, path):
+        """Send an HTML page with window.ASSET_MANIFEST injected at its placeholder."""
+        with open(path, 'rb') as f:
+            page = f.read()
+        if MANIFEST_MARKER in page:
+            page = page.replace(MANIFEST_MARKER, manifest_script(os.path.dirname(path)), 1)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        return io.BytesIO(page)
+
+    def _precompressed(self, path):
+        """Open a fresh .br/.gz sibling the client accepts and send its headers, or None."""
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        src = os.stat(path)
+        for coding, suffix in ENCODINGS:
+            if coding not in accepted or not os.path.isfile(path + suffix):
+                continue
+            if os.stat(path + suffix).st_mtime < src.st_mtime:
+                continue  # Stale: the source was rewritten after compressing
+            f = open(path + suffix, 'rb')
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Encoding', coding)
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Last-Modified', formatdate(src.st_mtime, usegmt=True))
+            self.end_headers()
+            return f
+        return None
+
     def do_GET(self):
         if self.path == '/health':
             self.send_response(200)
@@ -81,7 +161,9 @@ class OMHandler(SimpleHTTPRequestHandler):
         self.end_headers()
 
     def end_headers(self):
-        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Cache-Control', self.cache_control)
+        if self.path.split('?')[0].endswith(COMPRESSIBLE):
+            self.send_header('Vary', 'Accept-Encoding')
         self.send_header('Access-Control-Allow-Origin', '*')
         super().end_headers()
 
@@ -0,0 +1,156 @@
+"""
+polygon_layers.py — Bulk ArcGIS polygon layer download + local point-in-polygon.
+
+Used by: fetch_zoning.py (--bulk), fire_zones.py
+
+Instead of one identify-style query per point, a layer is paged through once
+(resultOffset / resultRecordCount ordered by the layer's object ID field,
+pages fetched concurrently through the shared http_client) and kept
+locally. Points are then matched offline:
+
+    features = await download_layer(client, url, "ZONE,Z_CATEGORY", pool="LA County (DRP)")
+    index = PolygonIndex([(rings, attrs) for rings, attrs in features])
+    index.lookup(lat, lng)   → attrs of the first polygon containing the point, or None
+
+PolygonIndex buckets polygon bounding boxes on a GRID_DEG grid; each lookup
+bbox-filters the polygons in one cell and runs an even-odd ray cast over all
+rings of a feature (outer rings and holes alike, as ArcGIS stores them).
+"""
+import asyncio, math
+
+PAGE_SIZE = 2000     # Records per page requested (servers may cap lower — see download_layer)
+PAGE_RETRIES = 3     # Attempts at a page that comes back short before giving up
+GRID_DEG = 0.01      # Index cell size (~1 km)
+
+
+def _filter_params(where, bbox):
+    params = {"where": where}
+    if bbox:
+        lng_min, lat_min, lng_max, lat_max = bbox
+        params.update({
+            "geometry": f"{lng_min},{lat_min},{lng_max},{lat_max}",
+            "geometryType": "esriGeometryEnvelope",
+            "inSR": 4326,
+            "spatialRel": "esriSpatialRelIntersects",
+        })
+    return params
+
+
+async def object_id_field(client, url, pool=None):
+    """The layer's object ID field, from its metadata (the layer URL without /query)."""
+    layer_url = url[:-len("/query")] if url.endswith("/query") else url
+    meta = await client.get_json(layer_url, params={"f": "json"}, pool=pool)
+    if meta and meta.get("objectIdField"):
+        return meta["objectIdField"]
+    for field in (meta or {}).get("fields") or []:
+        if field.get("type") == "esriFieldTypeOID":
+            return field["name"]
+    raise RuntimeError(f"no object ID field in layer metadata: {layer_url}")
+
+
+async def download_layer(client, url, out_fields="*", where="1=1", pool=None, page_size=PAGE_SIZE, bbox=None):
+    """All features of an ArcGIS layer (matching where, within bbox) as [(rings, attributes)].
+
+    Pages are ordered by the layer's object ID field, so concurrent offset
+    pages neither overlap nor skip records. The first page is fetched alone:
+    if the server caps it below page_size (maxRecordCount), its length
+    becomes the page size. The remaining pages are then fetched concurrently,
+    and a page that comes back short is requested again (PAGE_RETRIES).
+    Raises RuntimeError if any page fails or the features received don't add
+    up to the layer's count, so a partial layer is never mistaken for a
+    complete one.
+    """
+    filters = _filter_params(where, bbox)
+    oid = await object_id_field(client, url, pool)
+    base = dict(filters, outFields=out_fields, orderByFields=oid, returnGeometry="true", outSR=4326,
+                geometryPrecision=6, f="json")
+    count = await client.get_json(url, params=dict(filters, returnCountOnly="true", f="json"), pool=pool)
+    if not count or "count" not in count:
+        raise RuntimeError(f"count query failed: {url}")
+    total = count["count"]
+
+    async def page(offset, size, retry_short=True):
+        expected = min(size, total - offset)
+        for _ in range(PAGE_RETRIES):
+            data = await client.get_json(url, params=dict(base, resultOffset=offset, resultRecordCount=size),
+                                         timeout=120, pool=pool)
+            if data is None or "features" not in data:
+                raise RuntimeError(f"page at offset {offset} failed: {url}")
+            if len(data["features"]) >= expected or not retry_short:
+                return data["features"]
+        raise RuntimeError(f"page at offset {offset} came back short "
+                           f"({len(data['features'])}/{expected} features): {url}")
+
+    # A short first page is how a server's maxRecordCount shows up, so it isn't retried
+    first = await page(0, page_size, retry_short=False) if total else []
+    if total and not first:
+        raise RuntimeError(f"first page empty ({total:,} features counted): {url}")
+    if len(first) < min(page_size, total):
+        page_size = len(first)  # Server maxRecordCount
+    rest = await asyncio.gather(*(page(off, page_size) for off in range(len(first), total, page_size)))
+
+    received = len(first) + sum(len(feats) for feats in rest)
+    if received != total:
+        raise RuntimeError(f"received {received:,} features, layer count is {total:,}: {url}")
+    features = []
+    for feats in [first] + rest:
+        for feat in feats:
+            rings = (feat.get("geometry") or {}).get("rings")
+            if rings:
+                features.append((rings, feat.get("attributes", {})))
+    return features
+
+
+def point_in_rings(x, y, rings):
+    """Even-odd ray cast over every ring of a polygon ([[x, y], ...] each)."""
+    inside = False
+    for ring in rings:
+        xj, yj = ring[-1][0], ring[-1][1]
+        for pt in ring:
+            xi, yi = pt[0], pt[1]
+            if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+                inside = not inside
+            xj, yj = xi, yi
+    return inside
+
+
+class PolygonIndex:
+    """Point-in-polygon lookups over [(rings, value), ...] with a uniform grid.
+
+    Overlapping polygons resolve to the first in input order.
+    """
+
+    def __init__(self, polygons, cell=GRID_DEG):
+        self.cell = cell
+        self.rings = []
+        self.values = []
+        self.bounds = []
+        self.grid = {}
+        for rings, value in polygons:
+            xs = [p[0] for ring in rings for p in ring]
+            ys = [p[1] for ring in rings for p in ring]
+            if not xs:
+                continue
+            i = len(self.rings)
+            self.rings.append(rings)
+            self.values.append(value)
+            self.bounds.append((min(xs), min(ys), max(xs), max(ys)))
+            x0, y0, x1, y1 = self.bounds[i]
+            for cx in range(math.floor(x0 / cell), math.floor(x1 / cell) + 1):
+                for cy in range(math.floor(y0 / cell), math.floor(y1 / cell) + 1):
+                    self.grid.setdefault((cx, cy), []).append(i)
+
+    def __len__(self):
+        return len(self.rings)
+
+    def lookup(self, lat, lng):
+        """Value of the first polygon containing (lat, lng), or None."""
+        cell = self.grid.get((math.floor(lng / self.cell), math.floor(lat / self.cell)))
+        if not cell:
+            return None
+        bounds = self.bounds
+        for i in cell:
+            x0, y0, x1, y1 = bounds[i]
+            if x0 <= lng <= x1 and y0 <= lat <= y1 and point_in_rings(lng, lat, self.rings[i]):
+                return self.values[i]
+        return None
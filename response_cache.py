@@ -0,0 +1,88 @@
+"""
+response_cache.py — Local cache of Redfin gis-csv tile responses (SQLite).
+
+Used by: fetch_listings.py, fetch_sold_comps.py (fetch_tile)
+
+Entries are keyed by the request URL, which carries the tile polygon and
+every query param. Each entry stores an expiry chosen by response_ttl():
+  - 200 with rows        → max_age (--max-age HOURS, default REDFIN_CACHE_HOURS)
+  - 200 with no rows     → EMPTY_TTL_FACTOR × max_age (empty tiles rarely change)
+  - block pages / JSON errors, 429/403 throttles, other statuses → not stored
+A quick refresh inside the TTL only sends requests for expired tiles.
+--no-cache bypasses the cache for reads and writes.
+"""
+import sqlite3, sys, threading, time
+
+EMPTY_TTL_FACTOR = 4
+
+
+def response_ttl(status, text, max_age):
+    """Seconds to keep a gis-csv response, or 0 to not cache it."""
+    if status != 200:
+        return 0  # Throttles and errors are always refetched
+    body = text.strip()
+    if body.startswith("<!") or body.startswith("{"):
+        return 0  # Block page / API error served as 200
+    if body.count("\n") < 1:
+        return max_age * EMPTY_TTL_FACTOR  # Header only (or nothing): empty tile
+    return max_age
+
+
+def cache_settings(argv=None):
+    """(enabled, max_age seconds) from --no-cache / --max-age HOURS (default REDFIN_CACHE_HOURS)."""
+    from market_config import REDFIN_CACHE_HOURS
+    argv = sys.argv if argv is None else argv
+    hours = REDFIN_CACHE_HOURS
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--max-age":
+            hours = float(argv[i + 1])
+    return "--no-cache" not in argv and hours > 0, hours * 3600
+
+
+class ResponseCache:
+    """URL → response text with per-entry expiry. Safe to share between fetch worker threads."""
+
+    def __init__(self, path, max_age, enabled=True):
+        self.max_age = max_age
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+        self._lock = threading.Lock()
+        self._db = None
+        if enabled:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, status INTEGER, body TEXT, fetched REAL, expires REAL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, url):
+        """Cached response text for url, or None if absent/expired (or the cache is off)."""
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body FROM responses WHERE url = ? AND expires > ?", (url, time.time())
+            ).fetchone()
+            self.stats["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    def put(self, url, status, text):
+        """Store a response if response_ttl() allows it."""
+        ttl = response_ttl(status, text, self.max_age)
+        if self._db is None or ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (url, status, text, now, now + ttl)
+            )
+            self._db.commit()
+            self.stats["stored"] += 1
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
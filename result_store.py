@@ -0,0 +1,160 @@
+"""
+result_store.py — Crash-safe "lat,lng" → result store for the fetcher caches (SQLite).
+
+Used by: fetch_parcels.py (parcels.json), fetch_slopes.py (slopes.json),
+fetch_elevation.py (elevation_cache.json), fetch_zoning.py (zoning.json)
+
+Each JSON cache gets a SQLite (WAL) store next to it (parcels.json →
+parcels.json.sqlite). Results are upserted as they arrive. A checkpoint is
+a commit, so its cost no longer grows with the cache, and a crash loses at
+most the results since the last one. The JSON file remains the interface
+for listings_build.py and git: export_json() streams it out in
+insertion order with the same formatting json.dump produced (indent
+included). On open, the store is replaced by the JSON when the store is
+new, or when the file changed since the store last exported it (e.g. after
+a git pull or a hand edit), so entries removed from the JSON go away too.
+
+    store = ResultStore("parcels.json")
+    store["34.05,-118.25"] = {...}            # upsert (dict-style get/in/len too)
+    store.get_many(keys)                      → {key: value} for the keys present
+    store.within(lat0, lat1, lng0, lng1)      → [(key, value)] in a lat/lng box
+    store.commit()                            # checkpoint
+    store.clear()                             # --force
+    store.export_json(); store.close()
+"""
+import json, os, sqlite3
+
+
+class ResultStore:
+    """SQLite-backed dict of JSON values keyed "lat,lng", mirrored to a JSON file."""
+
+    def __init__(self, json_path, indent=None):
+        self.json_path = json_path
+        self.indent = indent
+        self._db = sqlite3.connect(json_path + ".sqlite")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "key TEXT PRIMARY KEY, lat REAL, lng REAL, value TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_lat_lng ON results (lat, lng)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.imported = self._import_json()
+
+    # ── JSON mirror ──
+    def _json_stamp(self):
+        st = os.stat(self.json_path)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def _import_json(self):
+        """Replace the store with the JSON file if the store hasn't seen this version of it.
+
+        The JSON wins: keys deleted from it (to force a refetch, or by a pruned
+        cache from git) are deleted from the store too. Returns entries imported.
+        """
+        if not os.path.exists(self.json_path):
+            return 0
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'json_stamp'").fetchone()
+        if row and row[0] == self._json_stamp():
+            return 0
+        with open(self.json_path) as f:
+            data = json.load(f)
+        self._db.execute("DELETE FROM results")
+        self.update(data.items())
+        self._set_stamp()  # Commits the delete + insert together
+        return len(data)
+
+    def _set_stamp(self):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('json_stamp', ?)", (self._json_stamp(),))
+        self._db.commit()
+
+    def export_json(self):
+        """Write the JSON file (json.dump-identical formatting), streaming row by row."""
+        tmp = self.json_path + ".tmp"
+        indent = self.indent
+        with open(tmp, "w") as f:
+            f.write("{")
+            sep, pad = (", ", "") if indent is None else (",\n", " " * indent)
+            first = True
+            for key, value in self.items():
+                body = json.dumps(value, indent=indent)
+                if indent is not None:
+                    body = body.replace("\n", "\n" + pad)
+                f.write(("\n" if indent is not None else "") if first else sep)
+                f.write(pad + json.dumps(key) + ": " + body)
+                first = False
+            f.write("}" if first or indent is None else "\n}")
+        os.replace(tmp, self.json_path)
+        self._set_stamp()
+
+    # ── dict-style access ──
+    @staticmethod
+    def _latlng(key):
+        try:
+            lat, lng = key.split(",")
+            return float(lat), float(lng)
+        except ValueError:
+            return None, None
+
+    def __setitem__(self, key, value):
+        self._db.execute("INSERT INTO results VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                         (key, *self._latlng(key), json.dumps(value)))
+
+    def update(self, items):
+        """Upsert many (key, value) pairs."""
+        self._db.executemany("INSERT INTO results VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                             ((k, *self._latlng(k), json.dumps(v)) for k, v in items))
+
+    def get(self, key, default=None):
+        row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __getitem__(self, key):
+        row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __contains__(self, key):
+        return self._db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get_many(self, keys, chunk=500):
+        """{key: value} for the keys that are present."""
+        keys = list(keys)
+        out = {}
+        for i in range(0, len(keys), chunk):
+            part = keys[i:i + chunk]
+            rows = self._db.execute(f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(part))})", part)
+            out.update((k, json.loads(v)) for k, v in rows)
+        return out
+
+    def within(self, lat_min, lat_max, lng_min, lng_max):
+        """[(key, value)] whose lat/lng lies in the box."""
+        rows = self._db.execute("SELECT key, value FROM results WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ? "
+                                "ORDER BY rowid", (lat_min, lat_max, lng_min, lng_max))
+        return [(k, json.loads(v)) for k, v in rows]
+
+    def items(self):
+        for k, v in self._db.execute("SELECT key, value FROM results ORDER BY rowid"):
+            yield k, json.loads(v)
+
+    def values(self):
+        for _, v in self.items():
+            yield v
+
+    def clear(self):
+        """Drop every result (--force recomputes)."""
+        self._db.execute("DELETE FROM results")
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,57 @@
+"""
+sale_dates.py — Sale-date parsing and the build reference date.
+
+Used by: build_comps.py (writes a "dn" day number per comp into data.js),
+listings_build.py (recency weights)
+
+Sold dates are reduced to ordinal day numbers (date.toordinal()), so recency
+is integer arithmetic against one reference day per build. The reference day
+is today unless --as-of YYYY-MM-DD pins it, which makes a rebuild of the same
+inputs reproducible.
+"""
+import sys
+from datetime import date, datetime
+
+DAYS_PER_MONTH = 30.44
+
+_MONTHS = {
+    name.lower(): i for i, name in enumerate(
+        ["January", "February", "March", "April", "May", "June", "July",
+         "August", "September", "October", "November", "December"], 1)
+}
+
+
+def sale_day_number(date_str):
+    """Ordinal day of a Redfin ("January-15-2025") or ISO ("2025-01-15") date, or None."""
+    if not date_str:
+        return None
+    # Fast path for the two known shapes; strptime is the fallback for anything else
+    parts = date_str.split("-")
+    if len(parts) == 3:
+        a, b, c = parts
+        try:
+            if a.lower() in _MONTHS and len(c) == 4 and len(b) <= 2 and b.isdigit() and c.isdigit():
+                return date(int(c), _MONTHS[a.lower()], int(b)).toordinal()
+            if len(a) == 4 and a.isdigit() and len(b) <= 2 and b.isdigit() and len(c) <= 2 and c.isdigit():
+                return date(int(a), int(b), int(c)).toordinal()
+        except ValueError:
+            return None
+    for fmt in ("%B-%d-%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(date_str, fmt).toordinal()
+        except ValueError:
+            continue
+    return None
+
+
+def build_date(argv=None):
+    """Reference date for recency weights: --as-of YYYY-MM-DD, else today."""
+    argv = sys.argv if argv is None else argv
+    for i, arg in enumerate(argv):
+        if arg == "--as-of" and i + 1 < len(argv):
+            try:
+                return datetime.strptime(argv[i + 1], "%Y-%m-%d").date()
+            except ValueError:
+                print(f"  Invalid --as-of date: {argv[i + 1]} (expected YYYY-MM-DD)")
+                sys.exit(1)
+    return date.today()
@@ -0,0 +1,354 @@
+"""
+spatial_index.py — Shared KD-tree spatial index for lat/lng point lookups.
+
+Used by: listings_build.py (sale comps, subdivision comps, rental comps,
+census tracts, cache stamping via KeyIndex), build_comps.py (neighborhood medians)
+
+Points are projected onto a local equirectangular plane (miles) and indexed
+with scipy.spatial.cKDTree when SciPy is installed (imported on first use),
+or a small pure-Python KD-tree otherwise. Tree hits are a superset; every
+query then applies its exact predicate (haversine miles, or a lat/lng degree
+box), so results do not depend on the backend. Hits are returned in index order (the order points
+were passed in), which keeps downstream float sums reproducible.
+"""
+import math
+
+np = None
+cKDTree = None
+
+EARTH_RADIUS_MI = 3958.8
+MILES_PER_DEG_LAT = EARTH_RADIUS_MI * math.pi / 180
+LEAF_SIZE = 16            # Points per leaf in the pure-Python tree
+PROJECTION_MARGIN = 1.0   # Degrees of latitude beyond the data used for the x scale
+RADIUS_PAD = 1.001        # Projected-vs-great-circle slack on radius queries
+BOUNDARY_EPS = 1e-9       # Vectorized distances this close to a cutoff are re-checked
+
+
+def _load_scipy():
+    """Import NumPy + scipy.spatial.cKDTree on first use. Returns True if available."""
+    global np, cKDTree
+    if cKDTree is None:
+        try:
+            import numpy
+            from scipy.spatial import cKDTree as tree_cls
+        except ImportError:
+            return False
+        np, cKDTree = numpy, tree_cls
+    return True
+
+
+def haversine_mi(lat1, lng1, lat2, lng2):
+    """Great-circle distance in miles between two lat/lng points."""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng/2)**2
+    return EARTH_RADIUS_MI * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def haversine_mi_vec(lat1, lng1, lat2, lng2):
+    """NumPy haversine (miles) with broadcasting. Requires NumPy."""
+    dlat = np.radians(lat2 - lat1)
+    dlng = np.radians(lng2 - lng1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlng / 2) ** 2
+    return EARTH_RADIUS_MI * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class _KDTree:
+    """Minimal static 2-d tree over projected points (pure-Python fallback)."""
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.root = self._build(list(range(len(xs))), 0) if xs else None
+
+    def _build(self, idx, depth):
+        if len(idx) <= LEAF_SIZE:
+            return (None, idx)
+        axis = depth % 2
+        coords = self.xs if axis == 0 else self.ys
+        idx.sort(key=coords.__getitem__)
+        mid = len(idx) // 2
+        return (axis, coords[idx[mid]], self._build(idx[:mid], depth + 1), self._build(idx[mid:], depth + 1))
+
+    def query_rect(self, x0, x1, y0, y1):
+        """Indices of points inside [x0, x1] × [y0, y1]."""
+        out = []
+        stack = [self.root] if self.root else []
+        xs, ys = self.xs, self.ys
+        while stack:
+            node = stack.pop()
+            if node[0] is None:
+                out.extend(i for i in node[1] if x0 <= xs[i] <= x1 and y0 <= ys[i] <= y1)
+                continue
+            axis, split, left, right = node
+            lo, hi = (x0, x1) if axis == 0 else (y0, y1)
+            if lo <= split:
+                stack.append(left)
+            if hi >= split:
+                stack.append(right)
+        return out
+
+    def query_nearest(self, x, y, k):
+        """[(sq_dist, i)] of the k nearest points, nearest first."""
+        best = []  # sorted list of (sq_dist, i), at most k long
+        stack = [self.root] if self.root else []
+        xs, ys = self.xs, self.ys
+        while stack:
+            node = stack.pop()
+            if node[0] is None:
+                for i in node[1]:
+                    d = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                    if len(best) < k or d < best[-1][0]:
+                        best.append((d, i))
+                        best.sort()
+                        del best[k:]
+                continue
+            axis, split, left, right = node
+            diff = (x if axis == 0 else y) - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Push far first so the near side is explored first
+            if len(best) < k or diff * diff <= best[-1][0]:
+                stack.append(far)
+            stack.append(near)
+        return best
+
+
+class SpatialIndex:
+    """Radius, box and k-nearest queries over a fixed set of (lat, lng) points.
+
+    index = SpatialIndex([(lat, lng), ...])
+    index.query_radius(lat, lng, 2.0)      → [(i, dist_mi), ...]  (index order)
+    index.query_box(lat, lng, 0.015)       → [i, ...]  |Δlat|, |Δlng| ≤ 0.015°
+    index.query_box_batch(points, 0.015)   → [[i, ...], ...]
+    index.query_nearest(lat, lng, k=3)     → [(i, dist_mi), ...]  nearest first
+    index.query_radius_batch(points, 2.0)  → (offsets, indices, dists)
+    """
+
+    def __init__(self, points, use_scipy=None):
+        self.lats = [float(p[0]) for p in points]
+        self.lngs = [float(p[1]) for p in points]
+        if use_scipy is None:
+            use_scipy = True
+        self.backend = "scipy" if use_scipy and _load_scipy() else "python"
+
+        # Equirectangular projection. The x scale uses the latitude farthest from
+        # the equator (plus a margin), so projected distances never exceed the
+        # great-circle distance and radius hits are always a superset.
+        self.lat0 = sum(self.lats) / len(self.lats) if self.lats else 0.0
+        self.lng0 = sum(self.lngs) / len(self.lngs) if self.lngs else 0.0
+        max_abs_lat = max((abs(v) for v in self.lats), default=0.0)
+        self.x_scale = MILES_PER_DEG_LAT * math.cos(math.radians(min(max_abs_lat + PROJECTION_MARGIN, 89.0)))
+        self.y_scale = MILES_PER_DEG_LAT
+        xs = [(v - self.lng0) * self.x_scale for v in self.lngs]
+        ys = [(v - self.lat0) * self.y_scale for v in self.lats]
+
+        if self.backend == "scipy":
+            self._lat_arr = np.asarray(self.lats, dtype=np.float64)
+            self._lng_arr = np.asarray(self.lngs, dtype=np.float64)
+            self._tree = cKDTree(np.column_stack([xs, ys])) if xs else None
+        else:
+            self._tree = _KDTree(xs, ys)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _project(self, lat, lng):
+        return (lng - self.lng0) * self.x_scale, (lat - self.lat0) * self.y_scale
+
+    def _ball(self, lat, lng, r, p=2.0):
+        """Candidate indices within projected distance r (p=2 circle, p=inf square)."""
+        if not self.lats:
+            return []
+        x, y = self._project(lat, lng)
+        if self.backend == "scipy":
+            if self._tree is None:
+                return []
+            return self._tree.query_ball_point((x, y), r, p=p)
+        hits = self._tree.query_rect(x - r, x + r, y - r, y + r)
+        if p == 2.0:
+            r2 = r * r
+            xs, ys = self._tree.xs, self._tree.ys
+            hits = [i for i in hits if (xs[i] - x) ** 2 + (ys[i] - y) ** 2 <= r2]
+        return hits
+
+    def query_radius(self, lat, lng, radius_mi):
+        """[(i, dist_mi)] for points within radius_mi (haversine), in index order."""
+        out = []
+        for i in sorted(self._ball(lat, lng, radius_mi * RADIUS_PAD + 1e-6)):
+            d = haversine_mi(lat, lng, self.lats[i], self.lngs[i])
+            if d <= radius_mi:
+                out.append((i, d))
+        return out
+
+    def query_box(self, lat, lng, half_deg):
+        """Indices with |Δlat| ≤ half_deg and |Δlng| ≤ half_deg, in index order."""
+        pad = 1 + 1e-9
+        if self.backend == "scipy":
+            hits = self._ball(lat, lng, half_deg * max(self.x_scale, self.y_scale) * pad, p=float("inf"))
+        elif self.lats:
+            x, y = self._project(lat, lng)
+            hx, hy = half_deg * self.x_scale * pad, half_deg * self.y_scale * pad
+            hits = self._tree.query_rect(x - hx, x + hx, y - hy, y + hy)
+        else:
+            hits = []
+        return [i for i in sorted(hits)
+                if abs(self.lats[i] - lat) <= half_deg and abs(self.lngs[i] - lng) <= half_deg]
+
+    def query_box_batch(self, points, half_deg):
+        """query_box for many (lat, lng) points at once → list of index lists."""
+        if self.backend != "scipy" or not points or self._tree is None:
+            return [self.query_box(lat, lng, half_deg) for lat, lng in points]
+        qlat = np.asarray([p[0] for p in points], dtype=np.float64)
+        qlng = np.asarray([p[1] for p in points], dtype=np.float64)
+        xy = np.column_stack([(qlng - self.lng0) * self.x_scale, (qlat - self.lat0) * self.y_scale])
+        r = half_deg * max(self.x_scale, self.y_scale) * (1 + 1e-9)
+        balls = self._tree.query_ball_point(xy, r, p=float("inf"), return_sorted=True)
+        lats, lngs = self.lats, self.lngs
+        return [[i for i in ball if abs(lats[i] - lat) <= half_deg and abs(lngs[i] - lng) <= half_deg]
+                for ball, (lat, lng) in zip(balls, points)]
+
+    def query_nearest(self, lat, lng, k=1, max_dist_mi=None):
+        """[(i, dist_mi)] for the k nearest points (haversine), nearest first."""
+        if not self.lats:
+            return []
+        if max_dist_mi is not None:
+            hits = self.query_radius(lat, lng, max_dist_mi)
+        else:
+            x, y = self._project(lat, lng)
+            # Over-fetch in projected space, then rank by true distance
+            kk = min(len(self.lats), k * 2 + 4)
+            if self.backend == "scipy":
+                _, idx = self._tree.query((x, y), k=kk)
+                idx = [int(i) for i in np.atleast_1d(idx)]
+            else:
+                idx = [i for _, i in self._tree.query_nearest(x, y, kk)]
+            hits = [(i, haversine_mi(lat, lng, self.lats[i], self.lngs[i])) for i in idx]
+        hits.sort(key=lambda h: (h[1], h[0]))
+        return hits[:k]
+
+    def query_radius_batch(self, points, radius_mi):
+        """Radius query for many (lat, lng) points at once.
+
+        Returns (offsets, indices, dists): hits for point k are
+        indices[offsets[k]:offsets[k+1]] (index order) with matching dists.
+        NumPy arrays on the SciPy backend, plain lists otherwise. Membership
+        matches query_radius exactly (vectorized distances near the cutoff
+        are recomputed with haversine_mi).
+        """
+        if self.backend != "scipy" or not points or self._tree is None:
+            offsets, indices, dists = [0], [], []
+            for lat, lng in points:
+                for i, d in self.query_radius(lat, lng, radius_mi):
+                    indices.append(i)
+                    dists.append(d)
+                offsets.append(len(indices))
+            return offsets, indices, dists
+
+        qlat = np.asarray([p[0] for p in points], dtype=np.float64)
+        qlng = np.asarray([p[1] for p in points], dtype=np.float64)
+        xy = np.column_stack([(qlng - self.lng0) * self.x_scale, (qlat - self.lat0) * self.y_scale])
+        balls = self._tree.query_ball_point(xy, radius_mi * RADIUS_PAD + 1e-6, return_sorted=True)
+        counts = np.fromiter((len(b) for b in balls), dtype=np.int64, count=len(balls))
+        owner = np.repeat(np.arange(len(points)), counts)
+        cand = np.concatenate([np.asarray(b, dtype=np.int64) for b in balls]) if counts.sum() else np.empty(0, dtype=np.int64)
+        dist = haversine_mi_vec(qlat[owner], qlng[owner], self._lat_arr[cand], self._lng_arr[cand])
+
+        # Match query_radius exactly at the cutoff
+        near = np.nonzero(np.abs(dist - radius_mi) < BOUNDARY_EPS)[0]
+        for j in near:
+            dist[j] = haversine_mi(qlat[owner[j]], qlng[owner[j]], self.lats[cand[j]], self.lngs[cand[j]])
+
+        keep = dist <= radius_mi
+        owner, cand, dist = owner[keep], cand[keep], dist[keep]
+        offsets = np.zeros(len(points) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner, minlength=len(points)), out=offsets[1:])
+        return offsets, cand, dist
+
+
+class KeyIndex:
+    """Fuzzy join of (lat, lng) points onto the keys of a "lat,lng"-keyed cache.
+
+    index = KeyIndex(cache)                  # keys parsed once into coordinate arrays
+    index.match([(lat, lng), ...], 0.0005)   → [key or None, ...]
+
+    A point's own "lat,lng" key wins when present. Otherwise the nearest key
+    within tol (|Δlat| + |Δlng| degrees) is used, with ties going to the key
+    that comes first in the cache. On the SciPy backend, all misses are
+    resolved in one vectorized tree query.
+    """
+
+    def __init__(self, cache, use_scipy=None):
+        self.keys = list(cache)
+        self._exact = set(self.keys)
+        if use_scipy is None:
+            use_scipy = True
+        self.backend = "scipy" if use_scipy and _load_scipy() else "python"
+        if self.backend == "scipy":
+            coords = np.array(",".join(self.keys).split(","), dtype=np.float64) if self.keys else np.empty(0)
+            self._coords = coords.reshape(-1, 2)
+            self._tree = cKDTree(self._coords) if self.keys else None
+        else:
+            self._coords = [tuple(float(v) for v in key.split(",")) for key in self.keys]
+            self._grid = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, points, tol):
+        out = [None] * len(points)
+        misses = []
+        for n, (lat, lng) in enumerate(points):
+            key = f"{lat},{lng}"
+            if key in self._exact:
+                out[n] = key
+            else:
+                misses.append(n)
+        if not misses or not self.keys:
+            return out
+        if self.backend == "scipy":
+            hits = self._nearest_scipy([points[n] for n in misses], tol)
+        else:
+            hits = [self._nearest_python(*points[n], tol) for n in misses]
+        for n, i in zip(misses, hits):
+            if i is not None:
+                out[n] = self.keys[i]
+        return out
+
+    def _nearest_scipy(self, points, tol):
+        q = np.asarray(points, dtype=np.float64)
+        k = min(2, len(self.keys))
+        dist, idx = self._tree.query(q, k=k, p=1, distance_upper_bound=tol * (1 + 1e-9))
+        dist, idx = dist.reshape(len(q), k), idx.reshape(len(q), k)
+        hits = []
+        for row, (lat, lng) in enumerate(points):
+            if not np.isfinite(dist[row, 0]):
+                hits.append(None)
+                continue
+            i = int(idx[row, 0])
+            if k > 1 and dist[row, 1] == dist[row, 0]:
+                # Tie: every key at exactly this distance, first in cache order
+                ball = self._tree.query_ball_point((lat, lng), dist[row, 0] * (1 + 1e-12), p=1)
+                i = min(j for j in ball if self._l1(j, lat, lng) == self._l1(i, lat, lng))
+            hits.append(i if self._l1(i, lat, lng) <= tol else None)
+        return hits
+
+    def _l1(self, i, lat, lng):
+        clat, clng = self._coords[i]
+        return abs(float(clat) - lat) + abs(float(clng) - lng)
+
+    def _nearest_python(self, lat, lng, tol):
+        if self._grid is None or self._grid[0] != tol:
+            grid = {}
+            for i, (clat, clng) in enumerate(self._coords):
+                grid.setdefault((round(clat / (2 * tol)), round(clng / (2 * tol))), []).append(i)
+            self._grid = (tol, grid)
+        grid = self._grid[1]
+        cr, cc = round(lat / (2 * tol)), round(lng / (2 * tol))
+        best, best_d = None, None
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                for i in grid.get((cr + dr, cc + dc), ()):
+                    d = self._l1(i, lat, lng)
+                    if d <= tol and (best_d is None or d < best_d or (d == best_d and i < best)):
+                        best, best_d = i, d
+        return best
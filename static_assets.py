@@ -0,0 +1,131 @@
+"""
+static_assets.py — Precompressed, content-hashed copies of the build artifacts.
+
+Used by: build_comps.py (data.js), listings_build.py (listings.js),
+build_rental_data.py (rental_data.js), om_server.py (serving)
+
+publish_asset("listings.js") writes:
+  listings.<hash>.js            content-hashed copy (first 12 hex of SHA-256)
+  listings.<hash>.js.gz         gzip -9 variant (deterministic: no mtime/name)
+  listings.<hash>.js.br         brotli variant, when the brotli package is installed
+  listings.js.gz / .br          variants of the unhashed file for old links
+and records {"listings.js": "listings.<hash>.js"} in asset_manifest.json.
+om_server injects it into index.html as window.ASSET_MANIFEST (manifest_script).
+Static hosting (GitHub Pages / Netlify from the git tree) publishes none of
+these files, and the page falls back to the plain ?v= names there.
+
+Hashed files never change, so om_server sends them with an immutable
+one-year Cache-Control. The manifest, the HTML and unhashed names stay
+no-cache. The previous hashed copy of each artifact is kept, so a page
+holding the old manifest can still load it. Older copies are deleted.
+"""
+import glob, gzip, hashlib, json, os, re
+
+MANIFEST_FILE = "asset_manifest.json"
+MANIFEST_MARKER = b"<!-- ASSET_MANIFEST -->"  # Placeholder in index.html
+HASH_LEN = 12
+HASHED_RE = re.compile(r"\.[0-9a-f]{%d}\.(?:js|json)$" % HASH_LEN)  # om_server: immutable assets
+BROTLI_QUALITY = 9  # 11 is ~10x slower on a 25 MB data.js for a few % smaller
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def compress_variants(data):
+    """{".gz": gzip bytes, ".br": brotli bytes (if available)} for data."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def write_compressed(path, data=None, variants=None):
+    """Write path.gz (and path.br if brotli is available). Returns the variant paths written.
+
+    Pass variants (from compress_variants) to reuse buffers already compressed.
+    """
+    if variants is None:
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        variants = compress_variants(data)
+    written = []
+    for ext, buf in variants.items():
+        _write_atomic(path + ext, buf)
+        written.append(path + ext)
+    return written
+
+
+def hashed_name(path, data):
+    """listings.js + content → listings.<sha256[:12]>.js"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LEN]}{ext}"
+
+
+def load_manifest(directory="."):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {}
+
+
+def _write_manifest(manifest, directory="."):
+    _write_atomic(os.path.join(directory, MANIFEST_FILE),
+                  json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+def manifest_script(directory="."):
+    """<script> setting window.ASSET_MANIFEST for a page in directory, or b"" without a manifest."""
+    manifest = load_manifest(directory)
+    if not manifest:
+        return b""
+    body = json.dumps(manifest, sort_keys=True, separators=(",", ":")).replace("</", "<\\/")
+    return ("<script>window.ASSET_MANIFEST=" + body + ";</script>").encode()
+
+
+def _prune(path, keep):
+    """Delete hashed copies of path (and their variants) not in keep."""
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"\.[0-9a-f]{%d}" % HASH_LEN + re.escape(ext) + r"(?:\.gz|\.br)?$")
+    for f in glob.glob(f"{stem}.*{ext}*"):
+        name = os.path.basename(f)
+        if pattern.match(name) and name.split(ext)[0] + ext not in keep:
+            os.remove(f)
+
+
+def publish_asset(path):
+    """Hash, precompress and register a freshly written artifact. Returns the hashed filename."""
+    with open(path, "rb") as f:
+        data = f.read()
+    hashed = hashed_name(path, data)
+    if not os.path.exists(hashed):
+        _write_atomic(hashed, data)
+    variants = compress_variants(data)  # Same bytes under both names: compress once
+    write_compressed(hashed, variants=variants)
+    write_compressed(path, variants=variants)
+
+    directory = os.path.dirname(path) or "."
+    manifest = load_manifest(directory)
+    key = os.path.basename(path)
+    previous = manifest.get(key)
+    manifest[key] = os.path.basename(hashed)
+    _write_manifest(manifest, directory)
+    _prune(path, {os.path.basename(hashed), previous})
+    return hashed
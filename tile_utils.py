@@ -1,8 +1,24 @@
 """
 tile_utils.py — Shared geographic tiling utilities for Redfin fetchers.
 
-Used by: fetch_listings.py, fetch_sold_comps.py, fetch_rental_comps.py
+Used by: fetch_listings.py, fetch_sold_comps.py, fetch_rental_comps.py,
+and the --tiles output of listings_build.py, build_comps.py,
+build_rental_data.py (write_tiles)
+
+fetch_listings.py / fetch_sold_comps.py fetch tiles concurrently through
+run_tiles(): a small worker pool behind one shared RateLimiter (token
+bucket). Tiles that hit the cap queue their quadrants instead of recursing.
+After a successful run they save the final leaf tiling with per-leaf row
+counts (save_leaves). The next run starts from it (plan_tiles), so dense
+areas do not spend a capped request at every depth again.
+
+Tiles finish in whatever order the workers get to them, so the fetchers
+buffer each leaf's rows and ingest them sorted by tile_order(). The CSV row
+order, and which copy of a duplicate is kept, then don't depend on timing.
 """
+import json, os, shutil, sys, threading, time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 def build_grid(market):
@@ -64,3 +80,255 @@ def tile_label(t):
 def tile_key(t):
     """Stable string key for checkpoint tracking."""
     return f"{t['lat_min']},{t['lat_max']},{t['lng_min']},{t['lng_max']}"
+
+
+def tile_order(t):
+    """Sort key for ingesting tile results in a fixed order (south-west corner first)."""
+    return (t["lat_min"], t["lng_min"], t["lat_max"], t["lng_max"])
+
+
+LEAF_MERGE_FILL = 0.5   # Merge 4 sibling leaves whose rows total ≤ this × cap
+LEAF_SPLIT_FILL = 0.9   # Pre-split a leaf whose rows reached this × cap
+
+
+def _grid_signature(market):
+    return {k: market[k] for k in ("lat_min", "lat_max", "lng_min", "lng_max", "tile_lat", "tile_lng")}
+
+
+def leaf_record(tile, rows):
+    """Leaf entry for save_leaves: the tile's bounds and depth plus the rows it returned."""
+    return {"lat_min": tile["lat_min"], "lat_max": tile["lat_max"], "lng_min": tile["lng_min"],
+            "lng_max": tile["lng_max"], "depth": tile.get("depth", 0), "rows": rows}
+
+
+def save_leaves(path, market, leaves):
+    """Persist a finished run's leaf tiles ({lat_min, lat_max, lng_min, lng_max, depth, rows})."""
+    with open(path + ".tmp", "w") as f:
+        json.dump({"grid": _grid_signature(market), "leaves": leaves}, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def plan_tiles(market, path, cap, max_depth):
+    """Initial tiles for a fetch: the previous run's leaf tiling, else build_grid(market).
+
+    Leaves are rebuilt top-down from the grid with subdivide_tile, so tile
+    coordinates match the fetchers exactly and the grid is always fully
+    covered (any part the file does not describe is fetched as its grid
+    tile or quadrant). Four sibling leaves whose rows total at most
+    LEAF_MERGE_FILL × cap are merged into their parent, repeatedly. A leaf at
+    LEAF_SPLIT_FILL × cap or more starts out as its 4 quadrants.
+    Returns (tiles, stats).
+    """
+    grid = build_grid(market)
+    stats = {"source": "grid", "merged": 0, "split": 0}
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return grid, stats
+    if saved.get("grid") != _grid_signature(market):
+        return grid, stats
+
+    # Leaf rows by key, plus the key of every ancestor on the way down to each leaf
+    tile_grid = TileGrid(market)
+    rows_by_key, inner = {}, set()
+    for leaf in saved.get("leaves", []):
+        lat = (leaf["lat_min"] + leaf["lat_max"]) / 2
+        lng = (leaf["lng_min"] + leaf["lng_max"]) / 2
+        t = tile_grid.by_index.get(tile_grid.index(lat, lng))
+        path_keys = []
+        while t is not None and t["depth"] < leaf["depth"]:
+            path_keys.append(tile_key(t))
+            t = next(c for c in subdivide_tile(t)
+                     if c["lat_min"] <= lat <= c["lat_max"] and c["lng_min"] <= lng <= c["lng_max"])
+        if t is None or tile_key(t) != tile_key(leaf):
+            continue  # Not reachable from this grid
+        rows_by_key[tile_key(t)] = leaf["rows"]
+        inner.update(path_keys)
+    if not rows_by_key:
+        return grid, stats
+
+    def expand(t):
+        """[(tile, rows or None)] covering t."""
+        key = tile_key(t)
+        if key in rows_by_key:
+            rows = rows_by_key[key]
+            if rows >= LEAF_SPLIT_FILL * cap and t["depth"] < max_depth:
+                stats["split"] += 1
+                return [(c, None) for c in subdivide_tile(t)]
+            return [(t, rows)]
+        if key not in inner or t["depth"] >= max_depth:
+            return [(t, None)]
+        parts = [p for c in subdivide_tile(t) for p in expand(c)]
+        if len(parts) == 4 and all(r is not None for _, r in parts):
+            total = sum(r for _, r in parts)
+            if total <= LEAF_MERGE_FILL * cap:
+                stats["merged"] += 1
+                return [(t, total)]
+        return parts
+
+    tiles = [t for g in grid for t, _ in expand(g)]
+    stats["source"] = "leaves"
+    return tiles, stats
+
+
+class RateLimiter:
+    """Token bucket shared by all fetch workers, with a shared throttle backoff.
+
+    acquire() blocks until a token is free (`rate` per second, at most `burst`
+    banked) and any backoff() pause has passed. One worker seeing a 429/403
+    pauses the whole pool, so a throttle is not hit again by the other workers.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._pause_until:
+                    delay = self._pause_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def backoff(self, seconds):
+        """Pause every worker for at least `seconds` (overlapping pauses don't stack)."""
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+
+def scheduler_settings(argv=None):
+    """(workers, rate) from --workers N / --rate R, defaulting to REDFIN_WORKERS / REDFIN_RATE."""
+    from market_config import REDFIN_WORKERS, REDFIN_RATE
+    argv = sys.argv if argv is None else argv
+    workers, rate = REDFIN_WORKERS, REDFIN_RATE
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--workers":
+            workers = max(1, int(argv[i + 1]))
+        elif arg == "--rate":
+            rate = float(argv[i + 1])
+    return workers, rate
+
+
+def run_tiles(tiles, fetch, handle, workers=1):
+    """Fetch tiles on a worker pool and handle each result on the calling thread.
+
+    fetch(tile) runs in a worker thread. handle(tile, result) runs on the
+    calling thread in completion order, so it can update shared state
+    without locks. It returns child tiles to queue (e.g. the quadrants of a
+    capped tile) or nothing. Returns once the queue drains.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        pending = {pool.submit(fetch, t): t for t in tiles}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                tile = pending.pop(fut)
+                for child in handle(tile, fut.result()) or ():
+                    pending[pool.submit(fetch, child)] = child
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)  # Ctrl-C: drop queued tiles, finish in-flight ones
+
+
+class TileGrid:
+    """Point → tile lookup over the fixed build_grid(market) tiles.
+
+    Rows/cols come from the grid's own (rounded) tile edges, so a point lands
+    in the same tile the fetchers query. Points outside the market box are
+    clamped to the edge tiles.
+    """
+
+    def __init__(self, market):
+        self.tiles = build_grid(market)
+        self.lat_edges = sorted({t["lat_min"] for t in self.tiles})
+        self.lng_edges = sorted({t["lng_min"] for t in self.tiles})
+        self.by_index = {
+            (self.lat_edges.index(t["lat_min"]), self.lng_edges.index(t["lng_min"])): t for t in self.tiles
+        }
+
+    def index(self, lat, lng):
+        """(row, col) of the tile containing (lat, lng)."""
+        row = min(max(bisect_right(self.lat_edges, lat) - 1, 0), len(self.lat_edges) - 1)
+        col = min(max(bisect_right(self.lng_edges, lng) - 1, 0), len(self.lng_edges) - 1)
+        return row, col
+
+
+def write_tiles(out_dir, records, market, meta=None, extra=None):
+    """Split records (dicts with lat/lng) into per-tile JSON shards under out_dir.
+
+    Writes <row>_<col>.json per non-empty tile plus manifest.json:
+      {"grid": {...}, "count": N, "meta": {...},
+       "tiles": [{"id", "file", "count", "bounds": [lat_min, lng_min, lat_max, lng_max],
+                  "extent": [min lat, min lng, max lat, max lng of its records]}, ...],
+       "files": {name: file}}   # extra whole-market files (e.g. clusters.json)
+    Records keep their input order within a tile. Shards are written to
+    <out_dir>.tmp and swapped in with renames (the old directory is moved
+    aside, then deleted), so stale shards never survive a rebuild and a crash
+    mid-swap still leaves the old tiles in <out_dir>.old. Returns the manifest.
+    """
+    grid = TileGrid(market)
+    shards = {}
+    for r in records:
+        shards.setdefault(grid.index(r["lat"], r["lng"]), []).append(r)
+
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    tiles = []
+    for (row, col) in sorted(shards):
+        recs = shards[(row, col)]
+        t = grid.by_index.get((row, col)) or {
+            "lat_min": grid.lat_edges[row], "lat_max": grid.lat_edges[row] + market["tile_lat"],
+            "lng_min": grid.lng_edges[col], "lng_max": grid.lng_edges[col] + market["tile_lng"],
+        }
+        tile_id = f"{row}_{col}"
+        with open(os.path.join(tmp_dir, tile_id + ".json"), "w") as f:
+            json.dump(recs, f, separators=(",", ":"))
+        lats = [r["lat"] for r in recs]
+        lngs = [r["lng"] for r in recs]
+        tiles.append({
+            "id": tile_id,
+            "file": tile_id + ".json",
+            "count": len(recs),
+            "bounds": [t["lat_min"], t["lng_min"], t["lat_max"], t["lng_max"]],
+            "extent": [min(lats), min(lngs), max(lats), max(lngs)],
+        })
+    files = {}
+    for name, value in (extra or {}).items():
+        files[name] = name + ".json"
+        with open(os.path.join(tmp_dir, files[name]), "w") as f:
+            json.dump(value, f, separators=(",", ":"))
+
+    manifest = {
+        "grid": {
+            "lat_min": market["lat_min"], "lng_min": market["lng_min"],
+            "tile_lat": market["tile_lat"], "tile_lng": market["tile_lng"],
+            "rows": len(grid.lat_edges), "cols": len(grid.lng_edges),
+        },
+        "count": len(records),
+        "meta": meta or {},
+        "tiles": tiles,
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    old_dir = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest